@@ -1,38 +1,388 @@
-import asyncio
+import codecs
+import functools
+import hashlib
+import io
 import re
 import os
 import html
+import json
+import logging
 import threading
+import time
 import subprocess
-import sys
-from flask import Flask, render_template, request, jsonify, send_file
-import edge_tts
-import tempfile
+import uuid
+import zipfile
+from flask import Flask, Response, has_request_context, render_template, request, jsonify, send_file
+from collections import deque
 from datetime import datetime
+from concurrent.futures import CancelledError, Future
+from flask import Request
+from werkzeug.exceptions import HTTPException
+from werkzeug.wsgi import ClosingIterator
+from tts_backends import create_backend, is_permanent_error
+from rate_limiter import AdaptiveRateLimiter, is_throttling_error
+from segment_cache import SegmentCache, make_key
+from voice_catalog import VoiceCatalog
+from preview_store import PreviewStore, PREVIEW_TEXT
+from job_store import JobStore, JobExists, ACTIVE_STATUSES
+from job_runner import JobRunner
+from spool import Spool, SpoolFull
+from request_gate import RequestGate
+from single_flight import SingleFlight
+from scheduler import FairScheduler, RetryLater, SchedulerFull, Ticket
+import mp3_concat
+from logging_setup import configure_logging
+from metrics import Registry, CONTENT_TYPE as METRICS_CONTENT_TYPE
 
-# Setup ffmpeg path for pydub
-try:
-    import imageio_ffmpeg
-    ffmpeg_path = imageio_ffmpeg.get_ffmpeg_exe()
-    from pydub import AudioSegment
-    from pydub.utils import which
-    AudioSegment.converter = ffmpeg_path
-    AudioSegment.ffmpeg = ffmpeg_path
-    AudioSegment.ffprobe = ffmpeg_path  # ffprobe is included in same binary
-    print(f"Using bundled ffmpeg: {ffmpeg_path}")
-    
-    # Also set environment variable for pydub
-    os.environ["PATH"] = os.path.dirname(ffmpeg_path) + os.pathsep + os.environ.get("PATH", "")
-except Exception as e:
-    print(f"Warning: ffmpeg setup failed: {e}")
+class TTSRequest(Request):
+    """Request whose body limit is raised for manuscript uploads, which are streamed to disk"""
+
+    @property
+    def max_content_length(self):
+        if self.endpoint == 'upload_job':
+            return app.config['UPLOAD_MAX_BYTES']
+        return super().max_content_length
 
 app = Flask(__name__)
+app.request_class = TTSRequest
+# Logging: TTS_LOG_LEVEL (DEBUG shows every segment) and TTS_LOG_FORMAT=text|json
+app.config['LOG_LEVEL'] = os.environ.get('TTS_LOG_LEVEL', 'INFO')
+app.config['LOG_FORMAT'] = os.environ.get('TTS_LOG_FORMAT', 'text')
+configure_logging(app.config['LOG_LEVEL'], app.config['LOG_FORMAT'])
+logger = logging.getLogger('app')
+
+# Heavy optional dependencies (ffmpeg lookup, numpy) load on first use, or in the
+# background warm-up below, so importing the app and answering /healthz stays fast.
+# TTS_WARMUP=0 skips the warm-up; /readyz then reports ready once the job store answers.
+app.config['WARMUP'] = os.environ.get('TTS_WARMUP', '1') == '1'
+
+@functools.lru_cache(maxsize=None)
+def ffmpeg_exe():
+    """Path of the bundled ffmpeg binary, located once on first use"""
+    import imageio_ffmpeg
+    path = imageio_ffmpeg.get_ffmpeg_exe()
+    logger.info("Using bundled ffmpeg: %s", path)
+    return path
+
+@functools.lru_cache(maxsize=None)
+def load_postprocess():
+    """The postprocess module, or None when numpy is not installed"""
+    try:
+        import postprocess
+    except ImportError:  # numpy is optional; post-processing is then unavailable
+        return None
+    return postprocess
+
+# Serving: TTS_WORKERS is the number of server processes sharing the upstream
+# budget (set by serve.py); TTS_DEBUG=1 enables Flask debug mode for `python app.py`
+app.config['WORKERS'] = max(1, int(os.environ.get('TTS_WORKERS', 1)))
+app.config['DEBUG_SERVER'] = os.environ.get('TTS_DEBUG', '0') == '1'
+# Slow requests admitted at once per process: sync generation/batches and SSE streams.
+# A request waits up to TTS_HEAVY_WAIT seconds for a slot, then gets 503.
+app.config['HEAVY_REQUESTS'] = int(os.environ.get('TTS_HEAVY_REQUESTS', 4))
+app.config['HEAVY_WAIT'] = float(os.environ.get('TTS_HEAVY_WAIT', 5))
+app.config['EVENT_STREAMS'] = int(os.environ.get('TTS_EVENT_STREAMS', 32))
+# Request threads serve.py keeps free for cheap endpoints on top of the gated ones
+app.config['SERVER_SPARE_THREADS'] = int(os.environ.get('TTS_SERVER_SPARE_THREADS', 8))
+
 # Configuration for handling large texts
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max request size
 app.config['JSON_AS_ASCII'] = False  # Support non-ASCII characters
 
-# Progress tracking for generation tasks
-progress_tracker = {}
+# Manuscript uploads (/api/jobs/upload): segments in flight per job; the size cap
+# (UPLOAD_MAX_BYTES) follows from the spool quota below
+app.config['UPLOAD_WINDOW'] = int(os.environ.get('TTS_UPLOAD_WINDOW', 16))
+
+# Batch synthesis limits (/api/batch)
+app.config['BATCH_MAX_DOCUMENTS'] = int(os.environ.get('TTS_BATCH_MAX_DOCUMENTS', 500))
+app.config['BATCH_MAX_TEXT_BYTES'] = int(os.environ.get('TTS_BATCH_MAX_TEXT_BYTES', 10 * 1024 * 1024))
+
+# Synthesis backend and the knobs of the offline fake backend
+app.config['TTS_BACKEND'] = os.environ.get('TTS_BACKEND', 'edge')
+app.config['FAKE_LATENCY'] = float(os.environ.get('TTS_FAKE_LATENCY', 0.05))
+app.config['FAKE_PER_CHAR'] = float(os.environ.get('TTS_FAKE_PER_CHAR', 0.0))
+app.config['FAKE_JITTER'] = float(os.environ.get('TTS_FAKE_JITTER', 0.0))
+app.config['FAKE_THROTTLE_RATE'] = float(os.environ.get('TTS_FAKE_THROTTLE_RATE', 0.0))
+app.config['FAKE_FAILURE_RATE'] = float(os.environ.get('TTS_FAKE_FAILURE_RATE', 0.0))
+app.config['FAKE_SEED'] = int(os.environ.get('TTS_FAKE_SEED', 0))
+# Warm WebSocket connections kept to the Edge service. Off (0, one connection per
+# segment through edge_tts) until the pooled client is measured against the live service
+app.config['EDGE_POOL_SIZE'] = int(os.environ.get('TTS_EDGE_POOL_SIZE', 0))
+app.config['EDGE_POOL_IDLE'] = float(os.environ.get('TTS_EDGE_POOL_IDLE', 30))
+# Synthesis endpoint for the pooled client, e.g. a local edge_standin.py
+app.config['EDGE_URL'] = os.environ.get('TTS_EDGE_URL')
+
+# Adaptive rate limiter settings (shared by every synthesis call in the process)
+app.config['RATE_LIMIT_RPS'] = float(os.environ.get('TTS_RATE_LIMIT_RPS', 2.0))
+app.config['RATE_LIMIT_MIN_RPS'] = float(os.environ.get('TTS_RATE_LIMIT_MIN_RPS', 0.25))
+app.config['RATE_LIMIT_MAX_RPS'] = float(os.environ.get('TTS_RATE_LIMIT_MAX_RPS', 8.0))
+app.config['RATE_LIMIT_BURST'] = int(os.environ.get('TTS_RATE_LIMIT_BURST', 3))
+app.config['SYNTH_CONCURRENCY'] = int(os.environ.get('TTS_CONCURRENCY', 2))
+app.config['SYNTH_MAX_CONCURRENCY'] = int(os.environ.get('TTS_MAX_CONCURRENCY', 6))
+app.config['SYNTH_THROTTLE_COOLDOWN'] = float(os.environ.get('TTS_THROTTLE_COOLDOWN', 5.0))
+app.config['SYNTH_MAX_RETRIES'] = int(os.environ.get('TTS_MAX_RETRIES', 10))
+
+# Fair scheduling of synthesis work between priority classes and clients.
+# Jobs of up to SCHED_SHORT_SEGMENTS segments are 'short', longer ones 'bulk'.
+app.config['SCHED_SHORT_SEGMENTS'] = int(os.environ.get('TTS_SHORT_JOB_SEGMENTS', 8))
+app.config['SCHED_CLIENT_CONCURRENCY'] = int(os.environ.get('TTS_CLIENT_CONCURRENCY', 4))
+app.config['SCHED_CLIENT_QUEUE'] = int(os.environ.get('TTS_CLIENT_QUEUE', 2000))
+app.config['SCHED_QUEUE'] = int(os.environ.get('TTS_SCHED_QUEUE', 20000))
+app.config['SCHED_INTERACTIVE_WORKERS'] = int(os.environ.get('TTS_INTERACTIVE_WORKERS', 1))
+app.config['PREVIEW_TIMEOUT'] = float(os.environ.get('TTS_PREVIEW_TIMEOUT', 60))
+
+# Planning: adjacent segments with the same emotion are merged into requests of up to this size
+app.config['PLAN_MAX_CHARS'] = int(os.environ.get('TTS_PLAN_MAX_CHARS', 1000))
+
+# Rendered segment cache (set TTS_CACHE_MAX_BYTES=0 to disable)
+app.config['SEGMENT_CACHE_DIR'] = os.environ.get(
+    'TTS_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'segments'))
+app.config['SEGMENT_CACHE_MAX_BYTES'] = int(os.environ.get('TTS_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+# Voice catalog snapshot, refreshed in the background once older than the TTL
+app.config['VOICE_CATALOG_PATH'] = os.environ.get(
+    'TTS_VOICE_CATALOG_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'voices.json'))
+app.config['VOICE_CATALOG_TTL'] = float(os.environ.get('TTS_VOICE_CATALOG_TTL', 24 * 3600))
+
+# Voice previews are rendered once and kept; optionally pre-warm some locales
+app.config['PREVIEW_CACHE_DIR'] = os.environ.get(
+    'TTS_PREVIEW_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'previews'))
+app.config['PREVIEW_CACHE_MAX_BYTES'] = int(os.environ.get('TTS_PREVIEW_MAX_BYTES', 64 * 1024 * 1024))
+app.config['PREVIEW_MEMORY_BYTES'] = int(os.environ.get('TTS_PREVIEW_MEMORY_BYTES', 8 * 1024 * 1024))
+app.config['PREVIEW_WARM_LOCALES'] = os.environ.get('TTS_PREVIEW_WARM_LOCALES', '')
+
+# Durable job store (progress, per-segment status, results) and background workers
+app.config['JOB_DB_PATH'] = os.environ.get(
+    'TTS_JOB_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'jobs.sqlite3'))
+app.config['JOB_DIR'] = os.environ.get(
+    'TTS_JOB_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'jobs'))
+app.config['JOB_WORKERS'] = int(os.environ.get('TTS_JOB_WORKERS', 2))
+app.config['JOB_RETENTION'] = float(os.environ.get('TTS_JOB_RETENTION', 24 * 3600))
+app.config['JOB_STALE_AFTER'] = float(os.environ.get('TTS_JOB_STALE_AFTER', 60))
+
+# Spool: JOB_DIR holds one directory per job; quota, TTL and post-delivery grace
+app.config['SPOOL_MAX_BYTES'] = int(os.environ.get('TTS_SPOOL_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+app.config['SPOOL_TTL'] = float(os.environ.get('TTS_SPOOL_TTL', app.config['JOB_RETENTION']))
+app.config['SPOOL_DELIVERED_GRACE'] = float(os.environ.get('TTS_SPOOL_DELIVERED_GRACE', 600))
+app.config['SPOOL_SWEEP_INTERVAL'] = float(os.environ.get('TTS_SPOOL_SWEEP_INTERVAL', 60))
+
+# edge-tts output is 48 kbps (6 KB/s) and speech runs at roughly 15 characters/s
+AUDIO_BYTES_PER_CHAR = 400
+# Largest manuscript whose text and audio fit in the spool; TTS_UPLOAD_MAX_BYTES may lower it
+upload_fits = app.config['SPOOL_MAX_BYTES'] // (AUDIO_BYTES_PER_CHAR + 1)
+app.config['UPLOAD_MAX_BYTES'] = min(int(os.environ.get('TTS_UPLOAD_MAX_BYTES', upload_fits)), upload_fits)
+
+# NumPy post-processing (per-emotion volume, crossfades, trimming, loudness);
+# TTS_POSTPROCESS=1 turns it on by default, requests can set "postprocess"
+app.config['POSTPROCESS'] = os.environ.get('TTS_POSTPROCESS', '0') == '1'
+app.config['POSTPROCESS_CROSSFADE_MS'] = float(os.environ.get('TTS_POSTPROCESS_CROSSFADE_MS', 15))
+app.config['POSTPROCESS_TRIM'] = os.environ.get('TTS_POSTPROCESS_TRIM', '1') == '1'
+app.config['POSTPROCESS_TRIM_DB'] = float(os.environ.get('TTS_POSTPROCESS_TRIM_DB', -50))
+app.config['POSTPROCESS_KEEP_SILENCE_MS'] = float(os.environ.get('TTS_POSTPROCESS_KEEP_SILENCE_MS', 120))
+# Target RMS level in dBFS; 'off' keeps the synthesized loudness
+app.config['POSTPROCESS_TARGET_DBFS'] = os.environ.get('TTS_POSTPROCESS_TARGET_DBFS', '-20')
+
+def worker_share(value, minimum=1):
+    """This process's share of a budget configured for the whole server"""
+    return max(minimum, value // app.config['WORKERS'])
+
+# Synthesis backend shared by all requests: 'edge' (online, the default) or
+# 'fake' (offline silent MP3 with simulated latency/throttling, for load tests)
+if app.config['TTS_BACKEND'] == 'fake':
+    backend = create_backend(
+        'fake',
+        latency=app.config['FAKE_LATENCY'],
+        per_char=app.config['FAKE_PER_CHAR'],
+        jitter=app.config['FAKE_JITTER'],
+        throttle_rate=app.config['FAKE_THROTTLE_RATE'],
+        failure_rate=app.config['FAKE_FAILURE_RATE'],
+        seed=app.config['FAKE_SEED'],
+    )
+elif app.config['TTS_BACKEND'] == 'edge':
+    backend = create_backend(
+        'edge',
+        pool_size=app.config['EDGE_POOL_SIZE'],
+        pool_idle=app.config['EDGE_POOL_IDLE'],
+        url=app.config['EDGE_URL'],
+    )
+else:
+    backend = create_backend(app.config['TTS_BACKEND'])
+logger.info("Synthesis backend: %s", backend.name)
+
+# Every worker process has its own limiter, so each gets an equal share of the upstream budget
+limiter = AdaptiveRateLimiter(
+    rate=app.config['RATE_LIMIT_RPS'] / app.config['WORKERS'],
+    min_rate=app.config['RATE_LIMIT_MIN_RPS'] / app.config['WORKERS'],
+    max_rate=app.config['RATE_LIMIT_MAX_RPS'] / app.config['WORKERS'],
+    burst=worker_share(app.config['RATE_LIMIT_BURST']),
+    concurrency=worker_share(app.config['SYNTH_CONCURRENCY']),
+    max_concurrency=worker_share(app.config['SYNTH_MAX_CONCURRENCY']),
+    cooldown=app.config['SYNTH_THROTTLE_COOLDOWN'],
+)
+# Worker threads that wait on the limiter and the backend for each segment, taking
+# segments in fair priority order; some are kept free for previews
+scheduler = FairScheduler(
+    workers=worker_share(app.config['SYNTH_MAX_CONCURRENCY']),
+    reserved=app.config['SCHED_INTERACTIVE_WORKERS'],
+    client_limit=worker_share(app.config['SCHED_CLIENT_CONCURRENCY']),
+    client_queue_limit=app.config['SCHED_CLIENT_QUEUE'],
+    queue_limit=worker_share(app.config['SCHED_QUEUE']),
+)
+
+heavy_gate = RequestGate('heavy', app.config['HEAVY_REQUESTS'], wait=app.config['HEAVY_WAIT'])
+event_gate = RequestGate('events', app.config['EVENT_STREAMS'])
+
+segment_cache = SegmentCache(app.config['SEGMENT_CACHE_DIR'], app.config['SEGMENT_CACHE_MAX_BYTES'],
+                             workers=app.config['WORKERS'])
+# Identical segments being synthesized right now, by cache key
+segment_flights = SingleFlight()
+
+voice_catalog = VoiceCatalog(
+    app.config['VOICE_CATALOG_PATH'],
+    app.config['VOICE_CATALOG_TTL'],
+    fetch=backend.list_voices,
+)
+# Serve from the on-disk snapshot right away; refresh it if missing or stale
+if not voice_catalog.load_snapshot() or voice_catalog.age > voice_catalog.ttl:
+    voice_catalog.refresh_in_background()
+
+preview_store = PreviewStore(
+    SegmentCache(app.config['PREVIEW_CACHE_DIR'], app.config['PREVIEW_CACHE_MAX_BYTES'],
+                 workers=app.config['WORKERS']),
+    render=lambda voice: render_preview(voice),
+    memory_bytes=app.config['PREVIEW_MEMORY_BYTES'],
+)
+
+# Progress tracking for generation tasks lives in the job store
+job_store = JobStore(app.config['JOB_DB_PATH'])
+job_runner = JobRunner(
+    job_store,
+    run_job=lambda job_id: run_job(job_id),
+    workers=app.config['JOB_WORKERS'],
+    stale_after=app.config['JOB_STALE_AFTER'],
+    retention=app.config['JOB_RETENTION'],
+    on_purge=lambda job: remove_job_files(job['id']),
+)
+
+def job_is_active(job_id):
+    job = job_store.get_job(job_id)
+    return job is not None and job['status'] in ACTIVE_STATUSES
+
+spool = Spool(
+    app.config['JOB_DIR'],
+    max_bytes=app.config['SPOOL_MAX_BYTES'],
+    ttl=app.config['SPOOL_TTL'],
+    delivered_grace=app.config['SPOOL_DELIVERED_GRACE'],
+    sweep_interval=app.config['SPOOL_SWEEP_INTERVAL'],
+    is_active=job_is_active,
+    is_known=lambda job_id: job_store.get_job(job_id) is not None,
+)
+
+# Metrics exported at /metrics
+metrics = Registry()
+parse_seconds = metrics.histogram('tts_parse_seconds', 'Time to parse and plan a document')
+synthesis_seconds = metrics.histogram(
+    'tts_segment_synthesis_seconds', 'Backend latency per synthesis attempt', labels=('outcome',))
+retries_total = metrics.counter('tts_segment_retries_total', 'Segment retries', labels=('cause',))
+rate_limit_wait_seconds = metrics.histogram(
+    'tts_rate_limit_wait_seconds', 'Time spent waiting on the rate limiter per attempt')
+retry_sleep_seconds = metrics.counter('tts_retry_sleep_seconds_total', 'Time segments waited out retry backoff')
+segments_total = metrics.counter('tts_segments_total', 'Segments completed', labels=('source',))
+concat_seconds = metrics.histogram('tts_concat_seconds', 'Time to join segment audio', labels=('method',))
+postprocess_seconds = metrics.histogram('tts_postprocess_seconds', 'Time to decode, post-process and encode audio')
+output_bytes = metrics.counter('tts_output_bytes_total', 'Audio bytes produced', labels=('endpoint',))
+jobs_total = metrics.counter('tts_jobs_total', 'Finished jobs', labels=('kind', 'status'))
+job_seconds = metrics.histogram(
+    'tts_job_duration_seconds', 'Job wall time from creation to finish', labels=('kind',),
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800))
+metrics.gauge('tts_job_queue_depth', 'Background jobs waiting for a worker',
+              callback=lambda: job_runner.queue_depth)
+metrics.gauge('tts_jobs_in_flight', 'Jobs running in this process', labels=('kind',),
+              callback=lambda: {(kind,): n for kind, n in job_store.running_counts(job_runner.worker_id).items()})
+metrics.gauge('tts_synthesis_in_flight', 'Segments currently held by the rate limiter',
+              callback=lambda: limiter.snapshot()['in_flight'])
+metrics.gauge('tts_rate_limit_rps', 'Current adaptive request rate', callback=lambda: limiter.snapshot()['rate'])
+metrics.gauge('tts_segment_cache_bytes', 'Bytes in the segment cache',
+              callback=lambda: segment_cache.stats()['bytes'])
+metrics.gauge('tts_gate_in_use', 'Slow requests holding a server thread', labels=('gate',),
+              callback=lambda: {(gate.name,): gate.in_use for gate in (heavy_gate, event_gate)})
+gate_rejections = metrics.counter('tts_gate_rejected_total', 'Slow requests turned away with 503',
+                                  labels=('gate',))
+coalesced_total = metrics.counter('tts_coalesced_total', 'Requests attached to identical in-flight work',
+                                  labels=('level',))
+scheduler_wait_seconds = metrics.histogram(
+    'tts_scheduler_wait_seconds', 'Time a segment waited for a synthesis worker', labels=('priority',))
+scheduler.on_wait = lambda priority, waited: scheduler_wait_seconds.observe(waited, priority=priority)
+metrics.gauge('tts_scheduler_queued', 'Segments waiting for a synthesis worker', labels=('priority',),
+              callback=lambda: {(p,): n for p, n in scheduler.stats()['queued'].items()})
+scheduler_rejections = metrics.counter('tts_scheduler_rejected_total', 'Requests turned away with 429')
+metrics.gauge('tts_upstream_pool', 'Pooled upstream connections: size, idle, opened, reused, discarded',
+              labels=('stat',), callback=lambda: {(k,): v for k, v in backend.stats().get('pool', {}).items()})
+metrics.gauge('tts_spool_bytes', 'Bytes of job audio in the spool', callback=lambda: spool.usage()['bytes'])
+metrics.gauge('tts_ready', '1 once the warm-up has finished and the process serves synthesis',
+              callback=lambda: int(readiness()[0]))
+
+def gated(gate):
+    """Admit a view through gate; the slot is held until the response is fully sent"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not gate.acquire():
+                gate_rejections.inc(gate=gate.name)
+                response = jsonify({'error': 'Server busy, retry shortly or use /api/jobs',
+                                    'retry_after': 5})
+                response.status_code = 503
+                response.headers['Retry-After'] = '5'
+                return response
+            try:
+                response = app.make_response(view(*args, **kwargs))
+            except BaseException:
+                gate.release()
+                raise
+            # Streamed bodies keep the thread busy until the server closes the response.
+            # send_file bodies are passed through untouched, so call_on_close would never run.
+            if response.direct_passthrough:
+                response.response = ClosingIterator(response.response, gate.release)
+            else:
+                response.call_on_close(gate.release)
+            return response
+        return wrapper
+    return decorator
+
+def client_id():
+    """Who the current request is for, for fair scheduling: X-Client-Id or the remote address"""
+    return request.headers.get('X-Client-Id') or request.remote_addr or 'anonymous'
+
+def job_priority(total, kind):
+    """Scheduling class of a job: 'short' for a few segments, 'bulk' for documents and batches"""
+    if kind in ('batch', 'upload') or total > app.config['SCHED_SHORT_SEGMENTS']:
+        return 'bulk'
+    return 'short'
+
+def job_ticket(job):
+    return Ticket(job.get('client') or 'anonymous', job['id'], job_priority(job['total'], job['kind']))
+
+def scheduler_busy(client, count):
+    """A 429 response if count more segments from client should not be queued now, else None"""
+    # Background jobs wait in the job runner before their segments reach the scheduler
+    waiting = job_store.pending_segments(client, app.config['PLAN_MAX_CHARS'])
+    try:
+        scheduler.admit(client, count, rate=limiter.snapshot()['rate'], waiting=waiting)
+    except SchedulerFull as e:
+        scheduler_rejections.inc()
+        logger.info("Turned away %d segments from %s: %s", count, client, e)
+        response = jsonify({'error': f"{e}; retry later", 'retry_after': e.retry_after})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response
+    return None
+
+def record_finished_job(job):
+    jobs_total.inc(kind=job['kind'], status=job['status'])
+    if job['finished_at']:
+        job_seconds.observe(job['finished_at'] - job['created_at'], kind=job['kind'])
+
+job_store.on_finished = record_finished_job
 
 # Emotion to prosody mapping - Psycholinguistically calibrated values
 # Pitch: +1% ≈ 1-2Hz change from baseline (male: 120Hz, female: 220Hz)
@@ -54,30 +404,141 @@ EMOTION_PROSODY = {
     'storytelling': {'pitch': '+3%', 'rate': '-5%', 'volume': '+5dB'}   # Slight pitch variation, 5% slower (clarity), louder
 }
 
+# Boundaries used to split long text, from most to least preferred. Each match
+# ends a piece, so the separator stays attached to the text before it.
+SENTENCE_BOUNDARY = re.compile(r'[.!?…]+["\'”’)\]]*\s+|[。！？]+')
+CLAUSE_BOUNDARY = re.compile(r'[,;:]\s+|[，；：、]|\s+[—–-]+\s+')
+WORD_BOUNDARY = re.compile(r'\s+')
+SPLIT_BOUNDARIES = [SENTENCE_BOUNDARY, CLAUSE_BOUNDARY, WORD_BOUNDARY]
+
+# Every character besides whitespace that a boundary match can contain; a
+# run of these at the end of unfinished text may still become a boundary
+BOUNDARY_CHARS = frozenset('.!?…"\'”’)]。！？,;:，；：、—–-')
+
+def split_at_boundaries(text, boundary):
+    """Split text after every match of boundary, keeping separators"""
+    pieces = []
+    start = 0
+    for match in boundary.finditer(text):
+        if match.end() > start:
+            pieces.append(text[start:match.end()])
+            start = match.end()
+    if start < len(text):
+        pieces.append(text[start:])
+    return pieces
+
+class TextChunker:
+    """Split text into chunks of at most max_length characters as it arrives
+
+    feed() takes the next piece of text and close() ends it; both return the
+    chunks that are finished. Splits at sentence ends where possible, then at
+    clause boundaries, then between words, and only cuts inside a word as a
+    last resort. Leading and trailing whitespace of the whole text is ignored.
+    Only the unfinished chunk is held, and a piece too long for any chunk is
+    handed to a chunker for the next finer boundary while it is still growing.
+    """
+    def __init__(self, max_length=500, level=0):
+        self.max_length = max_length
+        self.level = level
+        self.started = False
+        self.spaces = ''   # trailing whitespace, dropped if nothing follows
+        self.pending = ''  # text of the piece not yet packed
+        self.current = ''  # pieces packed into the next chunk
+        self.child = None  # chunker for a piece longer than max_length
+
+    def feed(self, text):
+        if not self.started:
+            text = text.lstrip()
+            if not text:
+                return []
+            self.started = True
+        body = text.rstrip()
+        if not body:
+            self.spaces += text
+            return []
+        chunks = self._push(self.spaces + body)
+        self.spaces = text[len(body):]
+        return chunks
+
+    def close(self):
+        return self._push('', final=True)
+
+    def _push(self, text, final=False):
+        self.pending += text
+        if self.level >= len(SPLIT_BOUNDARIES):
+            size = len(self.pending) if final else len(self.pending) // self.max_length * self.max_length
+            chunks = [self.pending[i:i + self.max_length] for i in range(0, size, self.max_length)]
+            self.pending = self.pending[size:]
+            return chunks
+        
+        if self.child is None and len(self.current) + len(self.pending) <= self.max_length:
+            # Everything still fits in one chunk, so no boundary is needed yet
+            if not final:
+                return []
+            chunk = (self.current + self.pending).strip()
+            self.current = self.pending = ''
+            return [chunk] if chunk else []
+        
+        # A match that reaches the end of the text may still grow
+        chunks = []
+        start = 0
+        for match in SPLIT_BOUNDARIES[self.level].finditer(self.pending):
+            if match.end() >= len(self.pending) and not final:
+                break
+            chunks.extend(self._pack(self.pending[start:match.end()]))
+            start = match.end()
+        self.pending = self.pending[start:]
+        if final:
+            if self.pending or self.child is not None:
+                chunks.extend(self._pack(self.pending))
+                self.pending = ''
+            if self.current.strip():
+                chunks.append(self.current.strip())
+            self.current = ''
+            return chunks
+        
+        if self.child is None and len(self.pending.strip()) > self.max_length:
+            chunks.extend(self._flush())
+            self.child = TextChunker(self.max_length, self.level + 1)
+        if self.child is not None:
+            keep = len(self.pending)
+            while keep and (self.pending[keep - 1].isspace() or self.pending[keep - 1] in BOUNDARY_CHARS):
+                keep -= 1
+            chunks.extend(self.child.feed(self.pending[:keep]))
+            self.pending = self.pending[keep:]
+        return chunks
+
+    def _flush(self):
+        chunk = self.current.strip()
+        self.current = ''
+        return [chunk] if chunk else []
+
+    def _pack(self, piece):
+        """Add a finished piece, greedily packing pieces into chunks"""
+        if self.child is not None:
+            child, self.child = self.child, None
+            return child.feed(piece) + child.close()
+        if len(piece.strip()) > self.max_length:
+            chunks = self._flush()
+            child = TextChunker(self.max_length, self.level + 1)
+            return chunks + child.feed(piece) + child.close()
+        if self.current and len((self.current + piece).strip()) > self.max_length:
+            chunks = self._flush()
+            self.current = piece
+            return chunks
+        self.current += piece
+        return []
+
 def chunk_long_text(text, max_length=500):
-    """Split very long text segments into smaller chunks to avoid timeouts"""
+    """Split very long text segments into chunks of at most max_length characters
+    
+    Splits at sentence ends where possible, then at clause boundaries, then
+    between words, and only cuts inside a word as a last resort.
+    """
     if len(text) <= max_length:
         return [text]
-    
-    chunks = []
-    words = text.split()
-    current_chunk = []
-    current_length = 0
-    
-    for word in words:
-        word_length = len(word) + 1  # +1 for space
-        if current_length + word_length > max_length and current_chunk:
-            chunks.append(' '.join(current_chunk))
-            current_chunk = [word]
-            current_length = word_length
-        else:
-            current_chunk.append(word)
-            current_length += word_length
-    
-    if current_chunk:
-        chunks.append(' '.join(current_chunk))
-    
-    return chunks
+    chunker = TextChunker(max_length)
+    return chunker.feed(text) + chunker.close()
 
 def parse_text_with_emotions(text):
     """Parse text and extract emotion markers, return segments with emotions"""
@@ -141,34 +602,768 @@ def build_text_with_prosody_data(text):
     plain_text = ' '.join(text_parts)
     return plain_text, prosody_segments
 
+def segment_cache_key(segment, voice):
+    """Cache key for a prosody segment rendered with voice"""
+    prosody = segment['prosody']
+    return make_key(voice, segment['text'], prosody['rate'], prosody['pitch'], prosody['volume'])
+
+def job_fingerprint(voice, prosody_segments, postprocess=False):
+    """Hash of everything that determines a job's result, for coalescing identical jobs"""
+    keys = [segment_cache_key(segment, voice) for segment in prosody_segments]
+    payload = '\x1f'.join([voice, 'postprocess' if postprocess else 'plain'] + keys)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def synthesize_segment(idx, segment, voice, cache_key=None, job_id=None, stages=None, urgent=False, tries=None):
+    """Synthesize one prosody segment through the shared limiter, with retries
+    
+    Throttled attempts are retried as soon as the limiter allows. Errors no
+    retry can fix (a bad voice or input) fail at once. After any other error
+    this raises RetryLater, so the scheduler runs the segment again after a
+    backoff instead of a worker sleeping through it; tries is a dict that
+    counts attempts across those runs and must be passed again each time.
+    
+    With a job_id, retries and noticeable limiter waits are published as job
+    events. A stages dict collects rate_limit_wait_ms, synth_ms and
+    retry_sleep_ms for the job's timing breakdown. Urgent segments (previews)
+    get the next limiter slot ahead of queued job segments.
+    """
+    if stages is None:
+        stages = {}
+    if tries is None:
+        tries = {}
+    stages.setdefault('rate_limit_wait_ms', 0)
+    stages.setdefault('synth_ms', 0)
+    segment_text = segment['text']
+    rate = segment['prosody']['rate']
+    pitch = segment['prosody']['pitch']
+    emotion = segment['emotion']
+    max_retries = app.config['SYNTH_MAX_RETRIES']
+    last_error = None
+    
+    while tries.get('attempts', 0) < max_retries:
+        retry = tries.get('attempts', 0)
+        tries['attempts'] = retry + 1
+        waited = limiter.acquire(urgent=urgent)
+        rate_limit_wait_seconds.observe(waited)
+        stages['rate_limit_wait_ms'] += waited * 1000
+        if job_id and waited >= 0.5:
+            job_store.add_event(job_id, 'throttle_wait', index=idx, wait_ms=round(waited * 1000))
+        attempt_started = time.monotonic()
+        try:
+            audio = backend.synthesize(segment_text, voice, rate, pitch, segment['prosody']['volume'],
+                                       timeout=90)
+        except Exception as e:
+            elapsed = time.monotonic() - attempt_started
+            stages['synth_ms'] += elapsed * 1000
+            last_error = str(e)
+            if is_throttling_error(e):
+                # The limiter backs off and cools down for everyone
+                limiter.release('throttled')
+                synthesis_seconds.observe(elapsed, outcome='throttled')
+                retries_total.inc(cause='throttled')
+                logger.info("Throttled on segment %d, retry %d/%d", idx, retry + 1, max_retries)
+                if job_id:
+                    job_store.add_event(job_id, 'retry', index=idx, attempt=retry + 1,
+                                        cause='throttled', error=last_error[:200])
+                continue
+            limiter.release('error')
+            synthesis_seconds.observe(elapsed, outcome='error')
+            if is_permanent_error(e):
+                break
+            if retry < max_retries - 1:
+                wait_time = min(2 * (2 ** retry), 20)
+                retries_total.inc(cause='error')
+                retry_sleep_seconds.inc(wait_time)
+                stages['retry_sleep_ms'] = stages.get('retry_sleep_ms', 0) + wait_time * 1000
+                logger.warning("Retry %d/%d for segment %d (error: %.100s, waiting %ds)",
+                               retry + 1, max_retries, idx, last_error, wait_time)
+                if job_id:
+                    job_store.add_event(job_id, 'retry', index=idx, attempt=retry + 1,
+                                        cause='error', error=last_error[:200], wait_ms=wait_time * 1000)
+                raise RetryLater(wait_time) from e
+        else:
+            elapsed = time.monotonic() - attempt_started
+            stages['synth_ms'] += elapsed * 1000
+            limiter.release('success')
+            synthesis_seconds.observe(elapsed, outcome='success')
+            logger.debug("Segment %d generated (%d bytes)", idx, len(audio))
+            if cache_key:
+                segment_cache.put(cache_key, audio)
+            return audio
+    
+    error_msg = f"TTS generation failed for segment {idx} (emotion: {emotion}) after {tries['attempts']} attempts: {(last_error or '')[:200]}"
+    logger.error("%s", error_msg)
+    raise Exception(error_msg)
+
+def complete_segment(job_id, idx, audio, on_segment=None, stages=None, **timing):
+    """Hand finished segment audio to on_segment and record it in the job store"""
+    audio_path = on_segment(idx, audio) if on_segment else None
+    job_store.mark_segment_done(job_id, idx, audio_path, stages=stages, **timing)
+    return audio
+
+def run_segment(job_id, idx, segment, voice, cache_key, on_segment=None, submitted_at=None, flight=None,
+                tries=None):
+    """Scheduler task for one segment; tries carries attempts and timings across retries"""
+    started = time.monotonic()
+    if tries is None:
+        tries = {}
+    stages = tries.setdefault('stages', {'queue_ms': 0})
+    stages['queue_ms'] += (started - tries.get('ready_at', submitted_at)) * 1000
+    try:
+        audio = synthesize_segment(idx, segment, voice, cache_key, job_id=job_id, stages=stages, tries=tries)
+    except RetryLater as e:
+        tries['ready_at'] = time.monotonic() + e.delay
+        raise
+    except BaseException as e:
+        if flight is not None:
+            flight.set_exception(e)
+        raise
+    if flight is not None:
+        flight.set_result(audio)
+    segments_total.inc(source='synthesized')
+    return complete_segment(job_id, idx, audio, on_segment, stages=stages, cached=False,
+                            queue_ms=round(stages['queue_ms']),
+                            synth_ms=round((time.monotonic() - started) * 1000))
+
+def dispatch_segments(prosody_segments, voice, job_id, on_segment=None, skip=(), ticket=None):
+    """Submit every segment to the scheduler and return futures in segment order
+    
+    Segments already in the cache resolve immediately without touching the
+    limiter or the network. A segment's own 'voice' key overrides voice.
+    Indices in skip are left out (their future is None). on_segment(idx,
+    audio) may store the audio and return its path. ticket says whose work
+    it is and at what priority (default: anonymous bulk work).
+    """
+    futures = []
+    hits = 0
+    misses = 0
+    for idx, segment in enumerate(prosody_segments):
+        if idx in skip:
+            futures.append(None)
+            continue
+        future, cached = dispatch_segment(idx, segment, voice, job_id, on_segment, ticket)
+        hits += cached
+        misses += not cached
+        futures.append(future)
+    
+    job_store.add_cache_stats(job_id, hits, misses)
+    segments_total.inc(hits, source='cache')
+    logger.debug("Segment cache: %d hits, %d misses", hits, misses)
+    return futures
+
+def dispatch_segment(idx, segment, voice, job_id, on_segment=None, ticket=None):
+    """Resolve one segment from the cache or submit it; return (future, cached)"""
+    # Batch segments carry their own voice
+    segment_voice = segment.get('voice', voice)
+    cache_key = segment_cache_key(segment, segment_voice)
+    audio = segment_cache.get(cache_key)
+    if audio is None:
+        flight, leader = segment_flights.begin(cache_key)
+        if not leader:
+            coalesced_total.inc(level='segment')
+            return follow_segment(flight, idx, segment, segment_voice, job_id, on_segment, ticket), False
+        # A flight that finished between the cache miss and begin() has filled the cache
+        audio = segment_cache.get(cache_key)
+        if audio is None:
+            future = scheduler.submit(run_segment, job_id, idx, segment, segment_voice, cache_key,
+                                      on_segment, time.monotonic(), flight, {},
+                                      ticket=ticket or Ticket('anonymous', job_id, 'bulk'))
+            future.add_done_callback(functools.partial(abandon_flight, flight))
+            return future, False
+        flight.set_result(audio)
+    future = Future()
+    try:
+        future.set_result(complete_segment(job_id, idx, audio, on_segment,
+                                           cached=True, queue_ms=0, synth_ms=0))
+    except Exception as e:
+        future.set_exception(e)
+    return future, True
+
+def follow_segment(flight, idx, segment, voice, job_id, on_segment=None, ticket=None):
+    """Future for a segment that another request is already synthesizing
+    
+    The audio is recorded for this job as soon as the leader has it. If the
+    leader was cancelled before it started, the segment is dispatched again.
+    """
+    future = Future()
+    attached_at = time.monotonic()
+    
+    def finish(flight):
+        if not future.set_running_or_notify_cancel():
+            return
+        if flight.cancelled():
+            try:
+                retry, _ = dispatch_segment(idx, segment, voice, job_id, on_segment, ticket)
+            except Exception as e:
+                future.set_exception(e)
+                return
+            retry.add_done_callback(functools.partial(copy_outcome, future))
+            return
+        try:
+            audio = flight.result()
+            segments_total.inc(source='coalesced')
+            future.set_result(complete_segment(job_id, idx, audio, on_segment, cached=False, coalesced=True,
+                                               queue_ms=round((time.monotonic() - attached_at) * 1000),
+                                               synth_ms=0))
+        except Exception as e:
+            future.set_exception(e)
+    
+    flight.add_done_callback(finish)
+    return future
+
+def abandon_flight(flight, future):
+    """A job that fails cancels its queued segments; let the followers take over"""
+    if future.cancelled():
+        flight.cancel()
+
+def copy_outcome(target, source):
+    """Resolve the running future target the way source was resolved"""
+    if source.cancelled():
+        target.set_exception(CancelledError())
+    elif source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+def collect_segments(futures):
+    """Wait for segment futures in order; cancel the rest if one fails"""
+    try:
+        return [future.result() if future is not None else None for future in futures]
+    except Exception:
+        for future in futures:
+            if future is not None:
+                future.cancel()
+        raise
+
+def drain_segments(futures):
+    """Wait for segment futures in order, dropping each result; cancel the rest if one fails
+
+    For callers whose on_segment already stored the audio, so it is not all
+    held in memory at once.
+    """
+    try:
+        for idx, future in enumerate(futures):
+            if future is not None:
+                future.result()
+                futures[idx] = None
+    except Exception:
+        for future in futures:
+            if future is not None:
+                future.cancel()
+        raise
+
+def reencode_segments(audio_segments):
+    """Join segments whose MP3 formats differ by re-encoding them with ffmpeg"""
+    ffmpeg = ffmpeg_exe()
+    logger.info("Re-encoding %d segments using ffmpeg", len(audio_segments))
+    
+    with spool.scratch_dir(prefix='concat_') as temp_dir:
+        concat_file = os.path.join(temp_dir, 'concat.txt')
+        with open(concat_file, 'w', encoding='utf-8') as f:
+            for idx, audio in enumerate(audio_segments):
+                seg_file = os.path.join(temp_dir, f'seg_{idx:05d}.mp3')
+                with open(seg_file, 'wb') as seg:
+                    seg.write(audio)
+                # Use forward slashes and escape special chars
+                safe_path = seg_file.replace('\\', '/').replace("'", "'\\''")
+                f.write(f"file '{safe_path}'\n")
+        
+        # Same format edge-tts produces: 24 kHz mono 48 kbps
+        output_path = os.path.join(temp_dir, 'result.mp3')
+        result = subprocess.run(
+            [ffmpeg, '-f', 'concat', '-safe', '0', '-i', concat_file,
+             '-c:a', 'libmp3lame', '-ar', '24000', '-ac', '1', '-b:a', '48k', '-y', output_path],
+            capture_output=True,
+            text=True,
+            timeout=300
+        )
+        if result.returncode != 0 or not os.path.exists(output_path):
+            raise Exception(f"ffmpeg failed: {result.stderr}")
+        with open(output_path, 'rb') as f:
+            return f.read()
+
+def record_concat(job_id, method, started):
+    elapsed = time.monotonic() - started
+    concat_seconds.observe(elapsed, method=method)
+    if job_id:
+        job_store.add_stage_times(job_id, concat_ms=elapsed * 1000)
+
+def concat_audio(audio_segments, job_id=None):
+    """Join segment MP3s in memory at the frame level; re-encode only on a format mismatch"""
+    if len(audio_segments) == 1:
+        return audio_segments[0]
+    started = time.monotonic()
+    try:
+        audio = mp3_concat.concat(audio_segments)
+        method = 'frames'
+    except mp3_concat.FormatMismatch as e:
+        logger.warning("%s; falling back to re-encoding", e)
+        audio = reencode_segments(audio_segments)
+        method = 'reencode'
+    record_concat(job_id, method, started)
+    return audio
+
+def concat_segment_files(segment_files, output_path, job_id=None):
+    """Join segment MP3 files into output_path, reading one segment at a time"""
+    def read_segments():
+        for seg_file in segment_files:
+            with open(seg_file, 'rb') as f:
+                yield f.read()
+    
+    started = time.monotonic()
+    tmp_path = output_path + '.tmp'
+    method = 'frames'
+    try:
+        with open(tmp_path, 'wb') as out:
+            mp3_concat.concat_to(out, read_segments())
+    except mp3_concat.FormatMismatch as e:
+        logger.warning("%s; falling back to re-encoding", e)
+        method = 'reencode'
+        with open(tmp_path, 'wb') as out:
+            out.write(reencode_segments(list(read_segments())))
+    os.replace(tmp_path, output_path)
+    record_concat(job_id, method, started)
+    return output_path
+
+def wants_postprocess(value):
+    """Resolve a request's "postprocess" flag against the server default"""
+    enabled = app.config['POSTPROCESS'] if value is None else bool(value)
+    if enabled and load_postprocess() is None:
+        raise ValueError("Post-processing requires numpy, which is not installed")
+    return enabled
+
+def postprocess_audio(audio_segments, volumes, job_id=None):
+    """Apply per-segment volume, crossfades, trimming and loudness; encode once"""
+    postprocess = load_postprocess()
+    target = app.config['POSTPROCESS_TARGET_DBFS']
+    started = time.monotonic()
+    audio, stats = postprocess.process(
+        audio_segments,
+        [postprocess.parse_db(volume) for volume in volumes],
+        ffmpeg_exe(),
+        crossfade_ms=app.config['POSTPROCESS_CROSSFADE_MS'],
+        trim=app.config['POSTPROCESS_TRIM'],
+        trim_threshold_db=app.config['POSTPROCESS_TRIM_DB'],
+        keep_silence_ms=app.config['POSTPROCESS_KEEP_SILENCE_MS'],
+        target_dbfs=None if target.lower() == 'off' else float(target),
+    )
+    elapsed = time.monotonic() - started
+    postprocess_seconds.observe(elapsed)
+    if job_id:
+        job_store.add_stage_times(job_id, postprocess_ms=elapsed * 1000)
+    logger.debug("Post-processed %d segments: %s", len(audio_segments), stats)
+    return audio
+
+# Client-chosen task ids name job directories in the spool
+TASK_ID = re.compile(r'[\w-]{1,64}')
+
+def job_dir(job_id, create=False):
+    return spool.job_dir(job_id, create=create)
+
+def remove_job_files(job_id):
+    try:
+        spool.remove(job_id)
+    except ValueError as e:  # ids stored before task ids were validated
+        logger.warning("Not removing files of job %r: %s", job_id, e)
+
+def run_job(job_id):
+    """Synthesize a background job, resuming from its last completed segment"""
+    job = job_store.get_job(job_id)
+    if job['kind'] == 'upload':
+        return run_upload_job(job)
+    segments = job_store.get_segments(job_id)
+    # Segment files and the result exist side by side until the concat is done
+    spool.ensure_space(2 * job['text_length'] * AUDIO_BYTES_PER_CHAR)
+    directory = job_dir(job_id, create=True)
+    
+    def segment_path(idx):
+        return os.path.join(directory, f'seg_{idx:05d}.mp3')
+    
+    def save_segment(idx, audio):
+        path = segment_path(idx)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(audio)
+        os.replace(path + '.tmp', path)
+        return path
+    
+    # Segments finished before an interruption are kept as long as their audio is
+    done = set()
+    for segment in segments:
+        if segment['status'] != 'done':
+            continue
+        if segment['audio_path'] and os.path.exists(segment['audio_path']):
+            done.add(segment['index'])
+        else:
+            job_store.reset_segment(job_id, segment['index'])
+    if done:
+        logger.info("Job %s: resuming with %d/%d segments already done", job_id, len(done), len(segments))
+    
+    futures = dispatch_segments(segments, job['voice'], job_id, on_segment=save_segment, skip=done,
+                                ticket=job_ticket(job))
+    collect_segments(futures)
+    
+    result_path = os.path.join(directory, 'result.mp3')
+    job_store.add_event(job_id, 'concat_start', segments=len(segments))
+    if job['postprocess']:
+        audio_segments = []
+        for idx in range(len(segments)):
+            with open(segment_path(idx), 'rb') as f:
+                audio_segments.append(f.read())
+        audio = postprocess_audio(audio_segments, [seg['prosody']['volume'] for seg in segments], job_id)
+        with open(result_path + '.tmp', 'wb') as f:
+            f.write(audio)
+        os.replace(result_path + '.tmp', result_path)
+    else:
+        concat_segment_files([segment_path(i) for i in range(len(segments))], result_path, job_id=job_id)
+    for idx in range(len(segments)):
+        try:
+            os.remove(segment_path(idx))
+        except OSError:
+            pass
+    size = os.path.getsize(result_path)
+    output_bytes.inc(size, endpoint='jobs')
+    job_store.set_status(job_id, 'done', result_path=result_path)
+    logger.info("Job %s: done (%d bytes)", job_id, size)
+
+# Uploaded manuscript text, stored in the job's spool directory
+UPLOAD_SOURCE = 'source.txt'
+UPLOAD_CHUNK_BYTES = 256 * 1024
+
+def run_upload_job(job):
+    """Synthesize an uploaded manuscript while parsing it, appending to the MP3 as segments finish
+    
+    At most UPLOAD_WINDOW segments are in flight or waiting to be written, so
+    memory stays flat however long the manuscript is. An interrupted job
+    starts over from the top; the segments it already rendered come from
+    the cache.
+    """
+    job_id = job['id']
+    directory = job_dir(job_id)
+    source = os.path.join(directory, UPLOAD_SOURCE)
+    result_path = os.path.join(directory, 'result.mp3')
+    spool.ensure_space(job['text_length'] * AUDIO_BYTES_PER_CHAR)
+    job_store.clear_segments(job_id)
+    ticket = job_ticket(job)
+    window = deque()
+    counts = {'hits': 0, 'misses': 0, 'parse': 0.0}
+    
+    def ordered_audio():
+        segments = iter_planned_segments(read_text_chunks(source))
+        idx = 0
+        while True:
+            started = time.monotonic()
+            segment = next(segments, None)
+            counts['parse'] += time.monotonic() - started
+            if segment is None:
+                break
+            job_store.append_segment(job_id, idx, segment)
+            future, cached = dispatch_segment(idx, segment, job['voice'], job_id, ticket=ticket)
+            counts['hits' if cached else 'misses'] += 1
+            window.append(future)
+            idx += 1
+            if len(window) >= app.config['UPLOAD_WINDOW']:
+                yield window.popleft().result()
+        while window:
+            yield window.popleft().result()
+    
+    try:
+        with open(result_path + '.tmp', 'wb') as out:
+            mp3_concat.concat_to(out, ordered_audio())
+    finally:
+        for future in window:
+            future.cancel()
+        job_store.add_cache_stats(job_id, counts['hits'], counts['misses'])
+        job_store.add_stage_times(job_id, parse_ms=counts['parse'] * 1000)
+        segments_total.inc(counts['hits'], source='cache')
+        parse_seconds.observe(counts['parse'])
+    if not counts['hits'] + counts['misses']:
+        os.remove(result_path + '.tmp')
+        raise ValueError("Manuscript has no text to synthesize")
+    os.replace(result_path + '.tmp', result_path)
+    os.remove(source)
+    size = os.path.getsize(result_path)
+    output_bytes.inc(size, endpoint='upload')
+    job_store.set_status(job_id, 'done', result_path=result_path)
+    logger.info("Job %s: done (%d segments, %d bytes)", job_id, counts['hits'] + counts['misses'], size)
+
+def render_preview(voice):
+    """Synthesize the fixed preview sentence for a voice
+    
+    A preview someone is waiting for is interactive work; warm-up renders
+    (no request) are bulk.
+    """
+    segment = {'text': PREVIEW_TEXT, 'emotion': 'neutral', 'prosody': EMOTION_PROSODY['neutral']}
+    if has_request_context():
+        ticket = Ticket(client_id(), f'preview:{voice}', 'interactive')
+    else:
+        ticket = Ticket('warmup', 'previews', 'bulk')
+    synthesize = functools.partial(synthesize_segment, urgent=ticket.priority == 'interactive', tries={})
+    return scheduler.run(synthesize, 0, segment, voice, ticket=ticket, timeout=app.config['PREVIEW_TIMEOUT'])
+
+# Warm-up steps run once in the background after start; name -> {'ms': ...} or {'error': ...}
+warmup_steps = {}
+warmup_done = threading.Event()
+started_at = time.monotonic()
+
+def warm_up():
+    """Load the backend, ffmpeg and numpy ahead of the first request that needs them"""
+    steps = [('backend', backend.warm), ('ffmpeg', ffmpeg_exe), ('postprocess', load_postprocess)]
+    for name, step in steps:
+        started = time.monotonic()
+        try:
+            step()
+        except Exception as e:
+            logger.warning("Warm-up step %s failed: %s", name, e)
+            warmup_steps[name] = {'error': str(e)}
+        else:
+            warmup_steps[name] = {'ms': round((time.monotonic() - started) * 1000, 1)}
+    logger.info("Warm-up finished in %.0f ms", (time.monotonic() - started_at) * 1000)
+    warmup_done.set()
+
+def readiness():
+    """(ready, details): warm-up finished, the backend loaded and the job store answers
+
+    A missing ffmpeg or numpy only disables re-encoding or post-processing,
+    so those steps are reported but do not hold readiness back.
+    """
+    checks = {'warmup': warmup_done.is_set(),
+              'backend': warmup_done.is_set() and 'error' not in warmup_steps.get('backend', {})}
+    try:
+        job_store.ping()
+        checks['job_store'] = True
+    except Exception as e:
+        logger.warning("Job store check failed: %s", e)
+        checks['job_store'] = False
+    return all(checks.values()), {'checks': checks, 'warmup': dict(warmup_steps)}
+
+def warm_previews(locales):
+    """Pre-render previews for every voice in the given locales in the background"""
+    try:
+        voices = voice_catalog.voice_names(locale=locales)
+    except Exception as e:
+        logger.warning("Preview warm-up skipped: %s", e)
+        return
+    logger.info("Warming %d voice previews for %s", len(voices), locales)
+    preview_store.warm(voices)
+
+def stream_segments(futures, task_id):
+    """Yield segment audio in segment order, holding back segments that finish early"""
+    try:
+        for idx, future in enumerate(futures):
+            # Only the first segment keeps its ID3 tag; the rest send bare frames
+            chunk = bytes(mp3_concat.stream_frames(future.result(), first=idx == 0))
+            output_bytes.inc(len(chunk), endpoint='stream')
+            yield chunk
+        job_store.set_status(task_id, 'done')
+        logger.info("Streamed %d segments for task %s", len(futures), task_id)
+    except Exception as e:
+        # Headers are already sent, so the error can only be reported via progress
+        logger.error("Streaming task %s failed: %s: %s", task_id, type(e).__name__, e)
+        job_store.set_status(task_id, 'failed', error=str(e))
+    finally:
+        # Also runs when the client disconnects mid-stream
+        for future in futures:
+            future.cancel()
+        job = job_store.get_job(task_id)
+        if job and job['status'] == 'running':
+            job_store.set_status(task_id, 'failed', error='Client disconnected')
+
+def plan_segments(prosody_segments, max_chars=None):
+    """Coalesce adjacent same-prosody segments into as few requests as possible
+    
+    Runs of segments with the same emotion are joined and re-split at
+    sentence (or clause) boundaries into requests of at most max_chars
+    characters. Returns (planned_segments, requests_saved).
+    """
+    max_chars = max_chars or app.config['PLAN_MAX_CHARS']
+    planned = []
+    run = []
+    
+    def flush():
+        if not run:
+            return
+        text = ' '.join(seg['text'] for seg in run)
+        for chunk in chunk_long_text(text, max_length=max_chars):
+            planned.append({'text': chunk, 'emotion': run[0]['emotion'], 'prosody': run[0]['prosody']})
+        run.clear()
+    
+    for segment in prosody_segments:
+        if run and (segment['emotion'] != run[0]['emotion'] or segment['prosody'] != run[0]['prosody']):
+            flush()
+        run.append(segment)
+    flush()
+    
+    return planned, len(prosody_segments) - len(planned)
+
+EMOTION_TAG = re.compile(r'\[(\w+)\]')
+# A '[' followed only by word characters may still become a tag
+PARTIAL_TAG = re.compile(r'\[\w*$')
+
+def iter_emotion_text(chunks):
+    """Yield ('tag', name) and ('text', fragment) tokens from an iterable of text chunks
+
+    [name] tags are found across chunk boundaries exactly as re.split finds
+    them in parse_text_with_emotions. Only a possible partial tag is held back.
+    """
+    pending = ''
+    for chunk in chunks:
+        pending += chunk
+        position = 0
+        for match in EMOTION_TAG.finditer(pending):
+            if match.start() > position:
+                yield 'text', pending[position:match.start()]
+            yield 'tag', match.group(1)
+            position = match.end()
+        partial = PARTIAL_TAG.search(pending, position)
+        cut = partial.start() if partial else len(pending)
+        if cut > position:
+            yield 'text', pending[position:cut]
+        pending = pending[cut:]
+    if pending:
+        yield 'text', pending
+
+def iter_planned_segments(chunks, max_chars=None):
+    """Yield planned prosody segments while text chunks are still arriving
+
+    Streaming counterpart of parse_document, giving the same segments: text
+    after each tag is split into pieces of at most 500 characters, text before
+    the first tag is kept whole unless it starts with '[', and same-emotion
+    runs are joined and split into requests of at most max_chars. Only
+    unfinished chunks are held, plus the text before the first segment, which
+    is narrated as is if the document turns out to have no segments at all.
+    """
+    max_chars = max_chars or app.config['PLAN_MAX_CHARS']
+    head = []          # raw text until the first segment starts
+    run = None         # TextChunker for the current same-emotion run
+    run_emotion = None
+    section = None     # TextChunker for the text after the latest tag
+    emotion = None
+    lead_drop = None   # whether text before the first tag starts with '['
+    lead_started = False
+    lead_spaces = ''
+
+    def planned(emotion, chunks):
+        return [{'text': text, 'emotion': emotion, 'prosody': EMOTION_PROSODY[emotion]}
+                for text in chunks]
+
+    def add(emotion, text, new_segment=True):
+        """Feed segment text into the run, starting a new run when the emotion changes"""
+        nonlocal head, run, run_emotion
+        out = []
+        if new_segment:
+            head = None
+            if run is not None and emotion == run_emotion:
+                text = ' ' + text
+            else:
+                if run is not None:
+                    out = planned(run_emotion, run.close())
+                run, run_emotion = TextChunker(max_chars), emotion
+        return out + planned(emotion, run.feed(text))
+
+    for kind, value in iter_emotion_text(chunks):
+        if head is not None:
+            head.append(f'[{value}]' if kind == 'tag' else value)
+        if kind == 'tag':
+            if section is not None:
+                for text in section.close():
+                    yield from add(emotion, text)
+            emotion = value.lower() if value.lower() in EMOTION_PROSODY else 'neutral'
+            section = TextChunker(500)
+        elif section is not None:
+            for text in section.feed(value):
+                yield from add(emotion, text)
+        else:
+            # Text before the first tag is one segment, stripped as it streams
+            if lead_drop is None:
+                lead_drop = value.startswith('[')
+            if lead_drop:
+                continue
+            if not lead_started:
+                value = value.lstrip()
+                if not value:
+                    continue
+            body = value.rstrip()
+            if not body:
+                lead_spaces += value
+                continue
+            yield from add('neutral', lead_spaces + body, new_segment=not lead_started)
+            lead_started = True
+            lead_spaces = value[len(body):]
+    if section is not None:
+        for text in section.close():
+            yield from add(emotion, text)
+    if head is not None:
+        yield from planned('neutral', chunk_long_text(''.join(head).strip(), max_length=max_chars))
+    elif run is not None:
+        yield from planned(run_emotion, run.close())
+
+def read_text_chunks(path, chunk_size=64 * 1024):
+    """Yield the decoded text of a UTF-8 file chunk by chunk"""
+    decoder = codecs.getincrementaldecoder('utf-8-sig')(errors='replace')
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            text = decoder.decode(data)
+            if text:
+                yield text
+    text = decoder.decode(b'', final=True)
+    if text:
+        yield text
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
 @app.route('/api/voices', methods=['GET'])
 def get_voices():
-    """Get list of available voices"""
-    async def fetch_voices():
-        voices = await edge_tts.list_voices()
-        return voices
-    
-    voices = asyncio.run(fetch_voices())
-    
-    # Organize voices by language
-    voice_data = {}
-    for voice in voices:
-        locale = voice['Locale']
-        if locale not in voice_data:
-            voice_data[locale] = []
-        
-        voice_data[locale].append({
-            'name': voice['ShortName'],
-            'display_name': voice['FriendlyName'],
-            'gender': voice['Gender'],
-            'locale': voice['Locale']
-        })
+    """Get list of available voices, grouped by locale
+    
+    Optional query parameters: locale (comma-separated codes or language
+    prefixes such as "en") and gender. Supports If-None-Match.
+    """
+    try:
+        body, etag = voice_catalog.get(
+            locale=request.args.get('locale'),
+            gender=request.args.get('gender')
+        )
+    except Exception as e:
+        logger.error("get_voices failed: %s: %s", type(e).__name__, e)
+        return jsonify({'error': f'Voice list unavailable: {e}'}), 502
     
-    return jsonify(voice_data)
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+def preview_response(voice, as_attachment):
+    # Only voices the catalog knows are rendered and kept
+    if not isinstance(voice, str) or not voice_catalog.has_voice(voice):
+        return jsonify({'error': 'Unknown voice'}), 404
+    stored = preview_store.get(voice, render=False)
+    if stored is None:
+        busy = scheduler_busy(client_id(), 1)
+        if busy:
+            return busy
+        stored = preview_store.get(voice)
+    audio, key = stored
+    response = Response(audio, mimetype='audio/mpeg')
+    response.set_etag(key[:20])
+    # A voice's preview never changes, so browsers may keep it
+    response.headers['Cache-Control'] = 'public, max-age=604800'
+    if as_attachment:
+        response.headers.set('Content-Disposition', 'attachment', filename=f'preview_{voice}.mp3')
+    return response.make_conditional(request)
+
+@app.route('/api/preview/<voice>', methods=['GET'])
+def get_preview(voice):
+    """Get the (cacheable) preview clip for a voice"""
+    try:
+        return preview_response(voice, as_attachment=False)
+    except Exception as e:
+        logger.error("get_preview failed: %s: %s", type(e).__name__, e)
+        return jsonify({'error': str(e)}), 500
 
 @app.route('/api/preview', methods=['POST'])
 def preview_voice():
@@ -176,242 +1371,702 @@ def preview_voice():
     try:
         data = request.json
         voice = data.get('voice', 'en-US-AriaNeural')
-        
-        # Short preview text
-        preview_text = "Hello, this is a voice preview."
-        
-        # Create temporary file
-        temp_dir = tempfile.gettempdir()
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-        temp_path = os.path.join(temp_dir, f'preview_{timestamp}.mp3')
-        
-        # Generate preview using subprocess
-        script_path = os.path.join(os.path.dirname(__file__), 'generate_tts_simple.py')
-        result = subprocess.run(
-            [sys.executable, script_path, temp_path, voice, preview_text, "+0%", "+0Hz"],
-            capture_output=True,
-            text=True,
-            timeout=15
-        )
-        
-        if result.returncode != 0 or not os.path.exists(temp_path):
-            raise Exception("Preview generation failed")
-        
-        return send_file(
-            temp_path,
-            mimetype='audio/mpeg',
-            as_attachment=True,
-            download_name=f'preview_{voice}.mp3'
-        )
+        return preview_response(voice, as_attachment=True)
         
     except Exception as e:
-        print(f"ERROR in preview_voice: {type(e).__name__}: {str(e)}")
+        logger.error("preview_voice failed: %s: %s", type(e).__name__, e)
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/previews', methods=['GET'])
+def get_preview_stats():
+    """Get preview store usage"""
+    return jsonify(preview_store.stats())
+
 @app.route('/api/progress/<task_id>', methods=['GET'])
 def get_progress(task_id):
     """Get progress for a specific task"""
-    progress = progress_tracker.get(task_id, {'completed': 0, 'total': 1})
-    return jsonify(progress)
+    job = job_store.get_job(task_id)
+    if job is None:
+        return jsonify({'completed': 0, 'total': 1})
+    return jsonify({
+        'completed': job['completed'],
+        'total': job['total'],
+        'status': job['status'],
+        'error': job['error'],
+        'cache_hits': job['cache_hits'],
+        'cache_misses': job['cache_misses'],
+        'requests_saved': job['requests_saved'],
+        'stages': job_stages(job),
+    })
 
-@app.route('/api/generate', methods=['POST'])
-def generate_speech():
-    """Generate speech from text with emotions"""
-    task_id = None
+def parse_document(text):
+    """Parse emotion tags and plan requests; return (prosody_segments, requests_saved, parse_ms)"""
+    started = time.monotonic()
+    plain_text, prosody_segments = build_text_with_prosody_data(text)
+    # Merge same-emotion neighbours into fewer, sentence-aligned requests
+    prosody_segments, requests_saved = plan_segments(prosody_segments)
+    elapsed = time.monotonic() - started
+    parse_seconds.observe(elapsed)
+    logger.debug("Plain text: %.200s", plain_text)
+    return prosody_segments, requests_saved, elapsed * 1000
+
+def validate_text(text):
+    """Return an error message if text cannot be synthesized, else None"""
+    if not text:
+        return 'No text provided'
+    # Check text length (allow up to 100,000 characters for ~100 segments)
+    if len(text) > 100000:
+        return 'Text too long. Maximum 100,000 characters allowed; upload longer texts to /api/jobs/upload.'
+    return None
+
+def job_stages(job):
+    """Per-stage timing breakdown in ms (sums over segments for queue/limiter/synthesis)"""
+    stages = {stage: round(ms) for stage, ms in job['stages'].items()}
+    if job['finished_at']:
+        stages['total_ms'] = round((job['finished_at'] - job['created_at']) * 1000)
+    return stages
+
+def job_status(job, include_segments=True):
+    """Public view of a job row"""
+    status = {
+        'job_id': job['id'],
+        'status': job['status'],
+        'voice': job['voice'],
+        'completed': job['completed'],
+        'total': job['total'],
+        'cache_hits': job['cache_hits'],
+        'cache_misses': job['cache_misses'],
+        'requests_saved': job['requests_saved'],
+        'postprocess': bool(job['postprocess']),
+        'error': job['error'],
+        'created_at': job['created_at'],
+        'finished_at': job['finished_at'],
+        'stages': job_stages(job),
+    }
+    if job['status'] == 'done' and job['result_path']:
+        status['result_url'] = f"/api/jobs/{job['id']}/result"
+    if include_segments:
+        status['segments'] = [{
+            'index': seg['index'],
+            'emotion': seg['emotion'],
+            'chars': len(seg['text']),
+            'status': seg['status'],
+        } for seg in job_store.get_segments(job['id'])]
+    return status
+
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    """Queue a generation job and return its id right away"""
     try:
         data = request.json
         text = data.get('text', '')
         voice = data.get('voice', 'en-US-AriaNeural')
-        task_id = data.get('task_id', datetime.now().strftime("%Y%m%d%H%M%S%f"))
         
-        if not text:
-            return jsonify({'error': 'No text provided'}), 400
+        error = validate_text(text)
+        if error:
+            return jsonify({'error': error}), 400
+        try:
+            use_postprocess = wants_postprocess(data.get('postprocess'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        # Check text length (allow up to 100,000 characters for ~100 segments)
-        if len(text) > 100000:
-            return jsonify({'error': 'Text too long. Maximum 100,000 characters allowed.'}), 400
+        prosody_segments, requests_saved, parse_ms = parse_document(text)
+        busy = scheduler_busy(client_id(), len(prosody_segments))
+        if busy:
+            return busy
+        new_id = uuid.uuid4().hex
+        # An identical job that is still queued or running is shared instead of repeated
+        job_id = job_store.create_job(new_id, voice, prosody_segments, kind='async', text_length=len(text),
+                                      requests_saved=requests_saved, postprocess=use_postprocess,
+                                      fingerprint=job_fingerprint(voice, prosody_segments, use_postprocess),
+                                      client=client_id())
+        coalesced = job_id != new_id
+        if coalesced:
+            coalesced_total.inc(level='job')
+            logger.info("Job %s: identical request attached", job_id)
+        else:
+            job_store.add_stage_times(job_id, parse_ms=parse_ms)
+            job_runner.submit(job_id)
+            logger.info("Job %s: queued with %d segments", job_id, len(prosody_segments))
+        job = job_store.get_job(job_id)
         
-        print(f"\n{'='*60}")
-        print(f"Starting TTS generation...")
-        print(f"Voice: {voice}")
-        print(f"Text length: {len(text)} characters")
-        print(f"Task ID: {task_id}")
+        response = jsonify({
+            'job_id': job_id,
+            'status': job['status'] if job else 'queued',
+            'total': len(prosody_segments),
+            'requests_saved': requests_saved,
+            'coalesced': coalesced,
+            'status_url': f'/api/jobs/{job_id}',
+        })
+        response.status_code = 202
+        response.headers['Location'] = f'/api/jobs/{job_id}'
+        return response
+    
+    except Exception as e:
+        logger.error("create_job failed: %s: %s", type(e).__name__, e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/jobs/upload', methods=['POST'])
+def upload_job():
+    """Queue a manuscript of any length; it is streamed to disk and parsed as it is synthesized
+    
+    Accepts a multipart upload with a "file" field (and optional "voice"), or
+    the UTF-8 text itself as the request body with ?voice=.
+    """
+    job_id = uuid.uuid4().hex
+    try:
+        # Checked before the body is read; the manuscript's length is not known yet
+        busy = scheduler_busy(client_id(), 1)
+        if busy:
+            return busy
+        if request.mimetype == 'multipart/form-data':
+            upload = request.files.get('file')
+            if upload is None:
+                return jsonify({'error': 'No file provided'}), 400
+            stream = upload.stream
+            voice = request.form.get('voice', 'en-US-AriaNeural')
+        else:
+            stream = request.stream
+            voice = request.args.get('voice', 'en-US-AriaNeural')
         
-        # Parse text and get prosody data for each segment
-        plain_text, prosody_segments = build_text_with_prosody_data(text)
-        print(f"Plain text: {plain_text[:200]}")
-        print(f"Total prosody segments to generate: {len(prosody_segments)}")
+        spool.ensure_space(request.content_length or 0)
+        source = os.path.join(job_dir(job_id, create=True), UPLOAD_SOURCE)
+        size = 0
+        with open(source, 'wb') as f:
+            while True:
+                data = stream.read(UPLOAD_CHUNK_BYTES)
+                if not data:
+                    break
+                f.write(data)
+                size += len(data)
+        # Whitespace alone plans a single empty segment
+        first = next(iter_planned_segments(read_text_chunks(source)), None)
+        if first is None or not first['text']:
+            remove_job_files(job_id)
+            return jsonify({'error': 'No text provided'}), 400
+        # Room for the finished audio, so a book that cannot fit fails now rather than hours in
+        spool.ensure_space(size * AUDIO_BYTES_PER_CHAR)
         
-        # Initialize progress tracker
-        progress_tracker[task_id] = {'completed': 0, 'total': len(prosody_segments)}
+        job_store.create_job(job_id, voice, [], kind='upload', text_length=size, client=client_id())
+        job_runner.submit(job_id)
+        logger.info("Job %s: queued manuscript of %d bytes", job_id, size)
         
-        # Show all segments for debugging
-        for idx, seg in enumerate(prosody_segments):
-            print(f"  Segment {idx}: [{seg['emotion']}] \"{seg['text'][:50]}...\"")
+        response = jsonify({
+            'job_id': job_id,
+            'status': 'queued',
+            'bytes': size,
+            'status_url': f'/api/jobs/{job_id}',
+        })
+        response.status_code = 202
+        response.headers['Location'] = f'/api/jobs/{job_id}'
+        return response
+    
+    except SpoolFull as e:
+        remove_job_files(job_id)
+        logger.warning("Upload %s: %s", job_id, e)
+        return jsonify({'error': str(e)}), 507
+    except HTTPException:
+        # e.g. 413 once the body passes UPLOAD_MAX_BYTES
+        remove_job_files(job_id)
+        raise
+    except Exception as e:
+        remove_job_files(job_id)
+        logger.error("upload_job failed: %s: %s", type(e).__name__, e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Get status, per-segment progress and result location of a job"""
+    job = job_store.get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    include_segments = request.args.get('segments', '1') != '0'
+    return jsonify(job_status(job, include_segments))
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    """Download the audio of a finished job"""
+    job = job_store.get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job['status'] != 'done' or not job['result_path']:
+        return jsonify({'error': f"Job is {job['status']}", 'status': job['status']}), 409
+    if not os.path.exists(job['result_path']):
+        return jsonify({'error': 'Result is no longer available'}), 410
+    response = send_file(
+        job['result_path'],
+        mimetype='audio/mpeg',
+        as_attachment=True,
+        download_name=f'tts_{job_id}.mp3'
+    )
+    # Repeat downloads still work until the spool's delivery grace period ends
+    spool.mark_delivered(job_id)
+    return response
+
+def batch_document_id(name, used):
+    """Filesystem-safe, unique id for a batch document"""
+    base = re.sub(r'[^\w.-]+', '_', str(name)).strip('._')[:80] or 'document'
+    doc_id = base
+    n = 2
+    while doc_id in used:
+        doc_id = f'{base}_{n}'
+        n += 1
+    used.add(doc_id)
+    return doc_id
+
+# An archive's voices.json only maps file names to voice names
+BATCH_VOICES_MAX_BYTES = 1024 * 1024
+
+def read_batch_archive(upload, default_voice):
+    """Read documents from an uploaded ZIP of .txt files (optional voices.json maps name -> voice)"""
+    try:
+        archive = zipfile.ZipFile(upload)
+    except zipfile.BadZipFile:
+        raise ValueError('Archive must be a ZIP file')
+    with archive:
+        entries = [info for info in archive.infolist()
+                   if not info.is_dir() and info.filename.lower().endswith(('.txt', '.md'))]
+        # Check the declared sizes before decompressing anything
+        if sum(info.file_size for info in entries) > app.config['BATCH_MAX_TEXT_BYTES']:
+            raise ValueError('Archive text is too large')
+        voices = {}
+        if 'voices.json' in archive.namelist():
+            with archive.open('voices.json') as f:
+                data = f.read(BATCH_VOICES_MAX_BYTES + 1)
+            if len(data) > BATCH_VOICES_MAX_BYTES:
+                raise ValueError('voices.json is too large')
+            try:
+                voices = json.loads(data.decode('utf-8'))
+            except ValueError:
+                raise ValueError('voices.json is not valid JSON')
+            if not isinstance(voices, dict):
+                raise ValueError('voices.json must map file names to voices')
+        documents = []
+        for info in sorted(entries, key=lambda info: info.filename):
+            name = info.filename.rsplit('.', 1)[0]
+            documents.append({
+                'id': name,
+                'text': archive.read(info).decode('utf-8-sig'),
+                'voice': voices.get(name) or voices.get(info.filename) or default_voice,
+            })
+    return documents
+
+def plan_batch(documents):
+    """Parse and plan every document and dedupe segments across the batch
+    
+    Returns (docs, unique_segments, total_segments, requests_saved, parse_ms);
+    each doc lists the indices of its segments in unique_segments.
+    """
+    used_ids = set()
+    docs = []
+    unique = []
+    index_by_key = {}
+    total = 0
+    requests_saved = 0
+    parse_ms = 0
+    for n, document in enumerate(documents):
+        voice = document['voice']
+        prosody_segments, saved, ms = parse_document(document['text'])
+        requests_saved += saved
+        parse_ms += ms
+        total += len(prosody_segments)
+        indices = []
+        for segment in prosody_segments:
+            key = segment_cache_key(segment, voice)
+            if key not in index_by_key:
+                index_by_key[key] = len(unique)
+                unique.append(dict(segment, voice=voice))
+            indices.append(index_by_key[key])
+        docs.append({
+            'id': batch_document_id(document.get('id') or f'document_{n + 1}', used_ids),
+            'voice': voice,
+            'chars': len(document['text']),
+            'segments': indices,
+        })
+    return docs, unique, total, requests_saved, parse_ms
+
+@app.route('/api/batch', methods=['POST'])
+@gated(heavy_gate)
+def generate_batch():
+    """Synthesize many documents at once, each unique segment only once
+    
+    Accepts JSON {"documents": [{"id", "text", "voice"}], "voice", "format"}
+    or a multipart upload with an "archive" ZIP of .txt files. format "zip"
+    (default) returns a ZIP with one MP3 per document plus manifest.json;
+    "manifest" stores the outputs and returns the manifest with download URLs.
+    """
+    batch_id = None
+    try:
+        if request.files.get('archive'):
+            voice = request.form.get('voice', 'en-US-AriaNeural')
+            output_format = request.form.get('format', 'zip')
+            batch_id = request.form.get('task_id')
+            use_postprocess = wants_postprocess(
+                request.form['postprocess'] == '1' if 'postprocess' in request.form else None)
+            documents = read_batch_archive(request.files['archive'], voice)
+        else:
+            data = request.json or {}
+            voice = data.get('voice', 'en-US-AriaNeural')
+            output_format = data.get('format', 'zip')
+            batch_id = data.get('task_id')
+            use_postprocess = wants_postprocess(data.get('postprocess'))
+            documents = [{'id': doc.get('id'), 'text': doc.get('text', ''), 'voice': doc.get('voice') or voice}
+                         for doc in data.get('documents', [])]
+        batch_id = batch_id or uuid.uuid4().hex
         
-        # Create temporary directory for segments
-        temp_dir = tempfile.gettempdir()
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        # The id names the batch's output directory
+        if not isinstance(batch_id, str) or not TASK_ID.fullmatch(batch_id):
+            return jsonify({'error': 'Invalid task_id'}), 400
+        if output_format not in ('zip', 'manifest'):
+            return jsonify({'error': "format must be 'zip' or 'manifest'"}), 400
+        if not documents:
+            return jsonify({'error': 'No documents provided'}), 400
+        if len(documents) > app.config['BATCH_MAX_DOCUMENTS']:
+            return jsonify({'error': f"Too many documents (maximum {app.config['BATCH_MAX_DOCUMENTS']})"}), 400
+        for n, document in enumerate(documents):
+            error = validate_text(document['text'])
+            if error:
+                return jsonify({'error': f"Document {document.get('id') or n + 1}: {error}"}), 400
         
-        # Generate audio for each emotion segment
-        segment_files = []
-        script_path = os.path.join(os.path.dirname(__file__), 'generate_tts_simple.py')
+        started = time.monotonic()
+        docs, unique, total, requests_saved, parse_ms = plan_batch(documents)
+        logger.info("Batch %s: %d documents, %d segments, %d unique (%d requests saved by planning)",
+                    batch_id, len(docs), total, len(unique), requests_saved)
+        client = client_id()
+        busy = scheduler_busy(client, len(unique))
+        if busy:
+            return busy
         
-        for idx, segment in enumerate(prosody_segments):
-            segment_text = segment['text']
-            rate = segment['prosody']['rate']
-            pitch = segment['prosody']['pitch']
-            emotion = segment['emotion']
-            
-            segment_path = os.path.join(temp_dir, f'tts_{timestamp}_seg{idx}.mp3')
-            print(f"Segment {idx} [{emotion}]: rate={rate}, pitch={pitch}")
-            
-            # Add delay to avoid rate limiting (except for first segment)
-            if idx > 0:
-                import time
-                # Optimized delay: faster but still prevents rate limiting
-                base_delay = 0.8  # Reduced from 2.0s
-                increment = min(idx * 0.1, 1.2)  # Reduced increment
-                delay = base_delay + increment
-                delay = min(delay, 2.0)  # Maximum 2 second delay (reduced from 5s)
-                print(f"Waiting {delay:.1f}s before segment {idx}...")
-                time.sleep(delay)
-            
-            # Retry logic for rate limiting with exponential backoff
-            max_retries = 10  # Increased retries for 100+ segments
-            last_error = None
+        # The id names the batch's outputs too, so an existing one is never reused
+        try:
+            job_store.create_job(batch_id, voice, unique, kind='batch', status='running',
+                                 text_length=sum(doc['chars'] for doc in docs), worker=job_runner.worker_id,
+                                 requests_saved=requests_saved + total - len(unique),
+                                 postprocess=use_postprocess, client=client)
+        except JobExists as e:
+            return jsonify({'error': str(e)}), 409
+        job_store.add_stage_times(batch_id, parse_ms=parse_ms)
+        # Unique segments, then one output per document and, for format=zip, the archive
+        spool.ensure_space(2 * job_store.get_job(batch_id)['text_length'] * AUDIO_BYTES_PER_CHAR)
+        directory = job_dir(batch_id, create=True)
+        with spool.scratch_dir(prefix='batch_') as scratch:
+            def segment_path(idx):
+                return os.path.join(scratch, f'seg_{idx:05d}.mp3')
             
-            for retry in range(max_retries):
-                try:
-                    result = subprocess.run(
-                        [sys.executable, script_path, segment_path, voice, segment_text, rate, pitch],
-                        capture_output=True,
-                        text=True,
-                        timeout=90  # Increased timeout for reliability
-                    )
-                    
-                    if result.returncode == 0 and os.path.exists(segment_path):
-                        print(f"✓ Segment {idx} generated successfully")
-                        # Update progress
-                        progress_tracker[task_id]['completed'] = idx + 1
-                        break  # Success!
-                    else:
-                        last_error = result.stderr or result.stdout or "Unknown error"
-                        if retry < max_retries - 1:
-                            # Faster backoff: 2s, 4s, 8s, 16s... (capped at 20s)
-                            wait_time = min(2 * (2 ** retry), 20)
-                            print(f"Retry {retry + 1}/{max_retries} for segment {idx} (waiting {wait_time}s)")
-                            import time
-                            time.sleep(wait_time)
-                except Exception as e:
-                    last_error = str(e)
-                    if retry < max_retries - 1:
-                        # Faster backoff for exceptions too
-                        wait_time = min(2 * (2 ** retry), 20)
-                        print(f"Retry {retry + 1}/{max_retries} for segment {idx} (error: {str(e)[:100]}, waiting {wait_time}s)")
-                        import time
-                        time.sleep(wait_time)
-                    else:
-                        print(f"Exception on final retry for segment {idx}: {e}")
-            else:
-                # All retries failed
-                error_msg = f"TTS generation failed for segment {idx} (emotion: {emotion}) after {max_retries} attempts: {last_error[:200]}"
-                print(f"ERROR: {error_msg}")
-                raise Exception(error_msg)
+            def save_segment(idx, audio):
+                with open(segment_path(idx), 'wb') as f:
+                    f.write(audio)
+                return segment_path(idx)
             
-            if not os.path.exists(segment_path):
-                raise Exception(f"Audio file was not created for segment {idx}")
+            drain_segments(dispatch_segments(unique, voice, batch_id, on_segment=save_segment,
+                                             ticket=Ticket(client, batch_id, 'bulk')))
+            job_store.add_event(batch_id, 'concat_start', segments=total, documents=len(docs))
             
-            segment_files.append(segment_path)
-        
-        # If multiple segments, concatenate them; otherwise use the single file
-        if len(segment_files) == 1:
-            temp_path = segment_files[0]
-        else:
-            # Use ffmpeg directly for concatenation
-            temp_path = os.path.join(temp_dir, f'tts_{timestamp}_final.mp3')
-            print(f"Concatenating {len(segment_files)} segments using ffmpeg...")
-            
-            try:
-                import imageio_ffmpeg
-                ffmpeg_exe = imageio_ffmpeg.get_ffmpeg_exe()
-                
-                # Create concat demuxer file
-                concat_file = os.path.join(temp_dir, f'concat_{timestamp}.txt')
-                with open(concat_file, 'w', encoding='utf-8') as f:
-                    for seg_file in segment_files:
-                        # Use forward slashes and escape special chars
-                        safe_path = seg_file.replace('\\', '/').replace("'", "'\\''")
-                        f.write(f"file '{safe_path}'\n")
-                
-                # Run ffmpeg concat
-                print(f"Running ffmpeg to merge {len(segment_files)} audio files...")
-                result = subprocess.run(
-                    [ffmpeg_exe, '-f', 'concat', '-safe', '0', '-i', concat_file,
-                     '-c', 'copy', '-y', temp_path],
-                    capture_output=True,
-                    text=True,
-                    timeout=300  # 5 minutes for 100+ segments
-                )
-                
-                # Debug: Print ffmpeg output
-                if result.stdout:
-                    print(f"ffmpeg stdout: {result.stdout}")
-                if result.stderr:
-                    print(f"ffmpeg stderr: {result.stderr}")
-                
-                # Clean up concat file
-                try:
-                    os.remove(concat_file)
-                except Exception as clean_err:
-                    print(f"Warning: Could not remove concat file: {clean_err}")
-                
-                if result.returncode == 0 and os.path.exists(temp_path):
-                    print(f"Successfully concatenated {len(segment_files)} segments")
-                    # Clean up segment files
-                    for seg_file in segment_files:
-                        try:
-                            os.remove(seg_file)
-                        except:
-                            pass
+            # One document's audio is in memory at a time
+            for doc in docs:
+                doc['file'] = f"{doc['id']}.mp3"
+                path = os.path.join(directory, doc['file'])
+                paths = [segment_path(idx) for idx in doc['segments']]
+                if use_postprocess:
+                    doc_audio = []
+                    for seg_file in paths:
+                        with open(seg_file, 'rb') as f:
+                            doc_audio.append(f.read())
+                    audio = postprocess_audio(doc_audio, [unique[idx]['prosody']['volume'] for idx in doc['segments']],
+                                              job_id=batch_id)
+                    with open(path, 'wb') as f:
+                        f.write(audio)
                 else:
-                    raise Exception(f"ffmpeg failed: {result.stderr}")
-                        
-            except Exception as e:
-                print(f"ffmpeg concatenation failed: {type(e).__name__}: {e}")
-                import traceback
-                traceback.print_exc()
-                
-                # Fallback: use first segment only
-                print("Warning: Using first segment only due to concatenation error.")
-                temp_path = segment_files[0]
+                    concat_segment_files(paths, path, job_id=batch_id)
+                doc['bytes'] = os.path.getsize(path)
         
-        print(f"Saving to: {temp_path}")
+        wall = time.monotonic() - started
+        job = job_store.get_job(batch_id)
+        stats = {
+            'documents': len(docs),
+            'total_segments': total,
+            'unique_segments': len(unique),
+            'duplicate_segments': total - len(unique),
+            'requests_saved': requests_saved,
+            'cache_hits': job['cache_hits'],
+            'cache_misses': job['cache_misses'],
+            'wall_ms': round(wall * 1000),
+            'segments_per_sec': round(total / wall, 2) if wall else None,
+            'documents_per_sec': round(len(docs) / wall, 2) if wall else None,
+            'audio_bytes': sum(doc['bytes'] for doc in docs),
+        }
+        manifest = {
+            'batch_id': batch_id,
+            'stats': stats,
+            'documents': [dict({key: doc[key] for key in ('id', 'voice', 'chars', 'file', 'bytes')},
+                               segments=len(doc['segments'])) for doc in docs],
+        }
+        output_bytes.inc(stats['audio_bytes'], endpoint='batch')
+        logger.info("Batch %s: done in %dms (%d/%d segments synthesized)",
+                    batch_id, stats['wall_ms'], stats['unique_segments'], stats['total_segments'])
         
-        if not os.path.exists(temp_path):
-            raise Exception(f"Audio file was not created at {temp_path}")
+        if output_format == 'manifest':
+            for doc in manifest['documents']:
+                doc['url'] = f"/api/batch/{batch_id}/{doc['id']}"
+            manifest_path = os.path.join(directory, 'manifest.json')
+            with open(manifest_path, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, ensure_ascii=False)
+            job_store.set_status(batch_id, 'done', result_path=manifest_path)
+            return jsonify(manifest)
         
-        print(f"File size: {os.path.getsize(temp_path)} bytes")
-        print(f"Audio generated successfully: {temp_path}")
+        # The archive is built on disk from the output files and streamed from there
+        zip_path = os.path.join(directory, 'batch.zip')
+        # MP3 does not compress further, so store entries as-is
+        with zipfile.ZipFile(zip_path + '.tmp', 'w', zipfile.ZIP_STORED) as archive:
+            for doc in docs:
+                path = os.path.join(directory, doc['file'])
+                archive.write(path, doc['file'])
+                os.remove(path)
+            archive.writestr('manifest.json', json.dumps(manifest, ensure_ascii=False, indent=2))
+        os.replace(zip_path + '.tmp', zip_path)
+        job_store.set_status(batch_id, 'done')
+        response = send_file(
+            zip_path,
+            mimetype='application/zip',
+            as_attachment=True,
+            download_name=f'tts_batch_{datetime.now().strftime("%Y%m%d_%H%M%S")}.zip'
+        )
+        response.headers.update({
+            'X-Batch-Id': batch_id,
+            'X-Batch-Documents': str(stats['documents']),
+            'X-Batch-Total-Segments': str(stats['total_segments']),
+            'X-Batch-Unique-Segments': str(stats['unique_segments']),
+            'X-Batch-Wall-Ms': str(stats['wall_ms']),
+        })
+        spool.mark_delivered(batch_id)
+        return response
+    
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except SpoolFull as e:
+        logger.warning("Batch %s: %s", batch_id, e)
+        job_store.set_status(batch_id, 'failed', error=str(e))
+        return jsonify({'error': str(e)}), 507
+    except Exception as e:
+        logger.exception("generate_batch failed: %s: %s", type(e).__name__, e)
+        if batch_id and job_store.get_job(batch_id):
+            job_store.set_status(batch_id, 'failed', error=str(e))
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/batch/<batch_id>', methods=['GET'])
+def get_batch(batch_id):
+    """Manifest of a batch generated with format=manifest"""
+    job = job_store.get_job(batch_id)
+    if job is None or job['kind'] != 'batch':
+        return jsonify({'error': 'Batch not found'}), 404
+    if job['status'] != 'done' or not job['result_path']:
+        return jsonify({'error': f"Batch is {job['status']}", 'status': job['status']}), 409
+    if not os.path.exists(job['result_path']):
+        return jsonify({'error': 'Result is no longer available'}), 410
+    return send_file(job['result_path'], mimetype='application/json')
+
+@app.route('/api/batch/<batch_id>/<doc_id>', methods=['GET'])
+def get_batch_document(batch_id, doc_id):
+    """Download one document of a batch generated with format=manifest"""
+    job = job_store.get_job(batch_id)
+    if job is None or job['kind'] != 'batch':
+        return jsonify({'error': 'Batch not found'}), 404
+    if doc_id != batch_document_id(doc_id, set()):
+        return jsonify({'error': 'Document not found'}), 404
+    path = os.path.join(job_dir(batch_id), f'{doc_id}.mp3')
+    if not os.path.exists(path):
+        return jsonify({'error': 'Document not found'}), 404
+    response = send_file(path, mimetype='audio/mpeg', as_attachment=True, download_name=f'{doc_id}.mp3')
+    spool.mark_delivered(batch_id)
+    return response
+
+def format_sse(event):
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+
+@app.route('/api/events/<task_id>', methods=['GET'])
+@gated(event_gate)
+def stream_events(task_id):
+    """Server-Sent Events stream of a task's progress, pushed only when something changes
+    
+    Event types: queued, started, segment_done, retry, throttle_wait,
+    concat_start, done and failed. Reconnecting clients resume via Last-Event-ID.
+    """
+    try:
+        last_id = int(request.headers.get('Last-Event-ID') or request.args.get('after', 0))
+    except ValueError:
+        last_id = 0
+    
+    def generate():
+        nonlocal last_id
+        yield 'retry: 2000\n\n'
+        waited_for_job = 0.0
+        while True:
+            events = job_store.wait_for_events(task_id, last_id, timeout=15.0)
+            if not events:
+                # The client may subscribe before the job exists; give up after a while
+                if job_store.get_job(task_id) is None:
+                    waited_for_job += 15.0
+                    if waited_for_job >= 60.0:
+                        return
+                yield ': keep-alive\n\n'
+                continue
+            for event in events:
+                last_id = event['id']
+                yield format_sse(event)
+                if event['type'] in ('done', 'failed'):
+                    return
+    
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness: the process is up and serving requests"""
+    return jsonify({'status': 'ok', 'uptime': round(time.monotonic() - started_at, 3)})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness: 200 once the engine is warm and the job store answers, 503 until then"""
+    ready, details = readiness()
+    response = jsonify(dict(details, status='ready' if ready else 'warming'))
+    response.status_code = 200 if ready else 503
+    return response
+
+@app.route('/api/limiter', methods=['GET'])
+def get_limiter():
+    """Get the rate limiter settings and its current adaptive state"""
+    return jsonify({'settings': limiter.settings(), 'state': limiter.snapshot(),
+                    'workers': app.config['WORKERS'],
+                    'gates': {gate.name: gate.stats() for gate in (heavy_gate, event_gate)},
+                    'upstream': backend.stats(),
+                    'scheduler': scheduler.stats()})
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus metrics for the generation pipeline"""
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+@app.route('/api/spool', methods=['GET'])
+def get_spool_stats():
+    """Get spool disk usage, limits and reclamation totals"""
+    return jsonify(spool.stats())
+
+@app.route('/api/cache', methods=['GET'])
+def get_cache_stats():
+    """Get segment cache usage, lifetime hit/miss counts and coalesced in-flight work"""
+    stats = segment_cache.stats()
+    stats['single_flight'] = dict(segment_flights.stats(), jobs_joined=int(coalesced_total.value(level='job')))
+    return jsonify(stats)
+
+@app.route('/api/generate', methods=['POST'])
+@gated(heavy_gate)
+def generate_speech():
+    """Generate speech from text with emotions"""
+    task_id = None
+    try:
+        data = request.json
+        text = data.get('text', '')
+        voice = data.get('voice', 'en-US-AriaNeural')
+        task_id = data.get('task_id') or uuid.uuid4().hex
+        if not isinstance(task_id, str) or not TASK_ID.fullmatch(task_id):
+            return jsonify({'error': 'Invalid task_id'}), 400
+        
+        error = validate_text(text)
+        if error:
+            return jsonify({'error': error}), 400
+        streaming = data.get('stream') or request.args.get('stream') == '1'
+        try:
+            # Loudness normalization needs the whole output, so streams are never post-processed
+            use_postprocess = not streaming and wants_postprocess(data.get('postprocess'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # Parse text, get prosody data for each segment and plan the requests
+        prosody_segments, requests_saved, parse_ms = parse_document(text)
+        logger.info("Task %s: voice %s, %d characters, %d segments (%d requests saved by planning)",
+                    task_id, voice, len(text), len(prosody_segments), requests_saved)
+        client = client_id()
+        busy = scheduler_busy(client, len(prosody_segments))
+        if busy:
+            return busy
+        
+        # Track progress in the job store; a task id names one job for good
+        try:
+            job_store.create_job(task_id, voice, prosody_segments, kind='sync', status='running',
+                                 text_length=len(text), worker=job_runner.worker_id,
+                                 requests_saved=requests_saved, postprocess=use_postprocess, client=client)
+        except JobExists as e:
+            return jsonify({'error': str(e)}), 409
+        job_store.add_stage_times(task_id, parse_ms=parse_ms)
+        
+        # Show all segments for debugging
+        if logger.isEnabledFor(logging.DEBUG):
+            for idx, seg in enumerate(prosody_segments):
+                logger.debug("Segment %d: [%s] %.50r", idx, seg['emotion'], seg['text'])
+        
+        # Synthesize all segments concurrently; the scheduler and the shared limiter pace them
+        ticket = Ticket(client, task_id, job_priority(len(prosody_segments), 'sync'))
+        futures = dispatch_segments(prosody_segments, voice, task_id, ticket=ticket)
+        job = job_store.get_job(task_id)
+        cache_headers = {
+            'X-Cache-Hits': str(job['cache_hits']),
+            'X-Cache-Misses': str(job['cache_misses']),
+            'X-Requests-Saved': str(requests_saved),
+        }
+        
+        # Streaming mode: send each segment as soon as it and all earlier ones are ready
+        if streaming:
+            return Response(
+                stream_segments(futures, task_id),
+                mimetype='audio/mpeg',
+                headers={
+                    'Cache-Control': 'no-store',
+                    'X-Accel-Buffering': 'no',
+                    **cache_headers,
+                }
+            )
+        
+        # Collect results in prosody_segments order and join them in memory
+        audio_segments = collect_segments(futures)
+        job_store.add_event(task_id, 'concat_start', segments=len(audio_segments))
+        if use_postprocess:
+            audio = postprocess_audio(audio_segments, [seg['prosody']['volume'] for seg in prosody_segments],
+                                      job_id=task_id)
+        else:
+            audio = concat_audio(audio_segments, job_id=task_id)
+        output_bytes.inc(len(audio), endpoint='generate')
+        logger.info("Task %s: %d bytes of audio", task_id, len(audio))
+        job_store.set_status(task_id, 'done')
         
         # Return the audio file
-        return send_file(
-            temp_path,
+        response = send_file(
+            io.BytesIO(audio),
             mimetype='audio/mpeg',
             as_attachment=True,
             download_name=f'tts_{datetime.now().strftime("%Y%m%d_%H%M%S")}.mp3'
         )
+        response.headers.update(cache_headers)
+        return response
         
     except Exception as e:
-        print(f"ERROR in generate_speech: {type(e).__name__}: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("generate_speech failed: %s: %s", type(e).__name__, e)
+        if task_id and job_store.get_job(task_id):
+            job_store.set_status(task_id, 'failed', error=str(e))
         return jsonify({'error': str(e)}), 500
-    finally:
-        # Clean up progress tracker after some time
-        if task_id and task_id in progress_tracker:
-            import threading
-            threading.Timer(60.0, lambda tid=task_id: progress_tracker.pop(tid, None)).start()
+
+spool.cleanup_startup()
+spool.start()
+job_runner.start()
+
+if app.config['WARMUP']:
+    threading.Thread(target=warm_up, name='warmup', daemon=True).start()
+else:
+    warmup_done.set()
+
+if app.config['PREVIEW_WARM_LOCALES']:
+    threading.Thread(target=warm_previews, args=(app.config['PREVIEW_WARM_LOCALES'],),
+                     name='preview-warmup-start', daemon=True).start()
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    # Development server; use serve.py in production
+    app.run(debug=app.config['DEBUG_SERVER'], host='0.0.0.0', port=5000, threaded=True)
@@ -0,0 +1,95 @@
+"""
+Benchmark joining segment MP3s: ffmpeg concat demuxer vs in-memory frame concat
+
+Usage:
+    python benchmarks/bench_concat.py                  # 10, 100 and 500 segments
+    python benchmarks/bench_concat.py --segments 50 --repeat 5
+
+Segments are generated once with the bundled ffmpeg in the format edge-tts
+returns (24 kHz mono 48 kbps). The ffmpeg route is what /api/generate used to
+do: write every segment to a temp file, write a concat list and run
+`ffmpeg -f concat -c copy`, then read the result back.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import imageio_ffmpeg
+
+import mp3_concat
+
+
+def make_segment(ffmpeg_exe, directory, seconds, frequency):
+    path = os.path.join(directory, f'src_{frequency}.mp3')
+    subprocess.run(
+        [ffmpeg_exe, '-loglevel', 'error', '-f', 'lavfi', '-i',
+         f'sine=frequency={frequency}:duration={seconds}',
+         '-ar', '24000', '-ac', '1', '-b:a', '48k', '-y', path],
+        check=True)
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def ffmpeg_concat(ffmpeg_exe, segments):
+    with tempfile.TemporaryDirectory(prefix='bench_concat_') as temp_dir:
+        concat_file = os.path.join(temp_dir, 'concat.txt')
+        with open(concat_file, 'w', encoding='utf-8') as f:
+            for idx, audio in enumerate(segments):
+                seg_file = os.path.join(temp_dir, f'seg_{idx:05d}.mp3')
+                with open(seg_file, 'wb') as seg:
+                    seg.write(audio)
+                f.write(f"file '{seg_file}'\n")
+        output_path = os.path.join(temp_dir, 'result.mp3')
+        subprocess.run(
+            [ffmpeg_exe, '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', concat_file,
+             '-c', 'copy', '-y', output_path],
+            check=True)
+        with open(output_path, 'rb') as f:
+            return f.read()
+
+
+def time_calls(fn, count):
+    timings = []
+    result = None
+    for _ in range(count):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return timings, result
+
+
+def report(label, timings, size):
+    print(f"  {label:<22} median={statistics.median(timings) * 1000:9.2f}ms  "
+          f"min={min(timings) * 1000:9.2f}ms  output={size / 1024:8.1f}KB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--segments', type=int, nargs='+', default=[10, 100, 500])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seconds', type=float, default=3.0, help='duration of each segment')
+    args = parser.parse_args()
+
+    ffmpeg_exe = imageio_ffmpeg.get_ffmpeg_exe()
+    with tempfile.TemporaryDirectory(prefix='bench_concat_src_') as directory:
+        sources = [make_segment(ffmpeg_exe, directory, args.seconds, freq) for freq in (440, 550, 660)]
+
+    for count in args.segments:
+        segments = [sources[i % len(sources)] for i in range(count)]
+        print(f"\n{count} segments ({sum(map(len, segments)) / 1024:.1f}KB of input)")
+        before, old = time_calls(lambda: ffmpeg_concat(ffmpeg_exe, segments), args.repeat)
+        after, new = time_calls(lambda: mp3_concat.concat(segments), args.repeat)
+        report("ffmpeg concat demuxer", before, len(old))
+        report("in-memory frames", after, len(new))
+        print(f"  Speedup: {statistics.median(before) / statistics.median(after):.0f}x")
+
+
+if __name__ == '__main__':
+    main()
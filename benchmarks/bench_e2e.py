@@ -0,0 +1,236 @@
+"""
+End-to-end benchmark of /api/generate on the offline fake backend
+
+Usage:
+    python benchmarks/bench_e2e.py                           # default matrix
+    python benchmarks/bench_e2e.py --sizes 5000 --concurrency 1 8 --jobs 16
+    python benchmarks/bench_e2e.py --latency 0.2 --throttle-rate 0.05
+
+Every scenario (document size x client concurrency) starts a fresh server
+process with TTS_BACKEND=fake and the segment cache disabled, so nothing
+touches the network and every segment really goes through the limiter,
+synthesis pool, job store and concatenation. Clients POST emotion-tagged
+documents with ?stream=1 and the benchmark reports:
+
+  segments/sec   segments synthesized per second of wall time
+  p50 / p99      job latency (request sent -> last byte received)
+  TTFB p50       time to the first audio byte
+  peak RSS       high-water resident memory of the server process
+"""
+import argparse
+import http.client
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+EMOTIONS = ['neutral', 'happy', 'sad', 'excited', 'calm', 'serious', 'questioning']
+
+
+def make_document(chars, salt):
+    """Emotion-tagged text of at most chars characters, unique per salt"""
+    parts = []
+    length = 0
+    sentence = 0
+    while True:
+        text = (f"This is sentence {sentence} of benchmark document {salt}, "
+                f"long enough to look like real narration. ")
+        if sentence % 3 == 0:
+            text = f"[{EMOTIONS[(sentence // 3) % len(EMOTIONS)]}] " + text
+        if parts and length + len(text) > chars:
+            return ''.join(parts)
+        parts.append(text)
+        length += len(text)
+        sentence += 1
+
+
+def peak_rss_bytes():
+    try:
+        import resource
+    except ImportError:  # Windows
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset
+        except Exception:
+            return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def serve(port):
+    """Child process: run the app until stdin closes, then report peak RSS"""
+    from werkzeug.serving import make_server
+    import app as tts_app
+
+    server = make_server('127.0.0.1', port, tts_app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"READY {server.server_port}", flush=True)
+    sys.stdin.read()
+    print(f"PEAK_RSS {peak_rss_bytes()}", flush=True)
+    server.shutdown()
+
+
+def start_server(args, directory):
+    env = dict(os.environ)
+    env.update({
+        'TTS_BACKEND': 'fake',
+        'TTS_FAKE_LATENCY': str(args.latency),
+        'TTS_FAKE_PER_CHAR': str(args.per_char),
+        'TTS_FAKE_JITTER': str(args.jitter),
+        'TTS_FAKE_THROTTLE_RATE': str(args.throttle_rate),
+        'TTS_FAKE_FAILURE_RATE': str(args.failure_rate),
+        'TTS_CACHE_MAX_BYTES': '0',
+        'TTS_CACHE_DIR': os.path.join(directory, 'segments'),
+        'TTS_JOB_DB': os.path.join(directory, 'jobs.sqlite3'),
+        'TTS_JOB_DIR': os.path.join(directory, 'jobs'),
+        'TTS_VOICE_CATALOG_PATH': os.path.join(directory, 'voices.json'),
+        'TTS_PREVIEW_DIR': os.path.join(directory, 'previews'),
+        'TTS_RATE_LIMIT_RPS': str(args.rps),
+        'TTS_RATE_LIMIT_MAX_RPS': str(args.rps),
+        'TTS_RATE_LIMIT_BURST': str(args.synth_concurrency),
+        'TTS_CONCURRENCY': str(args.synth_concurrency),
+        'TTS_MAX_CONCURRENCY': str(args.synth_concurrency),
+    })
+    proc = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--serve'],
+        cwd=ROOT, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL, text=True)
+    for line in proc.stdout:
+        if line.startswith('READY '):
+            return proc, int(line.split()[1])
+    raise RuntimeError("Benchmark server failed to start")
+
+
+def stop_server(proc):
+    proc.stdin.close()
+    peak = None
+    for line in proc.stdout:
+        if line.startswith('PEAK_RSS '):
+            value = line.split()[1]
+            peak = int(value) if value != 'None' else None
+    proc.wait(timeout=30)
+    return peak
+
+
+def run_job(port, text, stream):
+    task_id = uuid.uuid4().hex
+    body = json.dumps({'text': text, 'voice': 'en-US-AriaNeural', 'task_id': task_id})
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=600)
+    started = time.perf_counter()
+    conn.request('POST', '/api/generate' + ('?stream=1' if stream else ''), body,
+                 {'Content-Type': 'application/json'})
+    response = conn.getresponse()
+    first = response.read1(65536) if hasattr(response, 'read1') else response.read(1)
+    ttfb = time.perf_counter() - started
+    size = len(first) + len(response.read())
+    latency = time.perf_counter() - started
+
+    conn.request('GET', f'/api/jobs/{task_id}')
+    job = json.loads(conn.getresponse().read())
+    conn.close()
+    return {
+        'ok': response.status == 200 and job.get('status') == 'done',
+        'ttfb': ttfb,
+        'latency': latency,
+        'bytes': size,
+        'segments': job.get('total', 0),
+    }
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_scenario(args, size, concurrency):
+    jobs = args.jobs or max(4, concurrency * 2)
+    with tempfile.TemporaryDirectory(prefix='bench_e2e_') as directory:
+        proc, port = start_server(args, directory)
+        try:
+            # One warm-up request so imports and first connections are not measured
+            run_job(port, make_document(200, 'warmup'), args.stream)
+            documents = [make_document(size, f'{size}-{concurrency}-{n}') for n in range(jobs)]
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                results = list(pool.map(lambda text: run_job(port, text, args.stream), documents))
+            wall = time.perf_counter() - started
+        finally:
+            peak = stop_server(proc)
+
+    ok = [r for r in results if r['ok']]
+    latencies = [r['latency'] for r in ok] or [0.0]
+    ttfbs = [r['ttfb'] for r in ok] or [0.0]
+    segments = sum(r['segments'] for r in ok)
+    return {
+        'size': size,
+        'concurrency': concurrency,
+        'jobs': jobs,
+        'failed': len(results) - len(ok),
+        'segments': segments,
+        'segments_per_sec': segments / wall if wall else 0.0,
+        'p50': statistics.median(latencies),
+        'p99': percentile(latencies, 99),
+        'ttfb_p50': statistics.median(ttfbs),
+        'peak_rss': peak,
+    }
+
+
+def report(row):
+    rss = f"{row['peak_rss'] / 1024 / 1024:7.1f}MB" if row['peak_rss'] else '    n/a'
+    print(f"{row['size']:>8} {row['concurrency']:>5} {row['jobs']:>5} {row['failed']:>6} "
+          f"{row['segments']:>8} {row['segments_per_sec']:>9.1f} {row['p50'] * 1000:>9.0f}ms "
+          f"{row['p99'] * 1000:>9.0f}ms {row['ttfb_p50'] * 1000:>9.0f}ms {rss}", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[2000, 20000, 100000],
+                        help='document sizes in characters')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16],
+                        help='concurrent clients')
+    parser.add_argument('--jobs', type=int, default=0, help='requests per scenario (default 2x concurrency)')
+    parser.add_argument('--no-stream', dest='stream', action='store_false',
+                        help='request whole files instead of streamed responses')
+    parser.add_argument('--latency', type=float, default=0.05, help='fake backend latency per segment (s)')
+    parser.add_argument('--per-char', type=float, default=0.0, help='extra fake latency per character (s)')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--rps', type=float, default=1000.0, help='rate limiter ceiling')
+    parser.add_argument('--synth-concurrency', type=int, default=16, help='segments in flight per server')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(0)
+        return
+
+    print(f"Fake backend: latency={args.latency}s per_char={args.per_char}s "
+          f"throttle={args.throttle_rate} failure={args.failure_rate}; "
+          f"{'streamed' if args.stream else 'whole-file'} responses")
+    print(f"{'chars':>8} {'conc':>5} {'jobs':>5} {'failed':>6} {'segments':>8} {'seg/s':>9} "
+          f"{'p50':>11} {'p99':>11} {'TTFB p50':>11} {'peak RSS':>9}")
+    rows = []
+    for size in args.sizes:
+        for concurrency in args.concurrency:
+            row = run_scenario(args, size, concurrency)
+            report(row)
+            rows.append(row)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
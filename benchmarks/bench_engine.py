@@ -0,0 +1,90 @@
+"""
+Benchmark per-segment overhead: subprocess-per-segment vs the in-process engine
+
+Usage:
+    python benchmarks/bench_engine.py                 # overhead only, no network
+    python benchmarks/bench_engine.py --live 10       # also synthesize 10 real segments each way
+
+The overhead run measures what each segment paid before any network I/O:
+starting an interpreter, importing edge_tts and creating an event loop,
+compared with handing a no-op job to the long-lived engine loop.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tts_engine import SynthesisEngine
+
+SUBPROCESS_STARTUP = "import asyncio, edge_tts; asyncio.run(asyncio.sleep(0))"
+
+
+def time_calls(fn, count):
+    timings = []
+    for _ in range(count):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(label, timings):
+    print(f"{label:<28} mean={statistics.mean(timings) * 1000:8.2f}ms  "
+          f"median={statistics.median(timings) * 1000:8.2f}ms  "
+          f"total={sum(timings):7.2f}s  (n={len(timings)})")
+
+
+def bench_overhead(count, engine):
+    print(f"\nPer-segment overhead ({count} segments, no network)")
+    before = time_calls(
+        lambda: subprocess.run([sys.executable, '-c', SUBPROCESS_STARTUP], check=True),
+        count)
+    after = time_calls(lambda: engine.run(asyncio.sleep(0)), count)
+    report("subprocess per segment", before)
+    report("in-process engine", after)
+    print(f"Saved per segment: {(statistics.mean(before) - statistics.mean(after)) * 1000:.1f}ms")
+
+
+def bench_live(count, engine, voice):
+    print(f"\nLive synthesis ({count} segments, voice {voice})")
+    script = os.path.join(ROOT, 'generate_tts_simple.py')
+    out_path = os.path.join(tempfile.gettempdir(), 'bench_engine_segment.mp3')
+    text = "The quick brown fox jumps over the lazy dog."
+    before = time_calls(
+        lambda: subprocess.run([sys.executable, script, out_path, voice, text], check=True,
+                               capture_output=True),
+        count)
+    after = time_calls(lambda: engine.synthesize(text, voice), count)
+    if os.path.exists(out_path):
+        os.remove(out_path)
+    report("subprocess per segment", before)
+    report("in-process engine", after)
+    print(f"Saved per segment: {(statistics.mean(before) - statistics.mean(after)) * 1000:.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=20, help='segments for the overhead run')
+    parser.add_argument('--live', type=int, default=0, help='segments for the live run (needs network)')
+    parser.add_argument('--voice', default='en-US-AriaNeural')
+    args = parser.parse_args()
+
+    engine = SynthesisEngine()
+    engine.start()
+    try:
+        bench_overhead(args.count, engine)
+        if args.live:
+            bench_live(args.live, engine, args.voice)
+    finally:
+        engine.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""
+Benchmark preview and short-job latency while long documents are queued
+
+Usage:
+    python benchmarks/bench_fairness.py
+    python benchmarks/bench_fairness.py --bulk-clients 4 --bulk-segments 200 --rate 2
+
+Starts serve.py on the offline fake backend with a fixed upstream rate
+(--rate segments/s) for each scenario:
+
+  priority      the default scheduler: interactive / short / bulk classes,
+                a worker kept for previews, per-client caps
+  no-priority   every job segment in one class, no worker reserved for
+                previews and no client cap: jobs are only shared
+                round-robin between clients (previews keep their class)
+
+--bulk-clients clients each queue a --bulk-segments document through
+/api/jobs. Another client then fetches previews of voices not rendered yet
+and runs short sync /api/generate jobs one after another. Reports their
+latency and the scheduler's queue wait per class from /api/limiter.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_load import free_port, request  # noqa: E402
+
+PREVIEW_VOICES = ['en-US-GuyNeural', 'en-GB-SoniaNeural', 'fr-FR-DeniseNeural']
+SCENARIOS = {
+    'priority': {},
+    'no-priority': {'TTS_INTERACTIVE_WORKERS': '0', 'TTS_CLIENT_CONCURRENCY': '1000',
+                    'TTS_SHORT_JOB_SEGMENTS': '0'},
+}
+
+
+def start_server(args, scenario, directory):
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        'TTS_BACKEND': 'fake',
+        'TTS_FAKE_LATENCY': str(args.latency),
+        'TTS_CACHE_MAX_BYTES': '0',
+        'TTS_CACHE_DIR': os.path.join(directory, 'segments'),
+        'TTS_JOB_DB': os.path.join(directory, 'jobs.sqlite3'),
+        'TTS_JOB_DIR': os.path.join(directory, 'jobs'),
+        'TTS_VOICE_CATALOG_PATH': os.path.join(directory, 'voices.json'),
+        'TTS_PREVIEW_DIR': os.path.join(directory, 'previews'),
+        'TTS_RATE_LIMIT_RPS': str(args.rate),
+        'TTS_RATE_LIMIT_MAX_RPS': str(args.rate),
+        'TTS_JOB_WORKERS': str(args.bulk_clients),
+        'TTS_LOG_LEVEL': 'WARNING',
+    })
+    env.update(SCENARIOS[scenario])
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'serve.py'), '--host', '127.0.0.1', '--port', str(port)],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            if request(port, 'GET', '/api/limiter', timeout=2)[0] == 200:
+                return proc, port
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("Server did not start")
+
+
+def bulk_document(segments, salt):
+    # Alternating emotions keep the planner from merging sentences
+    return ' '.join(f"[{'happy' if i % 2 else 'sad'}] Sentence {i} of document {salt}." for i in range(segments))
+
+
+def timed(port, method, path, body=None):
+    started = time.perf_counter()
+    status, _ = request(port, method, path, body)
+    return status, time.perf_counter() - started
+
+
+def run_scenario(args, scenario):
+    with tempfile.TemporaryDirectory(prefix='bench_fairness_') as directory:
+        proc, port = start_server(args, scenario, directory)
+        try:
+            for _ in range(args.bulk_clients):
+                status, _ = request(port, 'POST', '/api/jobs',
+                                    {'text': bulk_document(args.bulk_segments, uuid.uuid4().hex)})
+                assert status == 202, status
+            time.sleep(2.0)  # let the bulk segments fill the queue
+
+            previews = [timed(port, 'GET', f'/api/preview/{voice}') for voice in PREVIEW_VOICES]
+            shorts = [timed(port, 'POST', '/api/generate',
+                            {'text': f'Quick line {n}. [happy] Short and sweet! [sad] The end.',
+                             'task_id': uuid.uuid4().hex})
+                      for n in range(args.short_jobs)]
+            scheduler = json.loads(request(port, 'GET', '/api/limiter')[1])['scheduler']
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+    return {
+        'scenario': scenario,
+        'preview_ms': [round(t * 1000) for _, t in previews],
+        'short_ms': [round(t * 1000) for _, t in shorts],
+        'errors': sum(1 for status, _ in previews + shorts if status != 200),
+        'wait_ms': scheduler['wait_ms'],
+    }
+
+
+def report(row):
+    print(f"\n{row['scenario']}: errors {row['errors']}")
+    print(f"  previews     {', '.join(f'{ms} ms' for ms in row['preview_ms'])}")
+    print(f"  short jobs   median {statistics.median(row['short_ms'])} ms, max {max(row['short_ms'])} ms")
+    for priority, wait in row['wait_ms'].items():
+        if wait['count']:
+            print(f"  wait {priority:<12} n={wait['count']:<5} mean {wait['mean']:>9.1f} ms  max {wait['max']:>9.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), default=['priority', 'no-priority'])
+    parser.add_argument('--bulk-clients', type=int, default=2)
+    parser.add_argument('--bulk-segments', type=int, default=100)
+    parser.add_argument('--short-jobs', type=int, default=5)
+    parser.add_argument('--rate', type=float, default=4.0, help='upstream segments per second')
+    parser.add_argument('--latency', type=float, default=0.3, help='fake backend latency per segment (s)')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    print(f"{args.bulk_clients} x {args.bulk_segments}-segment documents queued, "
+          f"{args.rate:g} segments/s upstream, {args.latency * 1000:.0f} ms per segment")
+    rows = []
+    for scenario in args.scenarios:
+        row = run_scenario(args, scenario)
+        report(row)
+        rows.append(row)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
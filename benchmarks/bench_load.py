@@ -0,0 +1,238 @@
+"""
+Load test: latency of cheap endpoints while heavy jobs are running
+
+Usage:
+    python benchmarks/bench_load.py                       # gated vs ungated serving
+    python benchmarks/bench_load.py --workers 2 --heavy-clients 16 --duration 20
+
+Starts serve.py (waitress) on the offline fake backend for each scenario:
+
+  gated     the default production setup: admission gates for slow requests
+            and a thread pool with spare threads for everything else
+  ungated   the same server with a small fixed thread pool and no effective
+            gates, which is how a plain threaded WSGI setup behaves
+
+A probe client calls the cheap endpoints (voices, a warm preview, job
+progress, limiter state, metrics) in a loop, first on an idle server and
+then while --heavy-clients clients keep sync /api/generate requests and SSE
+progress streams running. Reports p50/p99/max probe latency per phase, the
+heavy requests completed and how many were turned away with 503.
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_e2e import make_document, percentile  # noqa: E402
+
+VOICE = 'en-US-AriaNeural'
+SCENARIOS = {
+    'gated': {},
+    'ungated': {'TTS_SERVER_THREADS': '8', 'TTS_HEAVY_REQUESTS': '1000', 'TTS_EVENT_STREAMS': '1000'},
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def request(port, method, path, body=None, timeout=120):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    try:
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        conn.request(method, path, json.dumps(body) if body is not None else None, headers)
+        response = conn.getresponse()
+        return response.status, response.read()
+    finally:
+        conn.close()
+
+
+def start_server(args, scenario, directory):
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        'TTS_BACKEND': 'fake',
+        'TTS_FAKE_LATENCY': str(args.latency),
+        'TTS_CACHE_MAX_BYTES': '0',
+        'TTS_CACHE_DIR': os.path.join(directory, 'segments'),
+        'TTS_JOB_DB': os.path.join(directory, 'jobs.sqlite3'),
+        'TTS_JOB_DIR': os.path.join(directory, 'jobs'),
+        'TTS_VOICE_CATALOG_PATH': os.path.join(directory, 'voices.json'),
+        'TTS_PREVIEW_DIR': os.path.join(directory, 'previews'),
+        'TTS_RATE_LIMIT_RPS': '200',
+        'TTS_RATE_LIMIT_MAX_RPS': '200',
+        'TTS_RATE_LIMIT_BURST': '16',
+        'TTS_CONCURRENCY': '16',
+        'TTS_MAX_CONCURRENCY': '16',
+        'TTS_LOG_LEVEL': 'WARNING',
+    })
+    env.update(SCENARIOS[scenario])
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'serve.py'), '--host', '127.0.0.1', '--port', str(port),
+         '--workers', str(args.workers)],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            if request(port, 'GET', '/api/limiter', timeout=2)[0] == 200:
+                return proc, port
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("Server did not start")
+
+
+def probe(port, task_id, stop, samples):
+    """Call the cheap endpoints round-robin until stop is set"""
+    paths = ['/api/voices', f'/api/preview/{VOICE}', f'/api/progress/{task_id}', '/api/limiter', '/metrics']
+    n = 0
+    while not stop.is_set():
+        path = paths[n % len(paths)]
+        started = time.perf_counter()
+        try:
+            status, _ = request(port, 'GET', path, timeout=60)
+        except OSError:
+            status = None
+        samples.append((path.split('/')[2] if path.startswith('/api/') else 'metrics',
+                        time.perf_counter() - started, status))
+        n += 1
+        time.sleep(0.02)
+
+
+def heavy_client(port, stop, results, chars):
+    """Sync generation plus an SSE subscriber, over and over"""
+    while not stop.is_set():
+        task_id = uuid.uuid4().hex
+        events = threading.Thread(target=listen_events, args=(port, task_id), daemon=True)
+        events.start()
+        try:
+            status, _ = request(port, 'POST', '/api/generate',
+                                {'text': make_document(chars, task_id), 'voice': VOICE, 'task_id': task_id},
+                                timeout=600)
+        except OSError:
+            status = None
+        results.append(status)
+        if status == 503:
+            time.sleep(1.0)
+
+
+def listen_events(port, task_id):
+    try:
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+        conn.request('GET', f'/api/events/{task_id}')
+        response = conn.getresponse()
+        while response.read1(4096) if hasattr(response, 'read1') else response.read(4096):
+            pass
+        conn.close()
+    except (OSError, http.client.HTTPException):
+        pass
+
+
+def measure(port, task_id, seconds):
+    stop = threading.Event()
+    samples = []
+    thread = threading.Thread(target=probe, args=(port, task_id, stop, samples), daemon=True)
+    thread.start()
+    time.sleep(seconds)
+    stop.set()
+    thread.join()
+    return samples
+
+
+def summarize(samples):
+    latencies = [s[1] for s in samples if s[2] == 200] or [0.0]
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for s in samples if s[2] != 200),
+        'p50_ms': statistics.median(latencies) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'max_ms': max(latencies) * 1000,
+    }
+
+
+def run_scenario(args, scenario):
+    with tempfile.TemporaryDirectory(prefix='bench_load_') as directory:
+        proc, port = start_server(args, scenario, directory)
+        try:
+            # Warm the preview and create a job whose progress the probe reads
+            request(port, 'GET', f'/api/preview/{VOICE}')
+            task_id = 'probe-' + uuid.uuid4().hex
+            request(port, 'POST', '/api/generate', {'text': 'Warm up.', 'voice': VOICE, 'task_id': task_id})
+
+            idle = summarize(measure(port, task_id, args.duration / 2))
+
+            stop = threading.Event()
+            results = []
+            clients = [threading.Thread(target=heavy_client, args=(port, stop, results, args.chars), daemon=True)
+                       for _ in range(args.heavy_clients)]
+            for client in clients:
+                client.start()
+            time.sleep(1.0)  # let the heavy requests occupy the server
+            loaded = summarize(measure(port, task_id, args.duration))
+            stop.set()
+            for client in clients:
+                client.join(timeout=120)
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+    return {
+        'scenario': scenario,
+        'idle': idle,
+        'loaded': loaded,
+        'heavy_done': sum(1 for status in results if status == 200),
+        'heavy_rejected': sum(1 for status in results if status == 503),
+        'heavy_failed': sum(1 for status in results if status not in (200, 503)),
+    }
+
+
+def report(row):
+    for phase in ('idle', 'loaded'):
+        stats = row[phase]
+        print(f"{row['scenario']:>8} {phase:>7} {stats['requests']:>6} {stats['errors']:>6} "
+              f"{stats['p50_ms']:>8.1f}ms {stats['p99_ms']:>8.1f}ms {stats['max_ms']:>8.1f}ms", flush=True)
+    print(f"{'':>8} heavy: {row['heavy_done']} done, {row['heavy_rejected']} rejected (503), "
+          f"{row['heavy_failed']} failed", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), default=['gated', 'ungated'])
+    parser.add_argument('--workers', type=int, default=1, help='server processes')
+    parser.add_argument('--heavy-clients', type=int, default=24, help='concurrent sync generation clients')
+    parser.add_argument('--chars', type=int, default=3000, help='characters per generated document')
+    parser.add_argument('--latency', type=float, default=0.5, help='fake backend latency per segment (s)')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds of probing under load')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    print(f"{args.heavy_clients} heavy clients, {args.chars}-char documents, fake latency {args.latency}s, "
+          f"{args.workers} worker(s)")
+    print(f"{'scenario':>8} {'phase':>7} {'probes':>6} {'errors':>6} {'p50':>10} {'p99':>10} {'max':>10}")
+    rows = []
+    for scenario in args.scenarios:
+        row = run_scenario(args, scenario)
+        report(row)
+        rows.append(row)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Benchmark per-segment latency with and without pooled upstream connections
+
+Usage:
+    python benchmarks/bench_pool.py                          # 60 segments, 1 and 4 at a time
+    python benchmarks/bench_pool.py --handshake-delay 0.3 --concurrency 1 6
+
+Runs against the local Edge stand-in (edge_standin.py), which charges
+--handshake-delay for every new connection and --turn-delay for every
+synthesis turn, so no network is needed:
+
+  edge-tts   edge_tts.Communicate per segment, as the engine did before:
+             a new client session and WebSocket for every segment
+  pooled     EdgeSessionPool: warm connections reused across segments
+
+Reports mean/p50/p99 per-segment latency, connections opened and the
+latency saved per segment.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import edge_tts.communicate  # noqa: E402
+
+from bench_e2e import percentile  # noqa: E402
+from edge_standin import EdgeStandIn  # noqa: E402
+from tts_backends import create_backend  # noqa: E402
+
+VOICE = 'en-US-AriaNeural'
+
+
+def run_segments(backend, count, concurrency):
+    def one(i):
+        started = time.perf_counter()
+        backend.synthesize(f"Segment number {i}. The quick brown fox jumps over the lazy dog.", VOICE)
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(one, range(count)))
+
+
+def measure(mode, args, concurrency):
+    server = EdgeStandIn(handshake_delay=args.handshake_delay, turn_delay=args.turn_delay)
+    url = server.start()
+    if mode == 'edge-tts':
+        # Point the library's own per-segment connection at the stand-in
+        original_url = edge_tts.communicate.WSS_URL
+        edge_tts.communicate.WSS_URL = url
+        backend = create_backend('edge', pool_size=0)
+    else:
+        backend = create_backend('edge', pool_size=concurrency, url=url)
+    try:
+        timings = run_segments(backend, args.segments, concurrency)
+    finally:
+        backend.close()
+        server.stop()
+        if mode == 'edge-tts':
+            edge_tts.communicate.WSS_URL = original_url
+    return {
+        'mean_ms': statistics.mean(timings) * 1000,
+        'p50_ms': statistics.median(timings) * 1000,
+        'p99_ms': percentile(timings, 99) * 1000,
+        'connections': server.connections,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--segments', type=int, default=60)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--handshake-delay', type=float, default=0.15,
+                        help='simulated TCP+TLS+WebSocket setup per connection (s)')
+    parser.add_argument('--turn-delay', type=float, default=0.1, help='simulated synthesis time per segment (s)')
+    args = parser.parse_args()
+
+    print(f"{args.segments} segments, handshake {args.handshake_delay * 1000:.0f}ms, "
+          f"synthesis {args.turn_delay * 1000:.0f}ms per segment")
+    print(f"{'mode':>9} {'conc':>4} {'mean':>10} {'p50':>10} {'p99':>10} {'connections':>12}")
+    for concurrency in args.concurrency:
+        rows = {mode: measure(mode, args, concurrency) for mode in ('edge-tts', 'pooled')}
+        for mode, row in rows.items():
+            print(f"{mode:>9} {concurrency:>4} {row['mean_ms']:>8.1f}ms {row['p50_ms']:>8.1f}ms "
+                  f"{row['p99_ms']:>8.1f}ms {row['connections']:>12}")
+        saved = rows['edge-tts']['mean_ms'] - rows['pooled']['mean_ms']
+        print(f"{'':>9} {'':>4} saved {saved:.1f}ms per segment ({saved / rows['edge-tts']['mean_ms']:.0%})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Cost of the NumPy post-processing stage per minute of audio
+
+Usage:
+    python benchmarks/bench_postprocess.py                    # 1, 10 and 60 minutes
+    python benchmarks/bench_postprocess.py --minutes 5 --segment-seconds 4
+
+Builds speech-like input (tone bursts with leading/trailing silence, at the
+24 kHz mono 48 kbps edge-tts format) cut into segments with alternating
+per-emotion gains, then runs postprocess.process() on it and compares with
+plain frame-level concatenation. Reports, per audio minute:
+
+  analyse    first decode of all segments, for trimming and loudness statistics
+  render+enc second decode, with gain, crossfades and normalization applied
+             block by block on the way into the encoder
+  total      wall time per audio minute and the real-time factor
+  peak mem   Python/NumPy allocation high-water mark (tracemalloc)
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import mp3_concat  # noqa: E402
+import postprocess  # noqa: E402
+
+GAINS = ['+0dB', '-15dB', '+5dB', '+12dB', '-5dB', '+0dB', '-10dB']
+
+
+def make_segment(ffmpeg_exe, seconds, frequency):
+    """MP3 of a tone burst padded with silence on both sides"""
+    voiced = max(0.2, seconds - 0.6)
+    result = subprocess.run(
+        [ffmpeg_exe, '-v', 'error', '-f', 'lavfi', '-i',
+         f'sine=frequency={frequency}:duration={voiced}:sample_rate=24000',
+         '-af', 'adelay=300,apad=pad_dur=0.3,volume=0.3', '-ar', '24000', '-ac', '1',
+         '-c:a', 'libmp3lame', '-b:a', '48k', '-f', 'mp3', 'pipe:1'],
+        capture_output=True, check=True)
+    return result.stdout
+
+
+def run(ffmpeg_exe, templates, minutes, segment_seconds, args):
+    count = max(1, round(minutes * 60 / segment_seconds))
+    segments = [templates[n % len(templates)] for n in range(count)]
+    gains = [postprocess.parse_db(GAINS[n % len(GAINS)]) for n in range(count)]
+
+    started = time.perf_counter()
+    mp3_concat.concat(segments)
+    concat_s = time.perf_counter() - started
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    audio, stats = postprocess.process(segments, gains, ffmpeg_exe, crossfade_ms=args.crossfade_ms,
+                                       target_dbfs=args.target_dbfs)
+    wall = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    audio_minutes = stats['input_seconds'] / 60
+    per_minute = (lambda ms: ms / audio_minutes) if audio_minutes else (lambda ms: 0.0)
+    return {
+        'minutes': round(audio_minutes, 2),
+        'segments': count,
+        'analyse': per_minute(stats['analyse_ms']),
+        'render': per_minute(stats['render_encode_ms']),
+        'total': per_minute(wall * 1000),
+        'concat': per_minute(concat_s * 1000),
+        'realtime': stats['input_seconds'] / wall if wall else 0.0,
+        'peak_mb': peak / 1024 / 1024,
+        'bytes': len(audio),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--minutes', type=float, nargs='+', default=[1, 10, 60],
+                        help='audio lengths to process')
+    parser.add_argument('--segment-seconds', type=float, default=6.0, help='length of each segment')
+    parser.add_argument('--crossfade-ms', type=float, default=15)
+    parser.add_argument('--target-dbfs', type=float, default=-20.0)
+    args = parser.parse_args()
+
+    import imageio_ffmpeg
+    ffmpeg_exe = imageio_ffmpeg.get_ffmpeg_exe()
+    templates = [make_segment(ffmpeg_exe, args.segment_seconds, frequency)
+                 for frequency in (220, 330, 440, 550)]
+
+    print("ms per audio minute")
+    print(f"{'minutes':>8} {'segments':>8} {'analyse':>8} {'render+enc':>10} "
+          f"{'total':>8} {'concat':>8} {'x realtime':>10} {'peak mem':>9}")
+    for minutes in args.minutes:
+        row = run(ffmpeg_exe, templates, minutes, args.segment_seconds, args)
+        print(f"{row['minutes']:>8.1f} {row['segments']:>8} {row['analyse']:>8.1f} "
+              f"{row['render']:>10.1f} {row['total']:>8.1f} {row['concat']:>8.2f} {row['realtime']:>10.0f} "
+              f"{row['peak_mb']:>7.1f}MB", flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""
+Benchmark cold start: import time and time to the first served request
+
+Usage:
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --runs 10 --import-budget-ms 400 --first-request-budget-ms 1200
+
+Each run uses a fresh interpreter and empty cache directories. The default
+fake backend keeps the measurement offline; with --backend edge the startup
+voice catalog refresh goes upstream and the times include that request.
+
+  import          `import app` in a new process (configuration, stores,
+                  backend and scheduler set up, no request served)
+  first request   serve.py started until /healthz first answers 200
+  ready           serve.py started until /readyz answers 200 (backend,
+                  ffmpeg and numpy loaded by the background warm-up)
+
+Reports the median and worst of --runs runs and the warm-up steps from
+/readyz. Exits with status 1 if the median import or first-request time is
+over its budget, so it can gate a CI job; ready time is reported only,
+since it includes the one-off ffmpeg lookup and numpy import.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_load import free_port, request  # noqa: E402
+
+IMPORT_SNIPPET = ("import time; started = time.perf_counter(); import app; "
+                  "print((time.perf_counter() - started) * 1000)")
+
+
+def server_env(args, directory):
+    env = dict(os.environ)
+    env.update({
+        'TTS_BACKEND': args.backend,
+        'TTS_CACHE_DIR': os.path.join(directory, 'segments'),
+        'TTS_JOB_DB': os.path.join(directory, 'jobs.sqlite3'),
+        'TTS_JOB_DIR': os.path.join(directory, 'jobs'),
+        'TTS_VOICE_CATALOG_PATH': os.path.join(directory, 'voices.json'),
+        'TTS_PREVIEW_DIR': os.path.join(directory, 'previews'),
+        'TTS_LOG_LEVEL': 'WARNING',
+    })
+    return env
+
+
+def measure_import(args):
+    with tempfile.TemporaryDirectory(prefix='bench_startup_') as directory:
+        output = subprocess.run([sys.executable, '-c', IMPORT_SNIPPET], cwd=ROOT, env=server_env(args, directory),
+                                capture_output=True, text=True, check=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def wait_for(port, path, started, deadline):
+    while time.monotonic() < deadline:
+        try:
+            status, body = request(port, 'GET', path, timeout=2)
+            if status == 200:
+                return (time.monotonic() - started) * 1000, json.loads(body)
+        except OSError:
+            pass
+        time.sleep(0.005)
+    raise RuntimeError(f"{path} did not answer 200 in time")
+
+
+def measure_server(args):
+    with tempfile.TemporaryDirectory(prefix='bench_startup_') as directory:
+        port = free_port()
+        started = time.monotonic()
+        proc = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, 'serve.py'), '--host', '127.0.0.1', '--port', str(port)],
+            cwd=ROOT, env=server_env(args, directory), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            deadline = started + args.timeout
+            first_ms, _ = wait_for(port, '/healthz', started, deadline)
+            ready_ms, readiness = wait_for(port, '/readyz', started, deadline)
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+    return first_ms, ready_ms, readiness['warmup']
+
+
+def summary(name, values, budget=None):
+    median = statistics.median(values)
+    line = f"  {name:<14} median {median:>7.0f} ms   max {max(values):>7.0f} ms"
+    if budget is not None:
+        line += f"   budget {budget:.0f} ms {'OK' if median <= budget else 'OVER'}"
+    print(line)
+    return median
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--backend', default='fake',
+                        help='TTS_BACKEND of the measured server (edge also refreshes the voice catalog upstream)')
+    parser.add_argument('--import-budget-ms', type=float, default=500)
+    parser.add_argument('--first-request-budget-ms', type=float, default=1500)
+    parser.add_argument('--timeout', type=float, default=60, help='give up on a server after this many seconds')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    imports, firsts, readies = [], [], []
+    for _ in range(args.runs):
+        imports.append(measure_import(args))
+        first_ms, ready_ms, warmup = measure_server(args)
+        firsts.append(first_ms)
+        readies.append(ready_ms)
+
+    print(f"{args.runs} cold starts, {args.backend} backend")
+    import_ms = summary('import', imports, args.import_budget_ms)
+    first_ms = summary('first request', firsts, args.first_request_budget_ms)
+    summary('ready', readies)
+    print("  warm-up (last run): " + ', '.join(
+        f"{name} {step['ms']:.0f} ms" if 'ms' in step else f"{name} failed ({step['error']})"
+        for name, step in warmup.items()))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'import_ms': imports, 'first_request_ms': firsts, 'ready_ms': readies,
+                       'warmup': warmup}, f, indent=2)
+
+    over = [name for name, value, budget in (('import', import_ms, args.import_budget_ms),
+                                             ('first request', first_ms, args.first_request_budget_ms))
+            if value > budget]
+    if over:
+        print(f"Over budget: {', '.join(over)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
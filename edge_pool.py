@@ -0,0 +1,245 @@
+"""
+Pooled WebSocket client for the Edge read-aloud synthesis service.
+
+edge_tts.Communicate opens a new aiohttp session, TLS connection and
+WebSocket for every segment (and every retry). The protocol frames each
+synthesis turn with turn.start, audio frames and turn.end tagged with the
+request's X-RequestId, after a speech.config message, so several turns can
+be sent over one connection. EdgeSessionPool keeps such connections open
+and hands them to one segment at a time, so only the first segment on a
+connection pays for the handshake.
+
+edge_tts itself never reuses a connection, and this client has only been
+exercised against edge_standin.py. How many turns, and for how long, the
+live service serves on one connection has not been measured, so the pool
+is off unless TTS_EDGE_POOL_SIZE is set.
+
+Connections are checked before reuse and replaced when they are closed,
+have been idle longer than max_idle (the service drops idle sockets), or
+have served max_uses turns. A turn that fails on a reused connection
+before any audio arrived is retried once on a fresh one; any other failure
+discards the connection and is raised to the caller, which retries through
+the rate limiter as before. All methods run on the engine's event loop.
+"""
+import asyncio
+import logging
+import ssl
+import time
+from xml.sax.saxutils import escape
+
+import aiohttp
+import certifi
+import edge_tts
+from edge_tts.communicate import (
+    calc_max_mesg_size,
+    connect_id,
+    date_to_string,
+    get_headers_and_data,
+    mkssml,
+    remove_incompatible_characters,
+    split_text_by_byte_length,
+    ssml_headers_plus_data,
+)
+from edge_tts.constants import WSS_URL
+from edge_tts.exceptions import NoAudioReceived, UnexpectedResponse, UnknownResponse, WebSocketError
+
+logger = logging.getLogger(__name__)
+
+# The browser headers edge_tts sends with the handshake
+HEADERS = {
+    "Pragma": "no-cache",
+    "Cache-Control": "no-cache",
+    "Origin": "chrome-extension://jdiccldimpdaibmpdkjnbmckianbfold",
+    "Accept-Encoding": "gzip, deflate, br",
+    "Accept-Language": "en-US,en;q=0.9",
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
+                  " (KHTML, like Gecko) Chrome/91.0.4472.77 Safari/537.36 Edg/91.0.864.41",
+}
+
+SPEECH_CONFIG = (
+    "Content-Type:application/json; charset=utf-8\r\n"
+    "Path:speech.config\r\n\r\n"
+    '{"context":{"synthesis":{"audio":{"metadataoptions":{'
+    '"sentenceBoundaryEnabled":false,"wordBoundaryEnabled":true},'
+    '"outputFormat":"audio-24khz-48kbitrate-mono-mp3"'
+    "}}}}\r\n"
+)
+
+
+class StaleConnection(Exception):
+    """A reused connection was closed by the server before the turn produced audio"""
+
+
+class EdgeSession:
+    """One open WebSocket to the service; used by one segment at a time"""
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.uses = 0
+        self.configured = False
+
+    @property
+    def closed(self):
+        return self.websocket.closed
+
+    async def synthesize(self, text, voice, rate, volume, pitch):
+        """Run one synthesis turn per text chunk on this connection and return the MP3 bytes"""
+        reused = self.uses > 0
+        self.uses += 1
+        audio = bytearray()
+        chunks = split_text_by_byte_length(escape(remove_incompatible_characters(text)),
+                                           calc_max_mesg_size(voice, rate, volume, pitch))
+        for chunk in chunks:
+            try:
+                await self._turn(mkssml(chunk, voice, rate, volume, pitch), audio)
+            except (aiohttp.ClientConnectionError, ConnectionResetError, WebSocketError) as e:
+                if reused and not audio:
+                    raise StaleConnection(f"Pooled connection was closed by the service: {e}") from e
+                raise
+        self.last_used = time.monotonic()
+        if not audio:
+            raise NoAudioReceived("No audio was received. Please verify that your parameters are correct.")
+        return bytes(audio)
+
+    async def _turn(self, ssml, audio):
+        request_id = connect_id()
+        date = date_to_string()
+        if not self.configured:
+            # Output format and metadata options hold for every later turn on the connection
+            await self.websocket.send_str(f"X-Timestamp:{date}\r\n" + SPEECH_CONFIG)
+            self.configured = True
+        await self.websocket.send_str(ssml_headers_plus_data(request_id, date, ssml))
+        in_turn = False
+        async for received in self.websocket:
+            if received.type == aiohttp.WSMsgType.TEXT:
+                parameters, _ = get_headers_and_data(received.data)
+                if parameters.get(b"X-RequestId", request_id.encode()) != request_id.encode():
+                    continue  # leftovers of an earlier, abandoned turn
+                path = parameters.get(b"Path")
+                if path == b"turn.start":
+                    in_turn = True
+                elif path == b"turn.end":
+                    return
+                elif path not in (b"response", b"audio.metadata"):
+                    raise UnknownResponse("The response from the service is not recognized.\n"
+                                          + received.data)
+            elif received.type == aiohttp.WSMsgType.BINARY:
+                if not in_turn:
+                    raise UnexpectedResponse("We received a binary message, but we are not expecting one.")
+                if len(received.data) < 2:
+                    raise UnexpectedResponse("We received a binary message, but it is missing the header length.")
+                header_length = int.from_bytes(received.data[:2], "big")
+                if len(received.data) < header_length + 2:
+                    raise UnexpectedResponse("We received a binary message, but it is missing the audio data.")
+                audio.extend(received.data[header_length + 2:])
+            elif received.type == aiohttp.WSMsgType.ERROR:
+                raise WebSocketError(received.data if received.data else "Unknown error")
+        # The iterator ends when the server closes the socket
+        raise WebSocketError(f"Connection closed mid-turn (code {self.websocket.close_code})")
+
+    async def close(self):
+        if not self.websocket.closed:
+            await self.websocket.close()
+
+
+class EdgeSessionPool:
+    """Bounded pool of warm connections to one service endpoint"""
+
+    def __init__(self, url=WSS_URL, max_size=4, max_idle=30.0, max_uses=200, connect_timeout=15.0,
+                 proxy=None):
+        self.url = url
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.max_uses = max_uses
+        self.connect_timeout = connect_timeout
+        self.proxy = proxy
+        self._ssl = ssl.create_default_context(cafile=certifi.where())
+        self._client = None
+        self._idle = []
+        self._slots = None  # semaphore, created on the engine loop
+        self.opened = 0
+        self.reused = 0
+        self.discarded = 0
+
+    def _healthy(self, session):
+        return (not session.closed
+                and session.uses < self.max_uses
+                and time.monotonic() - session.last_used < self.max_idle)
+
+    async def _connect(self):
+        if self._client is None or self._client.closed:
+            self._client = aiohttp.ClientSession(trust_env=True)
+        separator = '&' if '?' in self.url else '?'
+        websocket = await self._client.ws_connect(
+            f"{self.url}{separator}ConnectionId={connect_id()}",
+            compress=15, autoclose=True, autoping=True, proxy=self.proxy, headers=HEADERS, ssl=self._ssl)
+        self.opened += 1
+        return EdgeSession(websocket)
+
+    async def _acquire(self, fresh=False):
+        while self._idle and not fresh:
+            session = self._idle.pop()
+            if self._healthy(session):
+                self.reused += 1
+                return session
+            await self._discard(session)
+        return await asyncio.wait_for(self._connect(), self.connect_timeout)
+
+    def _release(self, session):
+        if self._healthy(session) and len(self._idle) < self.max_size:
+            self._idle.append(session)
+        else:
+            asyncio.ensure_future(self._discard(session))
+
+    async def _discard(self, session):
+        self.discarded += 1
+        try:
+            await session.close()
+        except Exception:
+            pass
+
+    async def synthesize(self, text, voice, rate="+0%", pitch="+0Hz", volume="+0%"):
+        """Synthesize one segment over a pooled connection and return its MP3 bytes"""
+        # Validates the arguments and expands short voice names the way edge_tts does
+        request = edge_tts.Communicate(text, voice, rate=rate, pitch=pitch, volume=volume)
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_size)
+        async with self._slots:
+            fresh = False
+            while True:
+                session = await self._acquire(fresh)
+                try:
+                    audio = await session.synthesize(request.text, request.voice, request.rate,
+                                                     request.volume, request.pitch)
+                except StaleConnection:
+                    await self._discard(session)
+                    if fresh:
+                        raise
+                    logger.debug("Pooled connection went stale, reconnecting")
+                    fresh = True
+                    continue
+                except BaseException:
+                    # Includes cancellation on timeout: the turn may still be streaming
+                    await asyncio.shield(self._discard(session))
+                    raise
+                self._release(session)
+                return audio
+
+    def stats(self):
+        return {
+            'size': self.max_size,
+            'idle': len(self._idle),
+            'opened': self.opened,
+            'reused': self.reused,
+            'discarded': self.discarded,
+        }
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        for session in idle:
+            await self._discard(session)
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
@@ -0,0 +1,168 @@
+"""
+Local stand-in for the Edge read-aloud WebSocket service.
+
+Usage:
+    python edge_standin.py --port 8765                 # then run the app with
+    TTS_EDGE_POOL_SIZE=4 TTS_EDGE_URL=ws://127.0.0.1:8765/edge/v1 python serve.py
+
+Speaks the same protocol as the real endpoint closely enough for the pooled
+client (edge_pool.py) and edge_tts itself: speech.config, then for every
+Path:ssml request turn.start, response, binary audio frames (2-byte header
+length, headers, silent MP3 from tts_backends.fake_audio) and turn.end, all
+tagged with the request's X-RequestId. Any number of turns may share one
+connection.
+
+Network cost is simulated: every new connection waits handshake_delay
+before the upgrade completes (TCP, TLS and WebSocket round trips to a
+remote service) and every turn waits turn_delay. Connections idle for
+idle_timeout seconds, or that have served max_turns turns, are closed by
+the server, which exercises the client's reconnect path.
+"""
+import argparse
+import asyncio
+import re
+import threading
+import time
+
+from aiohttp import WSMsgType, web
+
+from tts_backends import fake_audio
+
+AUDIO_CHUNK_BYTES = 4096
+SSML_TAG = re.compile(r'<[^>]+>')
+SSML_ATTRIBUTE = re.compile(r"(\w+)='([^']*)'")
+
+
+def parse_message(data):
+    head, _, body = data.partition('\r\n\r\n')
+    headers = dict(line.split(':', 1) for line in head.split('\r\n') if ':' in line)
+    return headers, body
+
+
+def text_message(request_id, path, body=''):
+    return (f"X-RequestId:{request_id}\r\nContent-Type:application/json; charset=utf-8\r\n"
+            f"Path:{path}\r\n\r\n{body}")
+
+
+def audio_message(request_id, data):
+    header = f"X-RequestId:{request_id}\r\nContent-Type:audio/mpeg\r\nPath:audio\r\n".encode()
+    return len(header).to_bytes(2, 'big') + header + data
+
+
+class EdgeStandIn:
+    """aiohttp server that mimics the synthesis endpoint; runs on its own loop thread"""
+
+    def __init__(self, host='127.0.0.1', port=0, handshake_delay=0.15, turn_delay=0.0,
+                 idle_timeout=60.0, max_turns=0):
+        self.host = host
+        self.port = port
+        self.handshake_delay = handshake_delay
+        self.turn_delay = turn_delay
+        self.idle_timeout = idle_timeout
+        self.max_turns = max_turns
+        self.connections = 0
+        self.turns = 0
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return f'ws://{self.host}:{self.port}/edge/v1?TrustedClientToken=standin'
+
+    async def handle(self, request):
+        await asyncio.sleep(self.handshake_delay)
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.connections += 1
+        configured = False
+        turns = 0
+        while True:
+            try:
+                message = await ws.receive(timeout=self.idle_timeout)
+            except asyncio.TimeoutError:
+                break
+            if message.type != WSMsgType.TEXT:
+                break
+            headers, body = parse_message(message.data)
+            path = headers.get('Path')
+            if path == 'speech.config':
+                configured = True
+            elif path == 'ssml':
+                if not configured:
+                    await ws.close(code=1007, message=b'speech.config missing')
+                    break
+                await self.turn(ws, headers.get('X-RequestId', ''), body)
+                turns += 1
+                if self.max_turns and turns >= self.max_turns:
+                    break
+        await ws.close()
+        return ws
+
+    async def turn(self, ws, request_id, ssml):
+        self.turns += 1
+        await asyncio.sleep(self.turn_delay)
+        prosody = dict(SSML_ATTRIBUTE.findall(ssml))
+        audio = fake_audio(SSML_TAG.sub('', ssml), prosody.get('rate', '+0%'))
+        await ws.send_str(text_message(request_id, 'turn.start', '{"context":{}}'))
+        await ws.send_str(text_message(request_id, 'response', '{"context":{}}'))
+        for start in range(0, len(audio), AUDIO_CHUNK_BYTES):
+            await ws.send_bytes(audio_message(request_id, audio[start:start + AUDIO_CHUNK_BYTES]))
+        await ws.send_str(text_message(request_id, 'turn.end', '{}'))
+
+    async def _start(self):
+        app = web.Application()
+        app.router.add_get('/edge/v1', self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+
+    def start(self):
+        """Serve on a background thread; return the ws:// URL"""
+        self._loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self._start())
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name='edge-standin', daemon=True)
+        self._thread.start()
+        started.wait()
+        return self.url
+
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result(10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+        self._loop.close()
+        self._loop = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--handshake-delay', type=float, default=0.15, help='seconds per new connection')
+    parser.add_argument('--turn-delay', type=float, default=0.0, help='seconds per synthesis turn')
+    parser.add_argument('--idle-timeout', type=float, default=60.0)
+    parser.add_argument('--max-turns', type=int, default=0, help='close a connection after this many turns')
+    args = parser.parse_args()
+    server = EdgeStandIn(args.host, args.port, args.handshake_delay, args.turn_delay,
+                         args.idle_timeout, args.max_turns)
+    print(f"Edge stand-in listening on {server.start()}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Background workers for jobs in the JobStore.
+
+Worker threads pull job ids from a queue, claim them in the store (so two
+server processes never run the same job) and hand them to a run callable. A
+maintenance thread heart-beats the jobs this process is running, puts jobs
+whose owner died back in the queue, picks up jobs queued by other processes
+and purges finished jobs once they are past the retention period.
+"""
+import logging
+import os
+import queue
+import socket
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class JobRunner:
+    """Runs queued jobs on background threads and keeps the store healthy"""
+
+    def __init__(self, store, run_job, workers=2, heartbeat_interval=15.0,
+                 stale_after=60.0, retention=24 * 3600, on_purge=None):
+        self.store = store
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.workers = workers
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = stale_after
+        self.retention = retention
+        self._run_job = run_job      # callable(job_id); raises on failure
+        self._on_purge = on_purge    # callable(job_row) for finished jobs being removed
+        self._queue = queue.Queue()
+        self._pending = set()  # ids currently in the local queue
+        self._lock = threading.Lock()
+        self._threads = []
+        self._stop = threading.Event()
+        self.active = 0
+
+    def start(self):
+        if self._threads:
+            return
+        for n in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'job-worker-{n}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._maintain, name='job-maintenance', daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def submit(self, job_id):
+        with self._lock:
+            if job_id in self._pending:
+                return
+            self._pending.add(job_id)
+        self._queue.put(job_id)
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def _work(self):
+        while not self._stop.is_set():
+            job_id = self._queue.get()
+            with self._lock:
+                self._pending.discard(job_id)
+            if job_id is None or not self.store.claim(job_id, self.worker_id):
+                continue
+            with self._lock:
+                self.active += 1
+            try:
+                logger.info("Job %s: started on %s", job_id, self.worker_id)
+                self._run_job(job_id)
+            except Exception as e:
+                logger.exception("Job %s failed: %s: %s", job_id, type(e).__name__, e)
+                self.store.set_status(job_id, 'failed', error=str(e))
+            finally:
+                with self._lock:
+                    self.active -= 1
+
+    def _maintain(self):
+        while not self._stop.is_set():
+            try:
+                self.store.heartbeat(self.worker_id)
+                for job_id in self.store.requeue_stale(self.stale_after):
+                    logger.info("Job %s: resuming interrupted job", job_id)
+                for job_id in self.store.queued_jobs():
+                    self.submit(job_id)
+                for row in self.store.purge_finished(self.retention):
+                    if self._on_purge:
+                        self._on_purge(row)
+            except Exception as e:
+                logger.warning("Job maintenance failed: %s: %s", type(e).__name__, e)
+            self._stop.wait(self.heartbeat_interval)
+
+    def stop(self):
+        self._stop.set()
+        for _ in range(self.workers):
+            self._queue.put(None)
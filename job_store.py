@@ -0,0 +1,390 @@
+"""
+Durable job store backed by a local SQLite database.
+
+Holds every generation job (blocking /api/generate requests as well as
+background /api/jobs), its per-segment status and where its audio ended up.
+State survives restarts and is shared by all server processes using the same
+database file, which is what lets interrupted jobs resume from their last
+completed segment.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    voice TEXT NOT NULL,
+    text_length INTEGER NOT NULL DEFAULT 0,
+    total INTEGER NOT NULL DEFAULT 0,
+    completed INTEGER NOT NULL DEFAULT 0,
+    cache_hits INTEGER NOT NULL DEFAULT 0,
+    cache_misses INTEGER NOT NULL DEFAULT 0,
+    requests_saved INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    result_path TEXT,
+    worker TEXT,
+    stages TEXT NOT NULL DEFAULT '{}',
+    postprocess INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, updated_at);
+CREATE TABLE IF NOT EXISTS segments (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    emotion TEXT NOT NULL,
+    text TEXT NOT NULL,
+    rate TEXT NOT NULL,
+    pitch TEXT NOT NULL,
+    volume TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    audio_path TEXT,
+    updated_at REAL,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    type TEXT NOT NULL,
+    data TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_job ON events (job_id, seq);
+"""
+
+# Columns added after the first release: (table, column, definition)
+MIGRATIONS = [
+    ('jobs', 'requests_saved', 'INTEGER NOT NULL DEFAULT 0'),
+    ('jobs', 'stages', "TEXT NOT NULL DEFAULT '{}'"),
+    ('jobs', 'postprocess', 'INTEGER NOT NULL DEFAULT 0'),
+    ('jobs', 'fingerprint', 'TEXT'),
+    ('jobs', 'client', 'TEXT'),
+]
+# Indexes on migrated columns, created once the columns exist
+INDEXES = """
+CREATE INDEX IF NOT EXISTS jobs_fingerprint ON jobs (fingerprint, status);
+CREATE INDEX IF NOT EXISTS jobs_client ON jobs (client, status);
+"""
+
+ACTIVE_STATUSES = ('queued', 'running')
+FINISHED_STATUSES = ('done', 'failed')
+# Background jobs a restarted worker picks up again; sync and batch requests die with their client
+RESUMABLE_KINDS = ('async', 'upload')
+
+
+class JobExists(Exception):
+    """Raised by create_job() when the job id is already taken"""
+
+
+class JobStore:
+    """SQLite-backed store for jobs and their segments (one connection per thread)"""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        # Wakes in-process event listeners; other processes are picked up by polling
+        self._events_changed = threading.Condition()
+        # Serializes read-modify-write of the per-stage timing JSON
+        self._stages_lock = threading.Lock()
+        self.on_finished = None  # callable(job_row) after a job is marked done/failed
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+            for table, column, definition in MIGRATIONS:
+                existing = [row['name'] for row in conn.execute(f'PRAGMA table_info({table})')]
+                if column not in existing:
+                    conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+            conn.executescript(INDEXES)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def create_job(self, job_id, voice, segments, kind='async', status='queued', text_length=0,
+                   worker=None, requests_saved=0, postprocess=False, fingerprint=None, client=None):
+        """Insert a job and its prosody segments; raise JobExists if the id is taken
+        
+        With a fingerprint, an active job with the same fingerprint is reused
+        instead (checked and inserted atomically, across processes). Returns
+        the id of the job that will produce the result. client is who the job
+        is for, used to schedule its segments fairly.
+        """
+        now = time.time()
+        with self._conn() as conn:
+            if fingerprint is not None:
+                conn.execute('BEGIN IMMEDIATE')
+                row = conn.execute(
+                    'SELECT id FROM jobs WHERE fingerprint = ? AND status IN (?, ?) '
+                    'ORDER BY created_at LIMIT 1', (fingerprint,) + ACTIVE_STATUSES).fetchone()
+                if row is not None:
+                    return row['id']
+            try:
+                conn.execute(
+                    'INSERT INTO jobs (id, kind, status, voice, text_length, total, '
+                    'requests_saved, worker, postprocess, fingerprint, client, created_at, updated_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (job_id, kind, status, voice, text_length, len(segments), requests_saved, worker,
+                     int(postprocess), fingerprint, client, now, now))
+            except sqlite3.IntegrityError:
+                raise JobExists(f"Job {job_id} already exists") from None
+            conn.executemany(
+                'INSERT INTO segments (job_id, idx, emotion, text, rate, pitch, volume, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [(job_id, idx, seg['emotion'], seg['text'], seg['prosody']['rate'],
+                  seg['prosody']['pitch'], seg['prosody']['volume'], now)
+                 for idx, seg in enumerate(segments)])
+            self._insert_event(conn, job_id, 'started' if status == 'running' else 'queued',
+                               {'total': len(segments), 'requests_saved': requests_saved}, now)
+        self._notify_events()
+        return job_id
+
+    def get_job(self, job_id):
+        row = self._conn().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['stages'] = json.loads(job['stages'] or '{}')
+        return job
+
+    def get_segments(self, job_id):
+        """Return a job's segments in order, in the prosody_segments shape plus status"""
+        rows = self._conn().execute(
+            'SELECT * FROM segments WHERE job_id = ? ORDER BY idx', (job_id,)).fetchall()
+        return [{
+            'index': row['idx'],
+            'text': row['text'],
+            'emotion': row['emotion'],
+            'prosody': {'rate': row['rate'], 'pitch': row['pitch'], 'volume': row['volume']},
+            'status': row['status'],
+            'audio_path': row['audio_path'],
+        } for row in rows]
+
+    def claim(self, job_id, worker):
+        """Atomically move a queued job to running; return False if someone else has it"""
+        with self._conn() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, updated_at = ? "
+                "WHERE id = ? AND status = 'queued'", (worker, time.time(), job_id))
+            if cursor.rowcount != 1:
+                return False
+            row = conn.execute('SELECT completed, total FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            self._insert_event(conn, job_id, 'started',
+                               {'completed': row['completed'], 'total': row['total']}, time.time())
+        self._notify_events()
+        return True
+
+    def set_status(self, job_id, status, error=None, result_path=None):
+        """Update a job's status; finishing a job also publishes a done/failed event"""
+        now = time.time()
+        finished_at = now if status in FINISHED_STATUSES else None
+        with self._conn() as conn:
+            conn.execute(
+                'UPDATE jobs SET status = ?, error = ?, result_path = COALESCE(?, result_path), '
+                'updated_at = ?, finished_at = ? WHERE id = ?',
+                (status, error, result_path, now, finished_at, job_id))
+            if status in FINISHED_STATUSES:
+                row = conn.execute('SELECT completed, total, created_at FROM jobs WHERE id = ?',
+                                   (job_id,)).fetchone()
+                data = {'error': error} if error else {}
+                if row:
+                    data.update(completed=row['completed'], total=row['total'],
+                                elapsed_ms=round((now - row['created_at']) * 1000))
+                self._insert_event(conn, job_id, status, data, now)
+        if status in FINISHED_STATUSES:
+            self._notify_events()
+            if self.on_finished:
+                job = self.get_job(job_id)
+                if job:
+                    self.on_finished(job)
+
+    def _insert_event(self, conn, job_id, event_type, data, now):
+        conn.execute('INSERT INTO events (job_id, type, data, created_at) VALUES (?, ?, ?, ?)',
+                     (job_id, event_type, json.dumps(data), now))
+
+    def _notify_events(self):
+        with self._events_changed:
+            self._events_changed.notify_all()
+
+    def add_event(self, job_id, event_type, **data):
+        """Publish a progress event for a job"""
+        with self._conn() as conn:
+            self._insert_event(conn, job_id, event_type, data, time.time())
+        self._notify_events()
+
+    def events_since(self, job_id, after_seq=0):
+        rows = self._conn().execute(
+            'SELECT seq, type, data FROM events WHERE job_id = ? AND seq > ? ORDER BY seq',
+            (job_id, after_seq)).fetchall()
+        return [{'id': row['seq'], 'type': row['type'], 'data': json.loads(row['data'])} for row in rows]
+
+    def wait_for_events(self, job_id, after_seq=0, timeout=15.0, poll_interval=1.0):
+        """Block until a job has events newer than after_seq, or until timeout"""
+        deadline = time.monotonic() + timeout
+        while True:
+            events = self.events_since(job_id, after_seq)
+            remaining = deadline - time.monotonic()
+            if events or remaining <= 0:
+                return events
+            with self._events_changed:
+                self._events_changed.wait(min(poll_interval, remaining))
+
+    def add_cache_stats(self, job_id, hits, misses):
+        with self._conn() as conn:
+            conn.execute(
+                'UPDATE jobs SET cache_hits = cache_hits + ?, cache_misses = cache_misses + ? '
+                'WHERE id = ?', (hits, misses, job_id))
+
+    def _add_stage_times(self, conn, job_id, stage_ms):
+        row = conn.execute('SELECT stages FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return
+        stages = json.loads(row['stages'] or '{}')
+        for stage, ms in stage_ms.items():
+            stages[stage] = round(stages.get(stage, 0) + ms, 1)
+        conn.execute('UPDATE jobs SET stages = ? WHERE id = ?', (json.dumps(stages), job_id))
+
+    def add_stage_times(self, job_id, **stage_ms):
+        """Add milliseconds to a job's per-stage timing breakdown"""
+        with self._stages_lock, self._conn() as conn:
+            self._add_stage_times(conn, job_id, stage_ms)
+
+    def mark_segment_done(self, job_id, idx, audio_path=None, stages=None, **event_data):
+        """Record a finished segment, bump the completed count and publish segment_done
+        
+        stages (stage -> ms) is added to the job's timing breakdown in the same transaction.
+        """
+        now = time.time()
+        with self._stages_lock, self._conn() as conn:
+            cursor = conn.execute(
+                "UPDATE segments SET status = 'done', audio_path = ?, updated_at = ? "
+                "WHERE job_id = ? AND idx = ? AND status != 'done'", (audio_path, now, job_id, idx))
+            if not cursor.rowcount:
+                return
+            conn.execute('UPDATE jobs SET completed = completed + 1, updated_at = ? WHERE id = ?',
+                         (now, job_id))
+            row = conn.execute('SELECT completed, total FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            self._insert_event(conn, job_id, 'segment_done',
+                               dict(event_data, index=idx, completed=row['completed'], total=row['total']),
+                               now)
+            if stages:
+                self._add_stage_times(conn, job_id, stages)
+        self._notify_events()
+
+    def mark_segment_failed(self, job_id, idx):
+        with self._conn() as conn:
+            conn.execute("UPDATE segments SET status = 'failed', updated_at = ? WHERE job_id = ? AND idx = ?",
+                         (time.time(), job_id, idx))
+
+    def reset_segment(self, job_id, idx):
+        """Mark a segment pending again (its audio went missing)"""
+        with self._conn() as conn:
+            cursor = conn.execute(
+                "UPDATE segments SET status = 'pending', audio_path = NULL WHERE job_id = ? AND idx = ? "
+                "AND status = 'done'", (job_id, idx))
+            if cursor.rowcount:
+                conn.execute('UPDATE jobs SET completed = completed - 1 WHERE id = ?', (job_id,))
+
+    def append_segment(self, job_id, idx, segment):
+        """Add one segment to a job whose text is parsed while it runs"""
+        now = time.time()
+        prosody = segment['prosody']
+        with self._conn() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO segments (job_id, idx, emotion, text, rate, pitch, volume, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (job_id, idx, segment['emotion'], segment['text'], prosody['rate'], prosody['pitch'],
+                 prosody['volume'], now))
+            conn.execute('UPDATE jobs SET total = total + 1, updated_at = ? WHERE id = ?', (now, job_id))
+
+    def clear_segments(self, job_id):
+        """Drop all segments of a job so its text can be parsed again from the start"""
+        with self._conn() as conn:
+            conn.execute('DELETE FROM segments WHERE job_id = ?', (job_id,))
+            conn.execute('UPDATE jobs SET total = 0, completed = 0, updated_at = ? WHERE id = ?',
+                         (time.time(), job_id))
+
+    def heartbeat(self, worker):
+        """Refresh updated_at on every job this worker is running"""
+        with self._conn() as conn:
+            conn.execute("UPDATE jobs SET updated_at = ? WHERE worker = ? AND status = 'running'",
+                         (time.time(), worker))
+
+    def requeue_stale(self, stale_after):
+        """Return running background jobs whose worker stopped heart-beating to the queue"""
+        cutoff = time.time() - stale_after
+        kinds = ', '.join('?' * len(RESUMABLE_KINDS))
+        with self._conn() as conn:
+            rows = conn.execute(
+                f"SELECT id FROM jobs WHERE kind IN ({kinds}) AND status = 'running' AND updated_at < ?",
+                (*RESUMABLE_KINDS, cutoff)).fetchall()
+            conn.execute(
+                f"UPDATE jobs SET status = 'queued', worker = NULL WHERE kind IN ({kinds}) "
+                "AND status = 'running' AND updated_at < ?", (*RESUMABLE_KINDS, cutoff))
+            # Blocking requests cannot be resumed once their client is gone
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = 'Interrupted by server restart', "
+                f"finished_at = ? WHERE kind NOT IN ({kinds}) AND status = 'running' AND updated_at < ?",
+                (time.time(), *RESUMABLE_KINDS, cutoff))
+        return [row['id'] for row in rows]
+
+    def running_counts(self, worker):
+        """Number of running jobs per kind owned by a worker"""
+        rows = self._conn().execute(
+            "SELECT kind, COUNT(*) AS n FROM jobs WHERE status = 'running' AND worker = ? GROUP BY kind",
+            (worker,)).fetchall()
+        return {row['kind']: row['n'] for row in rows}
+
+    def pending_segments(self, client, chars_per_segment):
+        """Segments of client's background jobs that are not in a scheduler queue yet
+
+        Queued jobs count their unfinished segments. Uploads are parsed while
+        they run, so theirs are estimated from the text length at
+        chars_per_segment characters each.
+        """
+        rows = self._conn().execute(
+            "SELECT kind, status, total, completed, text_length FROM jobs "
+            "WHERE client = ? AND status IN (?, ?) AND kind IN (?, ?)",
+            (client, *ACTIVE_STATUSES, *RESUMABLE_KINDS)).fetchall()
+        pending = 0
+        for row in rows:
+            if row['kind'] == 'upload':
+                pending += max(0, -(-row['text_length'] // chars_per_segment) - row['completed'])
+            elif row['status'] == 'queued':
+                pending += row['total'] - row['completed']
+        return pending
+
+    def ping(self):
+        """Raise if the database cannot be queried"""
+        self._conn().execute('SELECT 1').fetchone()
+
+    def queued_jobs(self):
+        rows = self._conn().execute(
+            "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at").fetchall()
+        return [row['id'] for row in rows]
+
+    def purge_finished(self, older_than):
+        """Delete finished jobs older than the given age; return their rows"""
+        cutoff = time.time() - older_than
+        with self._conn() as conn:
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                (cutoff,)).fetchall()
+            ids = [(row['id'],) for row in rows]
+            conn.executemany('DELETE FROM events WHERE job_id = ?', ids)
+            conn.executemany('DELETE FROM segments WHERE job_id = ?', ids)
+            conn.executemany('DELETE FROM jobs WHERE id = ?', ids)
+        return [dict(row) for row in rows]
@@ -0,0 +1,190 @@
+"""
+In-memory MP3 concatenation at the frame level.
+
+Segments are joined by parsing their MPEG audio frame headers and keeping
+only the frame data: ID3 tags are dropped from every segment after the first,
+and Xing/Info/VBRI header frames from all of them (their sizes and frame
+counts would describe only one segment, not the joined stream). Everything
+works on memoryview slices, so the audio payload is copied once, into the
+output buffer or stream.
+
+When segments do not share a sample rate, channel mode and MPEG version,
+joining frames would produce an invalid stream; FormatMismatch is raised so
+the caller can fall back to re-encoding.
+"""
+from collections import namedtuple
+
+# Bitrates in kbps indexed by [is_mpeg1][layer_index][bitrate_index]
+# (layer_index: 1 = Layer III, 2 = Layer II, 3 = Layer I)
+_BITRATES = {
+    True: {
+        3: (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+        2: (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+        1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    },
+    False: {
+        3: (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+        2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+        1: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    },
+}
+# Sample rates indexed by version bits (0 = MPEG2.5, 2 = MPEG2, 3 = MPEG1)
+_SAMPLE_RATES = {
+    3: (44100, 48000, 32000),
+    2: (22050, 24000, 16000),
+    0: (11025, 12000, 8000),
+}
+
+FrameFormat = namedtuple('FrameFormat', 'version layer sample_rate channel_mode')
+
+
+class FormatMismatch(ValueError):
+    """Segments use different MP3 formats and cannot be joined without re-encoding"""
+
+
+class InvalidMP3(ValueError):
+    """No MPEG audio frames could be found in a segment"""
+
+
+def parse_header(data, offset):
+    """Parse the frame header at offset; return (FrameFormat, frame_length) or None"""
+    if offset + 4 > len(data):
+        return None
+    b0, b1, b2, b3 = data[offset], data[offset + 1], data[offset + 2], data[offset + 3]
+    if b0 != 0xFF or (b1 & 0xE0) != 0xE0:
+        return None
+    version = (b1 >> 3) & 0x03
+    layer = (b1 >> 1) & 0x03
+    bitrate_index = b2 >> 4
+    rate_index = (b2 >> 2) & 0x03
+    if version == 1 or layer == 0 or bitrate_index in (0, 15) or rate_index == 3:
+        return None  # reserved values, or free-format which we do not support
+
+    mpeg1 = version == 3
+    bitrate = _BITRATES[mpeg1][layer][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][rate_index]
+    padding = (b2 >> 1) & 0x01
+    if layer == 3:  # Layer I
+        length = (12 * bitrate // sample_rate + padding) * 4
+    elif layer == 1 and not mpeg1:  # Layer III, MPEG2/2.5
+        length = 72 * bitrate // sample_rate + padding
+    else:
+        length = 144 * bitrate // sample_rate + padding
+    return FrameFormat(version, layer, sample_rate, b3 >> 6), length
+
+
+def _id3v2_size(data):
+    if len(data) >= 10 and data[0:3] == b'ID3':
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        footer = 10 if data[5] & 0x10 else 0
+        return 10 + size + footer
+    return 0
+
+
+def _is_vbr_header_frame(data, offset, fmt):
+    """True if the frame at offset carries a Xing/Info/VBRI header instead of audio"""
+    mono = fmt.channel_mode == 3
+    if fmt.version == 3:
+        side_info = 17 if mono else 32
+    else:
+        side_info = 9 if mono else 17
+    xing = offset + 4 + side_info
+    tag = bytes(data[xing:xing + 4])
+    if tag in (b'Xing', b'Info'):
+        return True
+    return bytes(data[offset + 36:offset + 40]) == b'VBRI'
+
+
+def audio_frames(data, keep_id3=False):
+    """Locate the MPEG audio frames in one segment
+
+    Returns (memoryview_of_frames, FrameFormat, frame_count). A Xing/Info/VBRI
+    frame is always excluded (it would describe only this segment), as are
+    trailing tags and garbage after the last whole frame. A leading ID3v2 tag
+    is kept only with keep_id3.
+    """
+    view = memoryview(data)
+    tag_end = _id3v2_size(view)
+    start = tag_end
+    # Resynchronise if the tag is followed by padding or junk
+    while start < len(view) and parse_header(view, start) is None:
+        start += 1
+    first = parse_header(view, start)
+    if first is None:
+        raise InvalidMP3("No MPEG audio frames found")
+    fmt = first[0]
+
+    # Walk the frames; CBR segments repeat a handful of headers, so parse each once
+    known = {}
+    size = len(view)
+    offset = start
+    frames = 0
+    end = start
+    while offset + 4 <= size:
+        header = bytes(view[offset:offset + 4])
+        parsed = known.get(header)
+        if parsed is None:
+            parsed = known[header] = parse_header(header, 0)
+        if parsed is None or parsed[1] <= 4 or offset + parsed[1] > size:
+            break
+        offset += parsed[1]
+        frames += 1
+        end = offset
+
+    if frames and _is_vbr_header_frame(view, start, fmt):
+        start += first[1]
+        frames -= 1
+    if keep_id3 and tag_end:
+        if start == tag_end:
+            return view[:end], fmt, frames
+        # Padding or a VBR header frame sits between the tag and the audio
+        return memoryview(bytes(view[:tag_end]) + bytes(view[start:end])), fmt, frames
+    return view[start:end], fmt, frames
+
+
+def _same_stream(a, b):
+    return a.version == b.version and a.layer == b.layer and a.sample_rate == b.sample_rate \
+        and (a.channel_mode == 3) == (b.channel_mode == 3)
+
+
+def iter_concat(segments):
+    """Yield memoryview chunks forming one MP3 stream from segment buffers
+
+    segments may be any iterable (e.g. a generator reading files one by
+    one). The first segment keeps its leading ID3 tag; later segments
+    contribute only their audio frames. Raises FormatMismatch on reaching a
+    segment that cannot be joined without re-encoding.
+    """
+    reference = None
+    for idx, data in enumerate(segments):
+        frames, fmt, _ = audio_frames(data, keep_id3=idx == 0)
+        if reference is None:
+            reference = fmt
+        elif not _same_stream(reference, fmt):
+            raise FormatMismatch(f"Segment {idx} is {fmt.sample_rate} Hz, expected {reference.sample_rate} Hz")
+        yield frames
+
+
+def check_compatible(segments):
+    """Raise FormatMismatch unless all segment buffers share one stream format"""
+    for _ in iter_concat(segments):
+        pass
+
+
+def concat(segments):
+    """Join MP3 segment buffers into one bytes object (one copy of the payload)"""
+    return b''.join(iter_concat(segments))
+
+
+def concat_to(fileobj, segments):
+    """Write the joined MP3 to a binary file object; return bytes written"""
+    written = 0
+    for chunk in iter_concat(segments):
+        fileobj.write(chunk)
+        written += len(chunk)
+    return written
+
+
+def stream_frames(data, first):
+    """Return the part of one segment to send when streaming segments one by one"""
+    return audio_frames(data, keep_id3=first)[0]
@@ -0,0 +1,276 @@
+"""
+Optional post-processing of synthesized segments with NumPy.
+
+edge-tts cannot apply the per-emotion volume from EMOTION_PROSODY, so it is
+applied here instead. The segments are joined at the frame level and
+decoded by ffmpeg, whose int16 PCM output is read in blocks, twice:
+
+  analysis   every segment's length, audible range, energy and peak
+  render     each segment is trimmed of leading/trailing silence down to a
+             short pause, given its gain in dB (e.g. whisper -15dB, angry
+             +12dB), crossfaded with its neighbours over a few milliseconds
+             and scaled so the whole output meets a target RMS level under
+             a peak ceiling, then fed to the encoder
+
+The result is encoded once. Decoding twice costs an extra ffmpeg run, but
+no pass ever holds more than a block of samples (plus a crossfade), so
+memory stays the same for a sentence and for a 100k-character document.
+"""
+import itertools
+import subprocess
+import threading
+import time
+
+import numpy as np
+
+import mp3_concat
+
+BLOCK_SAMPLES = 1 << 18  # 256k samples (~11 s at 24 kHz) per float32 block
+_FULL_SCALE = 32768.0
+
+
+def parse_db(value):
+    """'+6dB' / '-15dB' / '+0dB' -> float dB (0.0 if unparseable)"""
+    try:
+        return float(str(value).strip().lower().replace('db', ''))
+    except ValueError:
+        return 0.0
+
+
+def _samples_per_frame(fmt):
+    if fmt.layer == 3:  # Layer I
+        return 384
+    if fmt.layer == 1 and fmt.version != 3:  # Layer III, MPEG2/2.5
+        return 576
+    return 1152
+
+
+def _pipe(args, data):
+    """Run ffmpeg with data on stdin and return stdout, without pipe deadlocks"""
+    proc = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE)
+    writer = threading.Thread(target=_feed, args=(proc.stdin, data), daemon=True)
+    writer.start()
+    out = proc.stdout.read()
+    err = proc.stderr.read()
+    writer.join()
+    if proc.wait() != 0:
+        raise RuntimeError(f"ffmpeg failed: {err.decode('utf-8', 'replace')[-500:]}")
+    return out
+
+
+def _feed(stream, chunks):
+    try:
+        if isinstance(chunks, (bytes, bytearray, memoryview)):
+            chunks = [chunks]
+        for chunk in chunks:
+            stream.write(chunk)
+    except (BrokenPipeError, OSError):
+        pass  # ffmpeg exited early; its stderr explains why
+    finally:
+        try:
+            stream.close()
+        except OSError:
+            pass
+
+
+def decode(ffmpeg_exe, chunks, sample_rate):
+    """Decode MP3 chunks to mono int16 PCM at sample_rate, yielding blocks of BLOCK_SAMPLES"""
+    proc = subprocess.Popen([ffmpeg_exe, '-v', 'error', '-f', 'mp3', '-i', 'pipe:0',
+                             '-f', 's16le', '-ac', '1', '-ar', str(sample_rate), 'pipe:1'],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    writer = threading.Thread(target=_feed, args=(proc.stdin, chunks), daemon=True)
+    writer.start()
+    finished = False
+    try:
+        while True:
+            data = proc.stdout.read(BLOCK_SAMPLES * 2)
+            if len(data) < 2:
+                break
+            yield np.frombuffer(data[:len(data) // 2 * 2], dtype=np.int16)
+        err = proc.stderr.read()
+        finished = True
+    finally:
+        if not finished:  # the consumer stopped early
+            proc.kill()
+        writer.join()
+        proc.stdout.close()
+        proc.stderr.close()
+        returncode = proc.wait()
+    if returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {err.decode('utf-8', 'replace')[-500:]}")
+
+
+def decode_segments(ffmpeg_exe, segments, sample_rate, expected):
+    """Yield (segment index, int16 PCM block) in order, every block within one segment
+
+    Compatible segments are decoded by a single ffmpeg run and split after
+    the expected sample count of each (extra samples from decoder padding
+    go to the last one). Otherwise every segment is decoded on its own,
+    resampled to sample_rate. The output is the same on every call.
+    """
+    try:
+        mp3_concat.check_compatible(segments)
+    except mp3_concat.FormatMismatch:
+        for idx, segment in enumerate(segments):
+            for block in decode(ffmpeg_exe, [segment], sample_rate):
+                yield idx, block
+        return
+
+    ends = list(itertools.accumulate(expected))
+    last = len(ends) - 1
+    idx = 0
+    offset = 0
+    for block in decode(ffmpeg_exe, mp3_concat.iter_concat(segments), sample_rate):
+        while len(block):
+            while idx < last and offset >= ends[idx]:
+                idx += 1
+            take = len(block) if idx == last else min(len(block), ends[idx] - offset)
+            yield idx, block[:take]
+            block = block[take:]
+            offset += take
+
+
+def analyse(blocks, count, threshold):
+    """Per-segment statistics from one pass over decode_segments() output
+
+    Returns a list of dicts with 'length', 'loud' ((first, last) offsets of
+    samples above threshold, or None), 'energy' (sum of squares) and 'peak'.
+    """
+    stats = [{'length': 0, 'loud': None, 'energy': 0.0, 'peak': 0.0} for _ in range(count)]
+    for idx, block in blocks:
+        seg = stats[idx]
+        samples = block.astype(np.float64)
+        seg['energy'] += float(np.dot(samples, samples))
+        seg['peak'] = max(seg['peak'], float(np.max(np.abs(samples))))
+        loud = np.flatnonzero((block > threshold) | (block < -threshold))
+        if len(loud):
+            first = seg['loud'][0] if seg['loud'] else seg['length'] + int(loud[0])
+            seg['loud'] = (first, seg['length'] + int(loud[-1]))
+        seg['length'] += len(block)
+    return stats
+
+
+def trim_span(length, loud, keep):
+    """(start, end) of a segment's audible part plus keep samples each side"""
+    if loud is None:
+        return 0, 0  # pure silence
+    return max(0, loud[0] - keep), min(length, loud[1] + 1 + keep)
+
+
+def _to_int16(block):
+    return np.clip(block, -_FULL_SCALE, _FULL_SCALE - 1).astype(np.int16).tobytes()
+
+
+def _span_blocks(blocks, start, end, factor):
+    """Float32 blocks of one segment's samples [start, end), scaled by factor"""
+    offset = 0
+    for _, block in blocks:
+        lo = max(start - offset, 0)
+        hi = min(end - offset, len(block))
+        offset += len(block)
+        if hi > lo:
+            yield block[lo:hi].astype(np.float32) * factor
+
+
+def render(blocks, spans, factors, crossfade):
+    """Yield int16 PCM bytes: each segment cut to its span and scaled by its factor, joins crossfaded
+
+    blocks is decode_segments() output and spans are (start, end) offsets
+    within each segment. The last `crossfade` samples of every span are
+    held back and mixed with the head of the next span using equal-gain
+    linear ramps.
+    """
+    tail = None
+    for idx, group in itertools.groupby(blocks, key=lambda item: item[0]):
+        start, end = spans[idx]
+        length = end - start
+        if length <= 0:
+            continue
+        n = min(len(tail), length // 2) if tail is not None and crossfade else 0
+        if tail is not None and not n:
+            yield _to_int16(tail)
+        elif tail is not None and len(tail) > n:
+            yield _to_int16(tail[:-n])
+            tail = tail[-n:]
+        hold = min(crossfade, length - n)
+        body_end = length - hold
+        head = []
+        held = []
+        position = 0
+        for piece in _span_blocks(group, start, end, factors[idx]):
+            piece_end = position + len(piece)
+            if position < n:
+                head.append(piece[:n - position])
+                if piece_end >= n:
+                    fade_in = np.linspace(0.0, 1.0, n, endpoint=False, dtype=np.float32)
+                    yield _to_int16(tail * (1.0 - fade_in) + np.concatenate(head) * fade_in)
+            body = piece[max(0, n - position):max(0, body_end - position)]
+            if len(body):
+                yield _to_int16(body)
+            if piece_end > body_end:
+                held.append(piece[max(0, body_end - position):])
+            position = piece_end
+        tail = np.concatenate(held) if held else None
+    if tail is not None and len(tail):
+        yield _to_int16(tail)
+
+
+def process(segments, gains_db, ffmpeg_exe, crossfade_ms=15, trim=True, trim_threshold_db=-50.0,
+            keep_silence_ms=80, target_dbfs=-20.0, peak_dbfs=-1.0, bitrate='48k'):
+    """Post-process MP3 segments into one MP3; return (mp3_bytes, stats)
+
+    gains_db has one entry per segment. target_dbfs=None skips loudness
+    normalization; crossfade_ms=0 butt-splices the segments.
+    """
+    parsed = [mp3_concat.audio_frames(seg) for seg in segments]
+    sample_rate = parsed[0][1].sample_rate
+    expected = [frames * _samples_per_frame(fmt) for _, fmt, frames in parsed]
+
+    def blocks():
+        return decode_segments(ffmpeg_exe, segments, sample_rate, expected)
+
+    started = time.perf_counter()
+    threshold = int(_FULL_SCALE * 10 ** (trim_threshold_db / 20))
+    stats = analyse(blocks(), len(segments), threshold)
+    spans = [(0, seg['length']) for seg in stats]
+    if trim:
+        keep = int(sample_rate * keep_silence_ms / 1000)
+        trimmed = [trim_span(seg['length'], seg['loud'], keep) for seg in stats]
+        # All silence (e.g. the offline fake backend): keep the audio as it is
+        if any(end > start for start, end in trimmed):
+            spans = trimmed
+    gains = [10 ** (gain / 20) for gain in gains_db]
+
+    norm = 1.0
+    if target_dbfs is not None:
+        # Trimming only cuts samples below the threshold, so the energy of the
+        # whole segment stands in for that of its span
+        energy = sum(seg['energy'] * gain * gain for seg, (start, end), gain in zip(stats, spans, gains)
+                     if end > start)
+        count = sum(end - start for start, end in spans)
+        peak = max((seg['peak'] * gain for seg, (start, end), gain in zip(stats, spans, gains)
+                    if end > start), default=0.0)
+        if count and energy:
+            rms = (energy / count) ** 0.5
+            norm = 10 ** (target_dbfs / 20) * _FULL_SCALE / rms
+            # Never push the loudest sample past the ceiling
+            if peak:
+                norm = min(norm, 10 ** (peak_dbfs / 20) * _FULL_SCALE / peak)
+    factors = [gain * norm for gain in gains]
+    analysed = time.perf_counter()
+
+    crossfade = int(sample_rate * crossfade_ms / 1000)
+    mp3 = _pipe([ffmpeg_exe, '-v', 'error', '-f', 's16le', '-ar', str(sample_rate), '-ac', '1',
+                 '-i', 'pipe:0', '-c:a', 'libmp3lame', '-b:a', bitrate, '-f', 'mp3', 'pipe:1'],
+                render(blocks(), spans, factors, crossfade))
+    finished = time.perf_counter()
+
+    output_samples = sum(end - start for start, end in spans) - crossfade * max(0, len(spans) - 1)
+    return mp3, {
+        'analyse_ms': round((analysed - started) * 1000, 1),
+        'render_encode_ms': round((finished - analysed) * 1000, 1),
+        'input_seconds': round(sum(seg['length'] for seg in stats) / sample_rate, 2),
+        'output_seconds': round(max(0, output_samples) / sample_rate, 2),
+        'normalize_gain_db': round(20 * np.log10(norm), 2) if norm > 0 else None,
+    }
@@ -0,0 +1,122 @@
+"""
+Pre-rendered voice preview store.
+
+Every voice's preview is the same fixed sentence, so it only ever needs to be
+synthesized once. Rendered previews live in their own size-capped
+SegmentCache on disk, with a small in-memory LRU in front of it, and popular
+locales can be warmed in the background at startup.
+"""
+import logging
+import threading
+from collections import OrderedDict
+
+from segment_cache import make_key
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_TEXT = "Hello, this is a voice preview."
+
+
+class PreviewStore:
+    """Render-once store for voice previews"""
+
+    def __init__(self, cache, render, memory_bytes=8 * 1024 * 1024):
+        self.cache = cache          # SegmentCache holding the preview MP3s
+        self._render = render       # callable(voice) -> MP3 bytes
+        self.memory_bytes = memory_bytes
+        self._memory = OrderedDict()  # key -> bytes, least recently used first
+        self._memory_total = 0
+        self._lock = threading.Lock()
+        self._voice_locks = {}
+        self.rendered = 0
+        self.served = 0
+
+    @staticmethod
+    def key(voice):
+        return make_key(voice, PREVIEW_TEXT, '+0%', '+0Hz', '+0dB')
+
+    def _remember(self, key, audio):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return
+            if len(audio) > self.memory_bytes:
+                return
+            self._memory[key] = audio
+            self._memory_total += len(audio)
+            while self._memory_total > self.memory_bytes:
+                _, dropped = self._memory.popitem(last=False)
+                self._memory_total -= len(dropped)
+
+    def _lookup(self, key):
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+                return audio
+        audio = self.cache.get(key)
+        if audio is not None:
+            self._remember(key, audio)
+        return audio
+
+    def get(self, voice, render=True):
+        """Return (audio_bytes, key) for a voice, rendering it on first use
+
+        With render=False a preview that is not stored yet gives None instead.
+        """
+        key = self.key(voice)
+        audio = self._lookup(key)
+        if audio is None:
+            if not render:
+                return None
+            with self._lock:
+                voice_lock = self._voice_locks.setdefault(key, threading.Lock())
+            # Concurrent clicks on the same voice wait for a single render
+            with voice_lock:
+                audio = self._lookup(key)
+                if audio is None:
+                    audio = self._render(voice)
+                    self.cache.put(key, audio)
+                    self._remember(key, audio)
+                    self.rendered += 1
+            with self._lock:
+                self._voice_locks.pop(key, None)
+        self.served += 1
+        return audio, key
+
+    def has(self, voice):
+        key = self.key(voice)
+        with self._lock:
+            if key in self._memory:
+                return True
+        return self.cache.get(key) is not None
+
+    def warm(self, voices):
+        """Render missing previews for voices one at a time on a daemon thread"""
+        def run():
+            warmed = 0
+            for voice in voices:
+                try:
+                    if not self.has(voice):
+                        self.get(voice)
+                        warmed += 1
+                except Exception as e:
+                    logger.warning("Preview warm-up failed for %s: %s: %s", voice, type(e).__name__, e)
+            logger.info("Preview warm-up finished: %d rendered, %d voices checked", warmed, len(voices))
+
+        thread = threading.Thread(target=run, name='preview-warmup', daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self):
+        cache_stats = self.cache.stats()
+        with self._lock:
+            return {
+                'rendered': self.rendered,
+                'served': self.served,
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_total,
+                'disk_entries': cache_stats['entries'],
+                'disk_bytes': cache_stats['bytes'],
+                'max_bytes': cache_stats['max_bytes'],
+            }
@@ -0,0 +1,155 @@
+"""
+Adaptive rate limiter shared by every synthesis call in the process.
+
+Combines a token bucket (requests per second, with a small burst) and an
+AIMD concurrency window: after a run of successful requests the rate and the
+number of requests allowed in flight grow additively; a throttling response
+cuts both multiplicatively and pauses new requests for a short cool-down.
+"""
+import threading
+import time
+
+
+def is_throttling_error(exc):
+    """Return True if an exception looks like upstream rate limiting"""
+    status = getattr(exc, 'status', None) or getattr(exc, 'status_code', None)
+    if status in (429, 503):
+        return True
+    message = str(exc).lower()
+    return '429' in message or 'too many requests' in message or 'throttl' in message
+
+
+class AdaptiveRateLimiter:
+    """Token bucket with an AIMD-adjusted rate and concurrency window"""
+
+    def __init__(self, rate=2.0, min_rate=0.25, max_rate=8.0, burst=3,
+                 concurrency=2, min_concurrency=1, max_concurrency=6,
+                 increase_after=5, rate_step=0.25, decrease_factor=0.5,
+                 cooldown=5.0):
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.increase_after = increase_after
+        self.rate_step = rate_step
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+
+        self.rate = min(max(rate, min_rate), max_rate)
+        self.concurrency = min(max(concurrency, min_concurrency), max_concurrency)
+        self.in_flight = 0
+        self.tokens = float(burst)
+        self.paused_until = 0.0
+
+        self.successes = 0
+        self.throttled = 0
+        self.errors = 0
+        self.total_wait = 0.0
+        self._streak = 0
+        self._urgent_waiting = 0
+        self._last_refill = time.monotonic()
+        self._cond = threading.Condition()
+
+    def _refill(self, now):
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self.tokens = min(float(self.burst), self.tokens + elapsed * self.rate)
+
+    def acquire(self, timeout=None, urgent=False):
+        """Block until a request may be sent; return the seconds spent waiting
+        
+        Urgent callers (previews) take the next slot or token ahead of any
+        ordinary caller that is already waiting.
+        """
+        start = time.monotonic()
+        deadline = None if timeout is None else start + timeout
+        with self._cond:
+            if urgent:
+                self._urgent_waiting += 1
+            try:
+                return self._acquire(start, deadline, urgent)
+            finally:
+                if urgent:
+                    self._urgent_waiting -= 1
+                    self._cond.notify_all()
+
+    def _acquire(self, start, deadline, urgent):
+        """Wait for a slot and a token; the caller holds the lock"""
+        while True:
+            now = time.monotonic()
+            self._refill(now)
+            if deadline is not None and now >= deadline:
+                raise TimeoutError("Timed out waiting for the rate limiter")
+
+            if now < self.paused_until:
+                wait = self.paused_until - now
+            elif self.in_flight >= self.concurrency or (self._urgent_waiting and not urgent):
+                wait = None  # woken by release() or an urgent caller getting through
+            elif self.tokens < 1.0:
+                wait = (1.0 - self.tokens) / self.rate
+            else:
+                self.tokens -= 1.0
+                self.in_flight += 1
+                waited = now - start
+                self.total_wait += waited
+                return waited
+
+            if deadline is not None:
+                remaining = deadline - now
+                wait = remaining if wait is None else min(wait, remaining)
+            self._cond.wait(wait)
+
+    def release(self, outcome='success'):
+        """Return a slot and adjust the limits: outcome is success, throttled or error"""
+        with self._cond:
+            self.in_flight = max(0, self.in_flight - 1)
+            if outcome == 'success':
+                self.successes += 1
+                self._streak += 1
+                if self._streak >= self.increase_after:
+                    self._streak = 0
+                    self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+                    self.rate = min(self.max_rate, self.rate + self.rate_step)
+            elif outcome == 'throttled':
+                self.throttled += 1
+                self._streak = 0
+                self.concurrency = max(self.min_concurrency, int(self.concurrency * self.decrease_factor))
+                self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+                self.tokens = 0.0
+                self.paused_until = max(self.paused_until, time.monotonic() + self.cooldown)
+            else:
+                self.errors += 1
+                self._streak = 0
+            self._cond.notify_all()
+
+    def settings(self):
+        """Static configuration of the limiter"""
+        return {
+            'min_rate': self.min_rate,
+            'max_rate': self.max_rate,
+            'burst': self.burst,
+            'min_concurrency': self.min_concurrency,
+            'max_concurrency': self.max_concurrency,
+            'increase_after': self.increase_after,
+            'rate_step': self.rate_step,
+            'decrease_factor': self.decrease_factor,
+            'cooldown': self.cooldown,
+        }
+
+    def snapshot(self):
+        """Current adaptive state of the limiter"""
+        with self._cond:
+            now = time.monotonic()
+            self._refill(now)
+            return {
+                'rate': round(self.rate, 3),
+                'concurrency': self.concurrency,
+                'in_flight': self.in_flight,
+                'tokens': round(self.tokens, 3),
+                'paused_for': round(max(0.0, self.paused_until - now), 3),
+                'successes': self.successes,
+                'throttled': self.throttled,
+                'errors': self.errors,
+                'total_wait': round(self.total_wait, 3),
+            }
@@ -0,0 +1,65 @@
+"""
+Admission gates that keep slow requests from taking every server thread.
+
+A production WSGI server has a fixed pool of request threads. A sync
+/api/generate call keeps its thread until the whole document is synthesized
+and an SSE stream keeps one for as long as the client listens, so a handful
+of them could starve cheap endpoints (voices, previews, progress). Each
+kind of slow request passes a RequestGate that admits at most `limit` at a
+time; the server runs with more threads than the gates admit in total, and
+the remainder is always free for cheap requests.
+"""
+import threading
+
+
+class RequestGate:
+    """Counting gate with a bounded wait and admission statistics"""
+
+    def __init__(self, name, limit, wait=0.0, max_waiting=None):
+        self.name = name
+        self.limit = limit
+        self.wait = wait  # seconds a request may queue for a slot before it is turned away
+        # Queued requests hold a server thread too, so the queue is bounded as well
+        self.max_waiting = (limit if max_waiting is None else max_waiting) if wait > 0 else 0
+        self._cond = threading.Condition()
+        self.in_use = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    def acquire(self):
+        """Take a slot, waiting up to self.wait seconds; return False if none freed up"""
+        with self._cond:
+            if self.in_use >= self.limit and self.waiting < self.max_waiting:
+                self.waiting += 1
+                try:
+                    self._cond.wait_for(lambda: self.in_use < self.limit, timeout=self.wait)
+                finally:
+                    self.waiting -= 1
+            if self.in_use >= self.limit:
+                self.rejected += 1
+                return False
+            self.in_use += 1
+            self.admitted += 1
+            return True
+
+    @property
+    def capacity(self):
+        """Most server threads this gate can occupy at once (admitted plus queued)"""
+        return self.limit + self.max_waiting
+
+    def release(self):
+        with self._cond:
+            self.in_use -= 1
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'limit': self.limit,
+                'in_use': self.in_use,
+                'waiting': self.waiting,
+                'max_waiting': self.max_waiting,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+            }
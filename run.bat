@@ -32,6 +32,6 @@ echo Press Ctrl+C to stop the server
 echo ========================================
 echo.
 
-python app.py
+python serve.py
 
 pause
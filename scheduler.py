@@ -0,0 +1,241 @@
+"""
+Fair scheduler for synthesis work.
+
+Every segment that needs an upstream call is submitted here instead of to a
+plain FIFO thread pool, so a 100-segment document cannot push a preview or
+a two-line job to the back of the line. Work is picked by:
+
+  priority class   interactive (previews), short (small jobs) and bulk
+                   (long documents, batches, uploads), shared by weight
+                   with stride scheduling: interactive work goes first,
+                   but bulk still gets its share and is never starved
+  client           round-robin between clients within a class
+  flow             round-robin between one client's jobs
+
+Each client may have at most client_limit segments running at once (not
+counting previews), and `reserved` of the worker threads only take
+interactive work so a preview never waits for a long segment to finish.
+admit() is the admission check: it raises SchedulerFull, with a retry-after
+estimate, when a client or the whole queue already has too much waiting.
+A request is never refused for its own size alone, only for piling onto an
+existing backlog.
+
+A task that raises RetryLater is queued again once its delay has passed,
+keeping its Future; no worker is held while it waits.
+"""
+import collections
+import concurrent.futures
+import heapq
+import itertools
+import threading
+import time
+
+PRIORITIES = ('interactive', 'short', 'bulk')
+DEFAULT_WEIGHTS = {'interactive': 16, 'short': 4, 'bulk': 1}
+
+Ticket = collections.namedtuple('Ticket', 'client flow priority')
+
+
+class SchedulerFull(Exception):
+    """Raised by admit() when work should be retried later rather than queued"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RetryLater(Exception):
+    """Raised by a task to be run again, with the same arguments, after delay seconds"""
+
+    def __init__(self, delay):
+        super().__init__(f"Retry in {delay}s")
+        self.delay = delay
+
+
+class FairScheduler:
+    """Worker threads that run submitted callables in fair priority order"""
+
+    def __init__(self, workers, reserved=1, client_limit=4, client_queue_limit=2000, queue_limit=20000,
+                 weights=None, name='synth'):
+        self.workers = workers
+        self.reserved = reserved
+        self.client_limit = client_limit
+        self.client_queue_limit = client_queue_limit
+        self.queue_limit = queue_limit
+        self.weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        self.on_wait = None  # callable(priority, seconds) when a task starts
+        self._cond = threading.Condition()
+        # priority -> client -> flow -> deque of tasks; OrderedDicts give the round-robin order
+        self._queues = {priority: collections.OrderedDict() for priority in PRIORITIES}
+        self._pass = {priority: 0.0 for priority in PRIORITIES}
+        self._queued = collections.Counter()          # per priority
+        self._queued_by_client = collections.Counter()
+        self._running = collections.Counter()         # per priority
+        self._running_by_client = collections.Counter()
+        self._delayed = []  # heap of (due, seq, task) waiting out a RetryLater
+        self._delay_seq = itertools.count()
+        self._waits = {priority: [0, 0.0, 0.0] for priority in PRIORITIES}  # count, total, max
+        self.rejected = 0
+        self._threads = []
+        for n in range(workers + reserved):
+            thread = threading.Thread(target=self._work, args=(n < reserved,), name=f'{name}-{n}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def admit(self, client, count=1, rate=None, waiting=0):
+        """Raise SchedulerFull if count more segments from client should not be queued now
+
+        waiting is the client's work queued elsewhere that will reach the
+        scheduler later (background jobs not started yet); it counts against
+        the client's limit. rate (segments per second) turns the backlog
+        into a retry-after hint.
+        """
+        with self._cond:
+            backlog = sum(self._queued.values())
+            mine = self._queued_by_client[client] + waiting
+            if mine and mine + count > self.client_queue_limit:
+                reason, ahead = f"Client {client} already has {mine} segments waiting", mine
+            elif backlog and backlog + count > self.queue_limit:
+                reason, ahead = f"{backlog} segments are already waiting", backlog
+            else:
+                return
+            self.rejected += 1
+        retry_after = int(min(600, max(1, ahead / rate))) if rate else 30
+        raise SchedulerFull(reason, retry_after)
+
+    def submit(self, fn, *args, ticket):
+        """Queue fn(*args) for ticket (client, flow, priority) and return a Future"""
+        future = concurrent.futures.Future()
+        task = (future, fn, args, ticket, time.monotonic())
+        with self._cond:
+            self._enqueue(task)
+            self._queued[ticket.priority] += 1
+            self._queued_by_client[ticket.client] += 1
+            self._cond.notify_all()
+        return future
+
+    def _enqueue(self, task):
+        ticket = task[3]
+        flows = self._queues[ticket.priority].setdefault(ticket.client, collections.OrderedDict())
+        flows.setdefault(ticket.flow, collections.deque()).append(task)
+
+    def _retry_later(self, task, delay):
+        """Hold task until delay has passed; it still counts as queued for admission"""
+        ticket = task[3]
+        with self._cond:
+            heapq.heappush(self._delayed, (time.monotonic() + delay, next(self._delay_seq), task))
+            self._queued[ticket.priority] += 1
+            self._queued_by_client[ticket.client] += 1
+            self._cond.notify_all()
+
+    def _release_due(self):
+        """Move delayed tasks whose time has come into their queues; return seconds to the next one"""
+        now = time.monotonic()
+        while self._delayed and self._delayed[0][0] <= now:
+            self._enqueue(heapq.heappop(self._delayed)[2])
+        return self._delayed[0][0] - now if self._delayed else None
+
+    def run(self, fn, *args, ticket, timeout=None):
+        """Submit and wait for the result"""
+        future = self.submit(fn, *args, ticket=ticket)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise TimeoutError(f"Waited {timeout}s for a synthesis slot")
+
+    def _may_start(self, priority, client):
+        # Previews are tiny and never held back by the client's cap
+        return priority == 'interactive' or self._running_by_client[client] < self.client_limit
+
+    def _runnable(self, priority):
+        return any(self._may_start(priority, client) for client in self._queues[priority])
+
+    def _next(self, interactive_only):
+        """Pop the next task to run, or None if nothing may run now (caller holds the lock)"""
+        candidates = [p for p in (('interactive',) if interactive_only else PRIORITIES) if self._runnable(p)]
+        if not candidates:
+            return None
+        priority = min(candidates, key=lambda p: (self._pass[p], PRIORITIES.index(p)))
+        now_pass = self._pass[priority]
+        self._pass[priority] += 1.0 / self.weights[priority]
+        # Idle classes do not bank credit while others run
+        for other in PRIORITIES:
+            if other not in candidates:
+                self._pass[other] = max(self._pass[other], now_pass)
+        clients = self._queues[priority]
+        client = next(c for c in clients if self._may_start(priority, c))
+        flows = clients[client]
+        flow, tasks = next(iter(flows.items()))
+        task = tasks.popleft()
+        if tasks:
+            flows.move_to_end(flow)
+        else:
+            del flows[flow]
+        if flows:
+            clients.move_to_end(client)
+        else:
+            del clients[client]
+        self._queued[priority] -= 1
+        self._queued_by_client[client] -= 1
+        if not self._queued_by_client[client]:
+            del self._queued_by_client[client]
+        return task
+
+    def _work(self, interactive_only):
+        while True:
+            with self._cond:
+                next_due = self._release_due()
+                task = self._next(interactive_only)
+                while task is None:
+                    self._cond.wait(next_due)
+                    next_due = self._release_due()
+                    task = self._next(interactive_only)
+                future, fn, args, ticket, submitted_at = task
+                self._running[ticket.priority] += 1
+                self._running_by_client[ticket.client] += 1
+            try:
+                # A retried task's Future is already running
+                if future.running() or future.set_running_or_notify_cancel():
+                    waited = time.monotonic() - submitted_at
+                    self._record_wait(ticket.priority, waited)
+                    try:
+                        future.set_result(fn(*args))
+                    except RetryLater as e:
+                        self._retry_later((future, fn, args, ticket, time.monotonic() + e.delay), e.delay)
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                with self._cond:
+                    self._running[ticket.priority] -= 1
+                    self._running_by_client[ticket.client] -= 1
+                    if not self._running_by_client[ticket.client]:
+                        del self._running_by_client[ticket.client]
+                    # A client that was at its cap may be runnable again
+                    self._cond.notify_all()
+
+    def _record_wait(self, priority, waited):
+        with self._cond:
+            stats = self._waits[priority]
+            stats[0] += 1
+            stats[1] += waited
+            stats[2] = max(stats[2], waited)
+        if self.on_wait:
+            self.on_wait(priority, waited)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'workers': self.workers,
+                'reserved_interactive': self.reserved,
+                'client_limit': self.client_limit,
+                'queued': {p: self._queued[p] for p in PRIORITIES},
+                'delayed': len(self._delayed),
+                'running': {p: self._running[p] for p in PRIORITIES},
+                'clients_waiting': len(self._queued_by_client),
+                'rejected': self.rejected,
+                'wait_ms': {p: {'count': count,
+                                'mean': round(total / count * 1000, 1) if count else 0.0,
+                                'max': round(longest * 1000, 1)}
+                            for p, (count, total, longest) in self._waits.items()},
+            }
@@ -0,0 +1,158 @@
+"""
+Content-addressed cache of rendered segment audio.
+
+Each segment is fully defined by voice, text, rate, pitch and volume, so its
+MP3 is stored on disk under a hash of those values. An in-memory index keeps
+entry sizes in LRU order and evicts the least recently used files once the
+byte budget is exceeded.
+
+Writes go to a temporary file and are moved into place atomically, so several
+threads and several server processes can share one cache directory. Each
+process keeps its own index and picks up entries written by others lazily;
+with several workers the index is also re-read from the directory every
+max_bytes / (4 * workers) bytes written, so the budget holds for the whole
+directory (overshooting by at most a quarter) rather than for each process.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+CACHE_SUFFIX = '.mp3'
+
+
+def make_key(voice, text, rate, pitch, volume):
+    """Hash of everything that determines a segment's audio"""
+    payload = '\x1f'.join([voice, rate, pitch, volume, text])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class SegmentCache:
+    """Disk-backed segment audio cache with a byte budget and LRU eviction"""
+
+    def __init__(self, directory, max_bytes, workers=1):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.sync_bytes = max_bytes // (4 * workers) if workers > 1 else 0
+        self._unsynced = 0  # bytes written since the index was last read from disk
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._index = OrderedDict()  # key -> size, least recently used first
+        self._lock = threading.Lock()
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+            self._load_index()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + CACHE_SUFFIX)
+
+    def _load_index(self):
+        """Rebuild the index from files on disk, oldest access first"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(CACHE_SUFFIX):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+            except OSError:
+                continue  # evicted by another worker meanwhile
+            entries.append((stat.st_mtime, entry.name[:-len(CACHE_SUFFIX)], stat.st_size))
+        index = OrderedDict((key, size) for _, key, size in sorted(entries))
+        with self._lock:
+            self._index = index
+            self.total_bytes = sum(index.values())
+            self._evict()
+
+    def get(self, key):
+        """Return cached audio bytes for key, or None on a miss"""
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            # Missing here, or evicted by another worker
+            with self._lock:
+                size = self._index.pop(key, None)
+                if size is not None:
+                    self.total_bytes -= size
+                self.misses += 1
+            return None
+
+        with self._lock:
+            if key not in self._index:
+                # Written by another worker since our index was built
+                self._index[key] = len(data)
+                self.total_bytes += len(data)
+            self._index.move_to_end(key)
+            self.hits += 1
+        try:
+            os.utime(path)  # share recency with other workers' index rebuilds
+        except OSError:
+            pass
+        return data
+
+    def put(self, key, data):
+        """Store audio bytes for key and evict old entries beyond the budget"""
+        if not self.enabled or len(data) > self.max_bytes:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+
+        with self._lock:
+            old_size = self._index.pop(key, None)
+            if old_size is not None:
+                self.total_bytes -= old_size
+            self._index[key] = len(data)
+            self.total_bytes += len(data)
+            self._unsynced += len(data)
+            sync = self.sync_bytes and self._unsynced >= self.sync_bytes
+            if sync:
+                self._unsynced = 0
+            else:
+                self._evict()
+        if sync:
+            # Count what the other workers wrote too before evicting
+            self._load_index()
+
+    def _evict(self):
+        """Drop least recently used entries until within budget (lock held)"""
+        while self.total_bytes > self.max_bytes and self._index:
+            key, size = self._index.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._index),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,123 @@
+"""
+Production server for TTS Studio
+
+Usage:
+    python serve.py                          # waitress on 0.0.0.0:5000
+    python serve.py --port 8000 --workers 4  # four worker processes (POSIX)
+
+Runs the app under waitress instead of the Flask development server: no
+debugger, no reloader, and a fixed pool of request threads. Slow requests
+(sync /api/generate, /api/batch and SSE streams) pass admission gates
+(TTS_HEAVY_REQUESTS, TTS_EVENT_STREAMS) and the pool is sized to what the
+gates admit or queue plus TTS_SERVER_SPARE_THREADS, so voices, previews,
+progress and metrics always find a free thread however many jobs are running.
+
+With --workers N the listening socket is opened once and N forked worker
+processes accept from it. Jobs, progress events, the segment cache, the
+voice catalog and the spool live in SQLite and on disk, so any worker can
+serve any request; the upstream rate budget is split between the workers.
+Windows has no fork, so it always runs a single worker.
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+from logging_setup import configure_logging
+
+logger = logging.getLogger('serve')
+
+
+def run_worker(sockets, threads=None):
+    """Import the app in this process and serve it on the given sockets"""
+    from waitress import serve
+    import app as tts_app
+
+    gated = tts_app.heavy_gate.capacity + tts_app.event_gate.capacity
+    threads = threads or gated + tts_app.app.config['SERVER_SPARE_THREADS']
+    logger.info("Worker %d serving with %d threads", os.getpid(), threads)
+    serve(tts_app.app, sockets=sockets, threads=threads,
+          connection_limit=max(100, threads * 4), channel_timeout=120, ident='tts-studio')
+
+
+def supervise(sock, workers, threads):
+    """Fork workers on a shared socket and replace any that die until told to stop"""
+    children = {}
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            code = 0
+            try:
+                run_worker([sock], threads)
+            except BaseException:
+                logger.exception("Worker %d crashed", os.getpid())
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = time.monotonic()
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        spawn()
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        started = children.pop(pid, None)
+        if stopping or started is None:
+            continue
+        logger.warning("Worker %d exited with status %d; restarting", pid, status)
+        # Do not spin if a worker dies right at startup
+        if time.monotonic() - started < 1.0:
+            time.sleep(1.0)
+        spawn()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default=os.environ.get('TTS_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('TTS_PORT', 5000)))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('TTS_WORKERS', 1)),
+                        help='server processes (POSIX only)')
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('TTS_SERVER_THREADS', 0)),
+                        help='request threads per worker (default: sized from the admission gates)')
+    args = parser.parse_args()
+
+    configure_logging(os.environ.get('TTS_LOG_LEVEL', 'INFO'), os.environ.get('TTS_LOG_FORMAT', 'text'))
+    workers = args.workers
+    if workers > 1 and not hasattr(os, 'fork'):
+        logger.warning("Multiple workers need fork(); running a single worker")
+        workers = 1
+    # Read by the app to split the upstream rate budget between processes
+    os.environ['TTS_WORKERS'] = str(workers)
+
+    sock = socket.create_server((args.host, args.port), backlog=1024)
+    logger.info("TTS Studio listening on http://%s:%d with %d worker(s)", args.host, args.port, workers)
+    if workers == 1:
+        run_worker([sock], args.threads)
+    else:
+        supervise(sock, workers, args.threads)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
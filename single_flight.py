@@ -0,0 +1,56 @@
+"""
+Single-flight registry for identical in-flight work.
+
+When several requests need the same thing at the same time (the same
+segment in the same voice and prosody, typically because a shared script is
+generated by several people at once) only the first one computes it. Later
+callers get the leader's Future and receive the same result when it
+resolves. The entry is dropped as soon as the Future is done, so anything
+asked for afterwards goes to the cache or starts a new flight.
+
+This is per process; identical jobs across worker processes are coalesced
+in the job store instead.
+"""
+import functools
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """Map of key -> Future for work that is currently being computed"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.started = 0
+        self.joined = 0
+
+    def begin(self, key):
+        """Return (future, leader)
+
+        The leader (leader=True) must resolve the future with set_result,
+        set_exception or cancel; everyone else just waits on it.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.joined += 1
+                return future, False
+            future = Future()
+            self._calls[key] = future
+            self.started += 1
+        future.add_done_callback(functools.partial(self._forget, key))
+        return future, True
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'started': self.started,
+                'joined': self.joined,
+            }
@@ -0,0 +1,276 @@
+"""
+Managed spool for job audio on disk.
+
+Every file the server writes for a job (segment files, results, batch
+outputs, ffmpeg scratch space) lives under one spool root, in a directory
+per job. The spool enforces a byte quota and a TTL, deletes a job's files
+a short grace period after they were delivered, sweeps in the background
+and clears what a crashed process left behind at startup.
+
+Delivery is recorded with a marker file in the job directory, so any server
+process sharing the spool can reclaim it.
+"""
+import contextlib
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+DELIVERED_MARKER = '.delivered'
+SCRATCH_DIR = '_tmp'
+# Leftovers younger than this may still belong to a live process sharing the spool
+STARTUP_MIN_AGE = 15 * 60
+
+
+class SpoolFull(Exception):
+    """The spool quota cannot fit a write even after reclaiming space"""
+
+
+def _dir_usage(path):
+    total = 0
+    files = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+                files += 1
+            except OSError:
+                pass
+    return total, files
+
+
+def _latest_mtime(path):
+    """Newest file mtime under path (the directory's own mtime if it is empty)"""
+    latest = None
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                mtime = os.path.getmtime(os.path.join(root, name))
+            except OSError:
+                continue
+            latest = mtime if latest is None else max(latest, mtime)
+    return latest if latest is not None else os.path.getmtime(path)
+
+
+class Spool:
+    """Per-job directories under a root, with quota, TTL and background sweeping"""
+
+    def __init__(self, root, max_bytes, ttl, delivered_grace=600.0, sweep_interval=60.0,
+                 is_active=None, is_known=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.delivered_grace = delivered_grace
+        self.sweep_interval = sweep_interval
+        self._is_active = is_active or (lambda job_id: False)  # job still writing its files
+        self._is_known = is_known or (lambda job_id: True)     # job exists in the store
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.removed_dirs = 0
+        self.removed_bytes = 0
+        self.last_sweep = None
+        os.makedirs(os.path.join(root, SCRATCH_DIR), exist_ok=True)
+
+    def job_dir(self, job_id, create=False):
+        root = os.path.realpath(self.root)
+        path = os.path.realpath(os.path.join(root, job_id))
+        if os.path.dirname(path) != root:
+            raise ValueError(f"Job id {job_id!r} does not name a directory in the spool")
+        if create:
+            os.makedirs(path, exist_ok=True)
+        return path
+
+    def remove(self, job_id):
+        """Delete a job's directory; return the bytes freed"""
+        path = self.job_dir(job_id)
+        if not os.path.isdir(path):
+            return 0
+        size, _ = _dir_usage(path)
+        shutil.rmtree(path, ignore_errors=True)
+        with self._lock:
+            self.removed_dirs += 1
+            self.removed_bytes += size
+        return size
+
+    def mark_delivered(self, job_id):
+        """Record that a job's output was sent; its files go after the grace period"""
+        path = self.job_dir(job_id)
+        if os.path.isdir(path):
+            with open(os.path.join(path, DELIVERED_MARKER), 'w'):
+                pass
+
+    @contextlib.contextmanager
+    def scratch_dir(self, prefix='scratch_'):
+        """Temporary directory inside the spool, removed on exit"""
+        path = os.path.join(self.root, SCRATCH_DIR, f'{prefix}{uuid.uuid4().hex}')
+        os.makedirs(path)
+        try:
+            yield path
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def _job_dirs(self):
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return []
+        return [name for name in names
+                if name != SCRATCH_DIR and os.path.isdir(os.path.join(self.root, name))]
+
+    def usage(self):
+        """Bytes and files currently in the spool"""
+        total, files = _dir_usage(self.root)
+        return {'bytes': total, 'files': files, 'jobs': len(self._job_dirs())}
+
+    def ensure_space(self, nbytes):
+        """Make room for nbytes, reclaiming finished jobs first; raise SpoolFull if impossible"""
+        if not self.max_bytes:
+            return
+        used = self.usage()['bytes']
+        if used + nbytes <= self.max_bytes:
+            return
+        used = self._evict(used + nbytes - self.max_bytes, used)
+        if used + nbytes > self.max_bytes:
+            raise SpoolFull(f"Spool quota exceeded: {used + nbytes} > {self.max_bytes} bytes")
+
+    def _evict(self, needed, used):
+        """Remove least recently touched inactive job dirs until needed bytes are freed
+
+        A young directory the store does not know yet is an upload still
+        being received (its job is registered once the body is in), so it
+        is left alone, as in sweep().
+        """
+        candidates = []
+        now = time.time()
+        for name in self._job_dirs():
+            if self._is_active(name):
+                continue
+            try:
+                mtime = _latest_mtime(self.job_dir(name))
+                if not self._is_known(name) and now - mtime <= STARTUP_MIN_AGE:
+                    continue
+            except OSError:
+                continue
+            candidates.append((mtime, name))
+        for _, name in sorted(candidates):
+            if needed <= 0:
+                break
+            freed = self.remove(name)
+            logger.info("Spool: evicted %s (%d bytes) to stay under quota", name, freed)
+            needed -= freed
+            used -= freed
+        return used
+
+    def sweep(self):
+        """Remove expired, delivered and orphaned job dirs, then enforce the quota"""
+        now = time.time()
+        removed = 0
+        for name in self._job_dirs():
+            path = self.job_dir(name)
+            if self._is_active(name):
+                continue
+            try:
+                marker = os.path.join(path, DELIVERED_MARKER)
+                if os.path.exists(marker) and now - os.path.getmtime(marker) > self.delivered_grace:
+                    reason = 'delivered'
+                elif self.ttl and now - _latest_mtime(path) > self.ttl:
+                    reason = 'expired'
+                elif not self._is_known(name) and now - _latest_mtime(path) > STARTUP_MIN_AGE:
+                    reason = 'orphaned'
+                else:
+                    continue
+            except OSError:
+                continue
+            freed = self.remove(name)
+            removed += 1
+            logger.debug("Spool: removed %s job dir %s (%d bytes)", reason, name, freed)
+        self._clear_scratch(STARTUP_MIN_AGE)
+        if self.max_bytes:
+            used = self.usage()['bytes']
+            if used > self.max_bytes:
+                self._evict(used - self.max_bytes, used)
+        self.last_sweep = now
+        return removed
+
+    def _clear_scratch(self, min_age):
+        scratch = os.path.join(self.root, SCRATCH_DIR)
+        now = time.time()
+        for name in os.listdir(scratch) if os.path.isdir(scratch) else []:
+            path = os.path.join(scratch, name)
+            try:
+                if now - os.path.getmtime(path) > min_age:
+                    if os.path.isdir(path):
+                        shutil.rmtree(path, ignore_errors=True)
+                    else:
+                        os.remove(path)
+            except OSError:
+                pass
+
+    def cleanup_startup(self):
+        """Clear crash leftovers: partial .tmp files, old scratch dirs and orphaned job dirs
+
+        Only the spool root is touched; the shared system temp dir may hold
+        other programs' files.
+        """
+        removed_tmp = 0
+        cutoff = time.time() - STARTUP_MIN_AGE
+        for root, _, names in os.walk(self.root):
+            for name in names:
+                if name.endswith('.tmp'):
+                    path = os.path.join(root, name)
+                    try:
+                        if os.path.getmtime(path) < cutoff:
+                            os.remove(path)
+                            removed_tmp += 1
+                    except OSError:
+                        pass
+        self._clear_scratch(STARTUP_MIN_AGE)
+        orphans = 0
+        for name in self._job_dirs():
+            path = self.job_dir(name)
+            try:
+                if not self._is_known(name) and _latest_mtime(path) < cutoff:
+                    self.remove(name)
+                    orphans += 1
+            except OSError:
+                pass
+        if removed_tmp or orphans:
+            logger.info("Spool startup cleanup: %d partial files, %d orphaned job dirs removed",
+                        removed_tmp, orphans)
+        return {'partial_files': removed_tmp, 'orphaned_jobs': orphans}
+
+    def start(self):
+        """Sweep on a daemon thread every sweep_interval seconds"""
+        if self._thread:
+            return
+
+        def run():
+            while not self._stop.wait(self.sweep_interval):
+                try:
+                    self.sweep()
+                except Exception as e:
+                    logger.warning("Spool sweep failed: %s: %s", type(e).__name__, e)
+
+        self._thread = threading.Thread(target=run, name='spool-sweeper', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        stats = self.usage()
+        with self._lock:
+            stats.update({
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'delivered_grace': self.delivered_grace,
+                'removed_dirs': self.removed_dirs,
+                'removed_bytes': self.removed_bytes,
+                'last_sweep': self.last_sweep,
+            })
+        return stats
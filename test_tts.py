@@ -1,29 +1,497 @@
-import asyncio
-import edge_tts
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
 
-async def test_tts():
-    """Test basic edge-tts functionality"""
-    text = "[happy] Hello! This is a test."
+import pytest
+
+import mp3_concat
+from edge_standin import EdgeStandIn
+from job_store import JobExists, JobStore
+from rate_limiter import AdaptiveRateLimiter
+from request_gate import RequestGate
+from scheduler import FairScheduler, RetryLater, SchedulerFull, Ticket
+from segment_cache import SegmentCache
+from single_flight import SingleFlight
+from spool import Spool, SpoolFull
+from tts_backends import FAKE_VOICES, create_backend, fake_audio
+from voice_catalog import VoiceCatalog
+
+@pytest.fixture(scope='module')
+def app_module(tmp_path_factory):
+    """The app module, imported offline with its caches and database in a temp dir"""
+    root = tmp_path_factory.mktemp('app')
+    env = {
+        'TTS_BACKEND': 'fake', 'TTS_WARMUP': '0', 'TTS_LOG_LEVEL': 'WARNING',
+        'TTS_JOB_DB': str(root / 'jobs.sqlite3'), 'TTS_JOB_DIR': str(root / 'jobs'),
+        'TTS_CACHE_DIR': str(root / 'segments'), 'TTS_PREVIEW_DIR': str(root / 'previews'),
+        'TTS_VOICE_CATALOG_PATH': str(root / 'voices.json'),
+    }
+    saved = {name: os.environ.get(name) for name in env}
+    os.environ.update(env)
+    try:
+        import app
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+    return app
+
+def check_backend(backend, output_file=None):
+    """Synthesize one emotional test line through a backend"""
+    text = "Hello! This is a test."
     voice = "en-US-AriaNeural"
+    # Same prosody the old hand-written SSML test used for [happy]
+    prosody = {'pitch': '+20%', 'rate': '+10%', 'volume': '+5dB'}
     
-    # Test with SSML
-    ssml = '''<speak version="1.0" xmlns="http://www.w3.org/2001/10/synthesis" xmlns:mstts="https://www.w3.org/2001/mstts" xml:lang="en-US">
-    <voice name="en-US-AriaNeural">
-    <prosody pitch="+20%" rate="+10%" volume="+5dB">Hello! This is a test.</prosody>
-    </voice>
-    </speak>'''
-    
-    print("Testing SSML generation...")
-    print(ssml)
-    
+    print(f"Testing {backend.name} backend...")
+    audio = backend.synthesize(text, voice, **prosody)
+    _, fmt, frames = mp3_concat.audio_frames(audio)
+    print(f"✓ Success! {len(audio)} bytes, {frames} frames at {fmt.sample_rate} Hz")
+    if output_file:
+        with open(output_file, 'wb') as f:
+            f.write(audio)
+        print(f"Audio saved to {output_file}")
+    return audio
+
+def test_tts():
+    """Offline check that the fake backend produces valid MP3 frames"""
+    audio = check_backend(create_backend('fake', latency=0))
+    assert mp3_concat.audio_frames(audio)[2] > 0
+
+def test_edge_pool():
+    """Pooled edge backend against the local stand-in: connections are reused and replaced"""
+    server = EdgeStandIn(handshake_delay=0, max_turns=3)
+    backend = create_backend('edge', pool_size=1, url=server.start())
+    try:
+        for _ in range(5):
+            assert mp3_concat.audio_frames(check_backend(backend))[2] > 0
+        # The server drops each connection after 3 turns; the pool reconnects once
+        assert server.connections == 2
+        assert backend.stats()['pool']['opened'] == 2
+    finally:
+        backend.close()
+        server.stop()
+
+def test_spool_job_dir(tmp_path):
+    """Job ids never name a directory outside the spool root"""
+    spool = Spool(str(tmp_path / 'spool'), max_bytes=1024, ttl=60)
+    assert os.path.isdir(spool.job_dir('job-1', create=True))
+    victim = tmp_path / 'victim'
+    victim.mkdir()
+    for job_id in (str(victim), '../victim', 'a/../../victim', '..', ''):
+        with pytest.raises(ValueError):
+            spool.remove(job_id)
+    assert victim.is_dir()
+
+def test_create_job_existing_id(tmp_path):
+    """A job id is never reused for another job"""
+    store = JobStore(str(tmp_path / 'jobs.sqlite3'))
+    store.create_job('job', 'en-US-AriaNeural', [], status='running', client='a')
+    with pytest.raises(JobExists):
+        store.create_job('job', 'en-US-AriaNeural', [], client='b')
+    assert (store.get_job('job')['status'], store.get_job('job')['client']) == ('running', 'a')
+
+def test_generate_existing_task_id(app_module):
+    """Reusing a task id gets 409 and leaves the earlier job alone"""
+    client = app_module.app.test_client()
+    body = {'text': 'Hello there.', 'voice': 'en-US-AriaNeural', 'task_id': 'shared-id'}
+    assert client.post('/api/generate', json=body).status_code == 200
+    assert client.post('/api/generate', json=body).status_code == 409
+    assert app_module.job_store.get_job('shared-id')['status'] == 'done'
+
+def test_batch_existing_task_id(app_module):
+    """A batch reusing a task id gets 409; the earlier batch keeps its outputs"""
+    client = app_module.app.test_client()
+    body = {'task_id': 'batch-id', 'format': 'manifest', 'voice': 'en-US-AriaNeural',
+            'documents': [{'id': 'one', 'text': 'Hello there.'}, {'id': 'two', 'text': 'Hello there. Bye.'}]}
+    with client.post('/api/batch', json=body) as response:
+        assert response.status_code == 200
+        manifest = response.get_json()
+    assert manifest['stats']['unique_segments'] == 2
+    with client.post('/api/batch', json=dict(body, documents=[{'id': 'one', 'text': 'Other.'}])) as response:
+        assert response.status_code == 409
+    assert app_module.job_store.get_job('batch-id')['status'] == 'done'
+    with client.get('/api/batch/batch-id/one') as audio:
+        assert audio.status_code == 200
+        assert len(audio.data) == manifest['documents'][0]['bytes']
+
+def test_stream_failure_status(app_module):
+    """A stream that fails after its headers were sent leaves the error in the task's progress"""
+    client = app_module.app.test_client()
+    response = client.post('/api/generate?stream=1', json={
+        'text': 'Hello there.', 'voice': 'xx-XX-BogusNeural', 'task_id': 'stream-fails'})
+    assert response.status_code == 200
+    assert response.get_data() == b''
+    response.close()  # releases the heavy-request slot, as the server does
+    progress = client.get('/api/progress/stream-fails').get_json()
+    assert progress['status'] == 'failed'
+    assert 'Invalid voice' in progress['error']
+
+def test_spool_evict_skips_uploads(tmp_path):
+    """Quota eviction reclaims finished jobs but not a young directory the store does not know yet"""
+    known = {'done-job'}
+    spool = Spool(str(tmp_path / 'spool'), max_bytes=1000, ttl=60, is_known=known.__contains__)
+    for job_id in ('done-job', 'receiving'):
+        with open(os.path.join(spool.job_dir(job_id, create=True), 'data'), 'wb') as f:
+            f.write(bytes(400))
+    spool.ensure_space(500)
+    assert not os.path.exists(spool.job_dir('done-job'))
+    assert os.path.exists(os.path.join(spool.job_dir('receiving'), 'data'))
+    with pytest.raises(SpoolFull):
+        spool.ensure_space(700)
+
+def test_segment_cache_shared_budget(tmp_path):
+    """Two workers on one cache directory keep it within the budget together"""
+    directory = str(tmp_path / 'segments')
+    workers = [SegmentCache(directory, max_bytes=10000, workers=2) for _ in range(2)]
+    for n in range(60):
+        workers[n % 2].put(f'key{n}', bytes(500))
+    on_disk = sum(entry.stat().st_size for entry in os.scandir(directory))
+    assert on_disk <= 10000 * 5 // 4
+    assert workers[0].get('key59') == bytes(500)
+    assert workers[0].get('key0') is None
+
+def test_requeue_stale(tmp_path):
+    """Background jobs of a dead worker are queued again; blocking requests fail"""
+    store = JobStore(str(tmp_path / 'jobs.sqlite3'))
+    for kind in ('async', 'upload', 'sync', 'batch'):
+        store.create_job(kind, 'en-US-AriaNeural', [], kind=kind, status='running', worker='gone')
+    assert sorted(store.requeue_stale(stale_after=-1)) == ['async', 'upload']
+    assert {kind: store.get_job(kind)['status'] for kind in ('async', 'upload', 'sync', 'batch')} == {
+        'async': 'queued', 'upload': 'queued', 'sync': 'failed', 'batch': 'failed'}
+
+def run_in_order(scheduler, tickets):
+    """Queue one task per ticket behind a blocked worker; return the order they ran in"""
+    release, order = threading.Event(), []
+    scheduler.submit(release.wait, ticket=Ticket('blocker', 'block', 'bulk'))
+    time.sleep(0.05)
+    futures = [scheduler.submit(order.append, n, ticket=ticket) for n, ticket in enumerate(tickets)]
+    release.set()
+    for future in futures:
+        future.result(5)
+    return [tickets[n] for n in order]
+
+def test_scheduler_stride_order():
+    """Classes share the worker by weight: previews go first, bulk is never starved"""
+    scheduler = FairScheduler(workers=1, reserved=0, client_limit=100)
+    tickets = [Ticket('c', 'doc', 'bulk')] * 3 + [Ticket('c', 'preview', 'interactive')] * 40
+    priorities = [ticket.priority for ticket in run_in_order(scheduler, tickets)]
+    # The blocker used bulk's first turn; after that bulk gets one in 17 (weights 16:1)
+    assert priorities[:17] == ['interactive'] * 17
+    assert priorities[:36].count('bulk') == 2
+
+def test_scheduler_round_robin():
+    """Clients take turns within a class, and so do one client's jobs"""
+    scheduler = FairScheduler(workers=1, reserved=0, client_limit=100)
+    tickets = ([Ticket('a', 'a1', 'bulk')] * 3 + [Ticket('a', 'a2', 'bulk')] * 3
+               + [Ticket('b', 'b1', 'bulk')] * 2)
+    ran = [(ticket.client, ticket.flow) for ticket in run_in_order(scheduler, tickets)]
+    assert ran == [('a', 'a1'), ('b', 'b1'), ('a', 'a2'), ('b', 'b1'), ('a', 'a1'),
+                   ('a', 'a2'), ('a', 'a1'), ('a', 'a2')]
+
+def test_scheduler_caps():
+    """A client at its cap waits while others run; previews and the reserved worker are exempt"""
+    scheduler = FairScheduler(workers=2, reserved=1, client_limit=1)
+    release = threading.Event()
+    try:
+        held = scheduler.submit(release.wait, ticket=Ticket('a', 'job', 'bulk'))
+        capped = scheduler.submit(lambda: 'a', ticket=Ticket('a', 'job', 'bulk'))
+        assert scheduler.submit(lambda: 'b', ticket=Ticket('b', 'job', 'bulk')).result(2) == 'b'
+        assert not capped.done()
+        # Both general workers could be busy; the reserved one still takes previews
+        assert scheduler.submit(lambda: 'p', ticket=Ticket('a', 'preview', 'interactive')).result(2) == 'p'
+        assert scheduler.stats()['running']['bulk'] == 1
+    finally:
+        release.set()
+    held.result(2)
+    assert capped.result(2) == 'a'
+
+def test_scheduler_admit():
+    """admit() refuses work that piles onto a backlog, never a request for its own size"""
+    scheduler = FairScheduler(workers=1, reserved=0, client_queue_limit=3, queue_limit=6)
+    release = threading.Event()
+    try:
+        scheduler.submit(release.wait, ticket=Ticket('x', 'block', 'bulk'))
+        time.sleep(0.05)
+        scheduler.admit('a', 100)
+        for _ in range(3):
+            scheduler.submit(lambda: None, ticket=Ticket('a', 'job', 'bulk'))
+        with pytest.raises(SchedulerFull) as error:
+            scheduler.admit('a', 1, rate=0.5)
+        assert error.value.retry_after == 6
+        # Work waiting elsewhere (jobs not started yet) counts against the client
+        scheduler.admit('b', 3)
+        with pytest.raises(SchedulerFull):
+            scheduler.admit('b', 1, waiting=3)
+        for _ in range(2):
+            scheduler.submit(lambda: None, ticket=Ticket('b', 'job', 'bulk'))
+        scheduler.admit('c', 1)
+        with pytest.raises(SchedulerFull):
+            scheduler.admit('c', 2)
+        assert scheduler.stats()['rejected'] == 3
+    finally:
+        release.set()
+
+def test_scheduler_retry_later():
+    """A task that raises RetryLater frees its worker and runs again after the delay"""
+    scheduler = FairScheduler(workers=1, reserved=0)
+    runs = []
+
+    def flaky():
+        runs.append(time.monotonic())
+        if len(runs) == 1:
+            raise RetryLater(0.3)
+        return 'done'
+
+    retried = scheduler.submit(flaky, ticket=Ticket('a', 'job', 'bulk'))
+    time.sleep(0.05)
+    assert scheduler.stats()['delayed'] == 1
+    # The only worker is free for other work during the backoff
+    assert scheduler.submit(lambda: 'other', ticket=Ticket('b', 'job', 'bulk')).result(0.2) == 'other'
+    assert not retried.done()
+    assert retried.result(2) == 'done'
+    assert runs[1] - runs[0] >= 0.3
+    assert scheduler.stats()['delayed'] == 0
+
+def test_rate_limiter_aimd():
+    """Successes grow rate and concurrency additively; throttling halves them and pauses"""
+    limiter = AdaptiveRateLimiter(rate=2.0, max_rate=8.0, burst=10, concurrency=2, max_concurrency=6,
+                                  increase_after=3, rate_step=0.5, decrease_factor=0.5, cooldown=10.0)
+    for outcome in ('success', 'success', 'error', 'success', 'success'):
+        limiter.acquire(timeout=1)
+        limiter.release(outcome)
+    # The error broke the streak
+    assert (limiter.rate, limiter.concurrency) == (2.0, 2)
+    limiter.acquire(timeout=1)
+    limiter.release('success')
+    assert (limiter.rate, limiter.concurrency) == (2.5, 3)
+
+    limiter.acquire(timeout=1)
+    limiter.release('throttled')
+    state = limiter.snapshot()
+    assert (state['rate'], state['concurrency']) == (1.25, 1)
+    assert state['tokens'] < 1 and state['paused_for'] > 9
+    with pytest.raises(TimeoutError):
+        limiter.acquire(timeout=0.1)
+
+def test_request_gate():
+    """A full gate queues a bounded number of requests briefly, then turns them away"""
+    gate = RequestGate('test', 1, wait=0.1)
+    assert gate.acquire()
+    started = time.monotonic()
+    assert not gate.acquire()
+    assert time.monotonic() - started >= 0.1
+    threading.Timer(0.05, gate.release).start()
+    assert gate.acquire()
+    gate.release()
+    assert gate.stats() == {'limit': 1, 'in_use': 0, 'waiting': 0, 'max_waiting': 1,
+                            'admitted': 2, 'rejected': 1}
+
+def test_single_flight():
+    """Callers of an in-flight key share the leader's future until it is done"""
+    flights = SingleFlight()
+    future, leader = flights.begin('key')
+    assert leader
+    assert flights.begin('key') == (future, False)
+    future.set_result(b'audio')
+    again, leader = flights.begin('key')
+    assert leader and again is not future
+    assert flights.stats() == {'in_flight': 1, 'started': 2, 'joined': 1}
+
+def test_synthesis_fails_fast(app_module):
+    """An invalid voice fails on its first attempt instead of retrying with backoff"""
+    client = app_module.app.test_client()
+    started = time.monotonic()
+    response = client.post('/api/generate', json={'text': 'Hello there.', 'voice': 'xx-XX-BogusNeural'})
+    assert response.status_code == 500
+    assert 'after 1 attempts' in response.get_json()['error']
+    assert time.monotonic() - started < 1
+
+def test_follower_redispatches_cancelled_leader(app_module):
+    """A segment waiting on a flight whose leader was cancelled is synthesized on its own"""
+    segment = {'text': 'Single flight test line.', 'emotion': 'neutral',
+               'prosody': app_module.EMOTION_PROSODY['neutral']}
+    app_module.job_store.create_job('flight-job', 'en-US-AriaNeural', [segment, segment])
+    key = app_module.segment_cache_key(segment, 'en-US-AriaNeural')
+    flight, leader = app_module.segment_flights.begin(key)
+    assert leader
+    follower, cached = app_module.dispatch_segment(0, segment, 'en-US-AriaNeural', 'flight-job')
+    assert not cached and not follower.done()
+    flight.cancel()
+    audio = follower.result(5)
+    assert audio and app_module.segment_cache.get(key) == audio
+    # Later identical segments come from the cache
+    assert app_module.dispatch_segment(1, segment, 'en-US-AriaNeural', 'flight-job')[1]
+
+def test_sse_events(app_module):
+    """The event stream replays a finished task and resumes after Last-Event-ID"""
+    client = app_module.app.test_client()
+    with client.post('/api/generate', json={'text': 'Hello there. [happy] Hooray!', 'task_id': 'sse-task',
+                                            'voice': 'en-US-AriaNeural'}) as response:
+        assert response.status_code == 200
+    with client.get('/api/events/sse-task') as response:
+        assert response.mimetype == 'text/event-stream'
+        events = [block.split('\n') for block in response.get_data(as_text=True).split('\n\n') if block.startswith('id:')]
+    types = [lines[1][len('event: '):] for lines in events]
+    assert types[0] == 'started' and types[-1] == 'done'
+    assert types.count('segment_done') == 2
+    last_id = events[-2][0][len('id: '):]
+    with client.get('/api/events/sse-task', headers={'Last-Event-ID': last_id}) as response:
+        assert response.get_data(as_text=True).count('event: ') == 1
+
+def test_preview_unknown_voice(app_module):
+    """Only catalog voices are rendered; the attachment name is quoted"""
+    client = app_module.app.test_client()
+    rendered = app_module.preview_store.stats()['rendered']
+    assert client.get('/api/preview/bogus-voice').status_code == 404
+    assert client.post('/api/preview', json={'voice': 'a"b\r\nX: y'}).status_code == 404
+    assert app_module.preview_store.stats()['rendered'] == rendered
+    response = client.post('/api/preview', json={'voice': 'en-GB-SoniaNeural'})
+    assert response.status_code == 200
+    assert response.headers['Content-Disposition'] == 'attachment; filename=preview_en-GB-SoniaNeural.mp3'
+
+def test_voice_catalog_variants(tmp_path):
+    """Filter results are cached under normalized keys; unknown filters are not cached"""
+    catalog = VoiceCatalog(str(tmp_path / 'voices.json'), ttl=3600, fetch=lambda: FAKE_VOICES)
+    assert catalog.get(' EN ,en,xx-YY') == catalog.get('en')
+    assert catalog.get('xx')[0] == catalog.get(gender='robot')[0] == b'{}'
+    for n in range(catalog.MAX_VARIANTS * 2):
+        catalog.get(f'x{n}', gender='female')
+        catalog.get('en', gender=f'g{n}')
+    assert list(catalog._variants) == [(('en',), '')]
+
+def without_spaces(text):
+    return ''.join(text.split())
+
+def test_chunk_long_text_limits(app_module):
+    """Chunks respect the size limit, end at sentence ends and lose no text"""
+    sentences = [f"Sentence number {n} is here, with a clause; and a few more words." for n in range(40)]
+    text = ' '.join(sentences)
+    chunks = app_module.chunk_long_text(text, max_length=200)
+    assert len(chunks) > 1
+    assert all(0 < len(chunk) <= 200 for chunk in chunks)
+    assert all(chunk.endswith('.') for chunk in chunks)
+    assert without_spaces(''.join(chunks)) == without_spaces(text)
+    assert app_module.chunk_long_text('Short.', max_length=200) == ['Short.']
+
+def test_chunk_long_text_finer_boundaries(app_module):
+    """Without sentence ends, text splits between words; only unbroken runs are cut"""
+    words = ' '.join(f'word{n}' for n in range(300))
+    chunks = app_module.chunk_long_text(words, max_length=100)
+    assert all(len(chunk) <= 100 for chunk in chunks)
+    assert [word for chunk in chunks for word in chunk.split()] == words.split()
+    assert app_module.chunk_long_text('x' * 250, max_length=100) == ['x' * 100, 'x' * 100, 'x' * 50]
+
+def test_chunk_long_text_cjk(app_module):
+    """CJK sentence and clause marks are boundaries even without spaces"""
+    text = '今天天气很好。' * 30 + '我们去公园散步，然后回家。' * 20
+    chunks = app_module.chunk_long_text(text, max_length=50)
+    assert all(len(chunk) <= 50 for chunk in chunks)
+    assert all(chunk.endswith('。') for chunk in chunks)
+    assert ''.join(chunks) == text
+    clauses = '，'.join(['一二三四五六七八九十'] * 20)
+    chunks = app_module.chunk_long_text(clauses, max_length=30)
+    assert all(len(chunk) <= 30 for chunk in chunks)
+    assert all(chunk.endswith('，') for chunk in chunks[:-1])
+    assert ''.join(chunks) == clauses
+
+def test_planned_segments_match_parse_document(app_module):
+    """Streamed parsing of a tagged document cut at random points matches parse_document"""
+    pieces = ['[happy]', '[SAD]', '[calm]', '[bogus]', '[not a tag]', '[', ']', 'Plain words ',
+              'A sentence. ', 'A clause, ', 'Question? ', '\n\n', '  ', 'x' * 30, 'y' * 700]
+    rng = random.Random(7)
+    documents = ['[HAPPY]', '[HAPPY]   [sad]', '  Leading text [happy] tagged text',
+                 '[aside] dropped text [calm] kept text', 'No tags at all.']
+    for _ in range(300):
+        documents.append(''.join(rng.choice(pieces) for _ in range(rng.randint(1, 80))))
+    saved = app_module.app.config['PLAN_MAX_CHARS']
     try:
-        communicate = edge_tts.Communicate(ssml, voice)
-        await communicate.save("test_output.mp3")
-        print("✓ Success! Audio saved to test_output.mp3")
+        for n, text in enumerate(documents):
+            app_module.app.config['PLAN_MAX_CHARS'] = rng.choice([40, 200, 1000])
+            cuts = sorted(rng.sample(range(1, len(text)), min(len(text) - 1, rng.randint(0, 30))))
+            chunks = [text[start:end] for start, end in zip([0] + cuts, cuts + [len(text)])]
+            expected, _, _ = app_module.parse_document(text)
+            assert list(app_module.iter_planned_segments(chunks)) == expected, (n, text)
+    finally:
+        app_module.app.config['PLAN_MAX_CHARS'] = saved
+
+def tone_segment(ffmpeg_exe, frequency, seconds=1.0):
+    """24 kHz mono MP3 of a tone with 0.3 s of silence on both sides"""
+    return subprocess.run(
+        [ffmpeg_exe, '-v', 'error', '-f', 'lavfi', '-i', f'sine=frequency={frequency}:duration={seconds}',
+         '-af', 'adelay=300,apad=pad_dur=0.3,volume=0.3', '-ar', '24000', '-ac', '1',
+         '-c:a', 'libmp3lame', '-b:a', '48k', '-f', 'mp3', 'pipe:1'], capture_output=True, check=True).stdout
+
+def test_postprocess_blocks(monkeypatch):
+    """Post-processing trims, crossfades and normalizes the same whatever the block size"""
+    postprocess = pytest.importorskip('postprocess')
+    ffmpeg_exe = pytest.importorskip('imageio_ffmpeg').get_ffmpeg_exe()
+    segments = [tone_segment(ffmpeg_exe, frequency) for frequency in (220, 330, 440)]
+    audio, stats = postprocess.process(segments, [0, -15, 6], ffmpeg_exe)
+    monkeypatch.setattr(postprocess, 'BLOCK_SAMPLES', 1000)
+    small_audio, small_stats = postprocess.process(segments, [0, -15, 6], ffmpeg_exe)
+    assert small_audio == audio
+    assert small_stats['normalize_gain_db'] == stats['normalize_gain_db']
+    # About 0.3 s of silence per side is trimmed down to 80 ms
+    assert stats['input_seconds'] > 4.7
+    assert 3.4 < stats['output_seconds'] < 3.6
+    assert mp3_concat.audio_frames(audio)[2] > 0
+
+def test_postprocess_job(app_module):
+    """A multi-segment document with postprocess on comes back as one MP3"""
+    pytest.importorskip('numpy')
+    client = app_module.app.test_client()
+    response = client.post('/api/generate', json={
+        'text': '[happy] Hello there. [whisper] This part is quiet. [angry] And this one is loud!',
+        'voice': 'en-US-AriaNeural', 'postprocess': True})
+    assert response.status_code == 200
+    assert response.mimetype == 'audio/mpeg'
+    assert mp3_concat.audio_frames(response.data)[2] > 0
+
+# MPEG-2 Layer III mono frames as FakeBackend makes them: 24 kHz (144 bytes) and 22.05 kHz (156 bytes)
+FRAME_24K = b'\xff\xf3\x64\xc4' + bytes(140)
+FRAME_22K = b'\xff\xf3\x60\xc4' + bytes(152)
+
+def id3_tag(payload=b'TIT2 test'):
+    size = len(payload)
+    return b'ID3\x04\x00\x00' + bytes([(size >> 21) & 0x7f, (size >> 14) & 0x7f, (size >> 7) & 0x7f, size & 0x7f]) + payload
+
+def xing_frame():
+    # MPEG-2 mono side info is 9 bytes, so the tag sits right after it
+    return FRAME_24K[:13] + b'Xing' + FRAME_24K[17:]
+
+def test_mp3_concat_strips_tags():
+    """The first ID3 tag is kept; later tags and every Xing frame are dropped"""
+    first = id3_tag() + xing_frame() + FRAME_24K * 3
+    second = id3_tag(b'TIT2 other') + xing_frame() + FRAME_24K * 2 + b'TAG trailing garbage'
+    joined = mp3_concat.concat([first, second])
+    assert joined == id3_tag() + FRAME_24K * 5
+    frames, fmt, count = mp3_concat.audio_frames(joined)
+    assert (count, fmt.sample_rate, bytes(frames)) == (5, 24000, FRAME_24K * 5)
+    assert bytes(mp3_concat.stream_frames(second, first=False)) == FRAME_24K * 2
+
+def test_mp3_concat_format_mismatch():
+    """Segments with another sample rate raise FormatMismatch instead of joining"""
+    assert mp3_concat.concat([fake_audio('Hello'), fake_audio('there')]) == fake_audio('Hello') + fake_audio('there')
+    with pytest.raises(mp3_concat.FormatMismatch):
+        mp3_concat.concat([FRAME_24K * 2, FRAME_22K * 2])
+    with pytest.raises(mp3_concat.InvalidMP3):
+        mp3_concat.concat([FRAME_24K, b'not an mp3'])
+
+if __name__ == "__main__":
+    # python test_tts.py [edge|fake]
+    name = sys.argv[1] if len(sys.argv) > 1 else os.environ.get('TTS_BACKEND', 'edge')
+    backend = create_backend(name)
+    try:
+        check_backend(backend, "test_output.mp3")
     except Exception as e:
         print(f"✗ Error: {type(e).__name__}: {e}")
         import traceback
         traceback.print_exc()
-
-if __name__ == "__main__":
-    asyncio.run(test_tts())
+    finally:
+        backend.close()
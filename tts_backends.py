@@ -0,0 +1,228 @@
+"""
+Synthesis backends: turn one segment (text, voice, prosody) into MP3 bytes.
+
+The server only talks to a backend through synthesize() and list_voices(), so
+the network-bound edge-tts implementation can be swapped for FakeBackend, a
+deterministic offline stand-in that returns valid (silent) MP3 frames and can
+simulate latency, throttling and failures. That makes the whole
+/api/generate pipeline runnable in load tests and profiles without network.
+
+edge_tts, aiohttp and the engine thread are only loaded when the edge
+backend is first used (or warmed), so importing this module is cheap.
+"""
+import hashlib
+import random
+import threading
+import time
+
+
+def is_permanent_error(exc):
+    """Return True if retrying a synthesis that raised exc cannot succeed
+
+    edge_tts raises ValueError for a malformed voice name and
+    NoAudioReceived when the service has nothing to say for the input (an
+    unknown voice, text without speakable content).
+    """
+    return isinstance(exc, (ValueError, TypeError)) or type(exc).__name__ == 'NoAudioReceived'
+
+
+class SynthesisBackend:
+    """Interface every backend implements"""
+
+    name = 'base'
+
+    def synthesize(self, text, voice, rate="+0%", pitch="+0Hz", volume="+0dB", timeout=90):
+        """Return the MP3 bytes for one segment; raise on failure"""
+        raise NotImplementedError
+
+    def list_voices(self):
+        """Return the voice list in the edge-tts list_voices() format"""
+        raise NotImplementedError
+
+    def stats(self):
+        """Backend-specific counters for /api/limiter"""
+        return {}
+
+    def warm(self):
+        """Load whatever the first synthesize() would otherwise wait for"""
+
+    def close(self):
+        pass
+
+
+class EdgeTTSBackend(SynthesisBackend):
+    """Microsoft Edge online TTS through the shared in-process engine
+
+    By default every segment opens its own connection through
+    edge_tts.Communicate. With pool_size > 0 segments go over a pool of warm
+    WebSocket connections to url (edge_pool.py) instead; that client has
+    only been tested against edge_standin.py so far.
+    """
+
+    name = 'edge'
+
+    def __init__(self, engine=None, pool_size=0, pool_idle=30.0, url=None):
+        self.pool_size = pool_size
+        self.pool_idle = pool_idle
+        self.url = url
+        self._engine = engine
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            with self._lock:
+                if self._engine is None:
+                    from tts_engine import SynthesisEngine
+                    self._engine = SynthesisEngine()
+        return self._engine
+
+    @property
+    def pool(self):
+        if self._pool is None and self.pool_size:
+            with self._lock:
+                if self._pool is None:
+                    from edge_pool import EdgeSessionPool, WSS_URL
+                    self._pool = EdgeSessionPool(self.url or WSS_URL, max_size=self.pool_size,
+                                                 max_idle=self.pool_idle)
+        return self._pool
+
+    def synthesize(self, text, voice, rate="+0%", pitch="+0Hz", volume="+0dB", timeout=90):
+        # edge-tts only takes volume as a percentage, so dB gains are not sent upstream
+        if self.pool is None:
+            return self.engine.synthesize(text, voice, rate, pitch, timeout=timeout)
+        from tts_engine import convert_pitch
+        return self.engine.run(self.pool.synthesize(text, voice, rate, convert_pitch(pitch)), timeout=timeout)
+
+    def list_voices(self):
+        import edge_tts
+        return self.engine.run(edge_tts.list_voices(), timeout=30)
+
+    def warm(self):
+        self.engine.start()  # imports edge_tts
+        self.pool
+
+    def stats(self):
+        return {'pool': self._pool.stats()} if self._pool else {}
+
+    def close(self):
+        if self._engine is None:
+            return
+        if self._pool is not None and self._engine.running:
+            self._engine.run(self._pool.close(), timeout=5)
+        self._engine.stop()
+
+
+class SimulatedThrottle(Exception):
+    """Raised by FakeBackend to look like an upstream 429"""
+
+    status = 429
+
+
+class SimulatedFailure(RuntimeError):
+    """Raised by FakeBackend for a simulated non-throttling failure"""
+
+
+# MPEG-2 Layer III, 24 kHz, 48 kbps, mono: the format edge-tts returns
+_FAKE_FRAME_HEADER = b'\xff\xf3\x64\xc4'
+_FAKE_FRAME_BYTES = 144           # 72 * 48000 // 24000
+_FAKE_FRAME_SECONDS = 576 / 24000  # 24 ms of audio per frame
+_FAKE_CHARS_PER_SECOND = 15.0      # roughly conversational speech
+
+FAKE_VOICES = [
+    {'ShortName': 'en-US-AriaNeural', 'FriendlyName': 'Fake Aria (English, United States)',
+     'Gender': 'Female', 'Locale': 'en-US'},
+    {'ShortName': 'en-US-GuyNeural', 'FriendlyName': 'Fake Guy (English, United States)',
+     'Gender': 'Male', 'Locale': 'en-US'},
+    {'ShortName': 'en-GB-SoniaNeural', 'FriendlyName': 'Fake Sonia (English, United Kingdom)',
+     'Gender': 'Female', 'Locale': 'en-GB'},
+    {'ShortName': 'fr-FR-DeniseNeural', 'FriendlyName': 'Fake Denise (French, France)',
+     'Gender': 'Female', 'Locale': 'fr-FR'},
+]
+_FAKE_VOICE_NAMES = frozenset(voice['ShortName'] for voice in FAKE_VOICES)
+
+
+def fake_audio(text, rate="+0%"):
+    """Silent MP3 whose duration follows the text length and speaking rate"""
+    try:
+        speed = 1 + int(rate.replace('%', '')) / 100
+    except ValueError:
+        speed = 1.0
+    seconds = len(text) / (_FAKE_CHARS_PER_SECOND * max(speed, 0.1))
+    frames = max(1, round(seconds / _FAKE_FRAME_SECONDS))
+    # All-zero side info decodes as silence
+    frame = _FAKE_FRAME_HEADER + bytes(_FAKE_FRAME_BYTES - len(_FAKE_FRAME_HEADER))
+    return frame * frames
+
+
+class FakeBackend(SynthesisBackend):
+    """Offline, deterministic backend for load tests and profiling
+
+    Each call sleeps for latency + per_char * len(text) (+/- jitter) and then
+    either returns silent MP3 frames or raises SimulatedThrottle /
+    SimulatedFailure with the configured probabilities. Voices outside
+    FAKE_VOICES raise ValueError, as edge_tts does for invalid ones. Outcomes are derived
+    from the seed, the segment and its attempt number, so a run is
+    reproducible regardless of thread scheduling, and retries of a failed
+    segment can succeed.
+    """
+
+    name = 'fake'
+
+    def __init__(self, latency=0.05, per_char=0.0, jitter=0.0, throttle_rate=0.0,
+                 failure_rate=0.0, seed=0):
+        self.latency = latency
+        self.per_char = per_char
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.failure_rate = failure_rate
+        self.seed = seed
+        self._attempts = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def _rng(self, text, voice, rate, pitch):
+        key = hashlib.sha256(f'{self.seed}\0{voice}\0{rate}\0{pitch}\0{text}'.encode('utf-8')).digest()
+        with self._lock:
+            attempt = self._attempts.get(key, 0)
+            self._attempts[key] = attempt + 1
+            self.calls += 1
+        return random.Random(key + attempt.to_bytes(4, 'big'))
+
+    def synthesize(self, text, voice, rate="+0%", pitch="+0Hz", volume="+0dB", timeout=90):
+        if voice not in _FAKE_VOICE_NAMES:
+            raise ValueError(f"Invalid voice '{voice}'.")
+        rng = self._rng(text, voice, rate, pitch)
+        delay = self.latency + self.per_char * len(text)
+        if self.jitter:
+            delay = max(0.0, delay + rng.uniform(-self.jitter, self.jitter))
+        if delay > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"Synthesis timed out after {timeout}s")
+        time.sleep(delay)
+
+        roll = rng.random()
+        if roll < self.throttle_rate:
+            raise SimulatedThrottle("429 Too Many Requests (simulated)")
+        if roll < self.throttle_rate + self.failure_rate:
+            raise SimulatedFailure("Simulated synthesis failure")
+        return fake_audio(text, rate)
+
+    def list_voices(self):
+        return [dict(voice) for voice in FAKE_VOICES]
+
+
+BACKENDS = {
+    'edge': EdgeTTSBackend,
+    'fake': FakeBackend,
+}
+
+
+def create_backend(name='edge', **options):
+    """Build a backend by name ('edge' or 'fake'); options go to its constructor"""
+    try:
+        backend_class = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown TTS backend {name!r} (expected one of: {', '.join(BACKENDS)})")
+    return backend_class(**options)
@@ -0,0 +1,101 @@
+"""
+Persistent in-process synthesis engine for edge-tts.
+
+A single asyncio event loop runs on a dedicated daemon thread for the whole
+life of the process. Flask request threads hand segment jobs to it and get
+MP3 bytes back, so there is no interpreter start-up, edge_tts import or event
+loop creation per segment.
+"""
+import asyncio
+import threading
+import concurrent.futures
+
+import edge_tts
+
+
+def convert_pitch(pitch):
+    """Convert a percentage pitch ("+7%") to the Hz format edge-tts expects"""
+    # edge-tts pitch format: +50Hz, -50Hz (not percentages)
+    if '%' not in pitch:
+        return pitch
+    try:
+        percent = int(pitch.replace('%', '').replace('+', '').replace('-', ''))
+        sign = '-' if '-' in pitch else '+'
+        hz_value = int(percent * 1.0)  # 1% = 1Hz for more natural sound
+        return f"{sign}{hz_value}Hz"
+    except ValueError:
+        return "+0Hz"
+
+
+async def synthesize_async(text, voice, rate="+0%", pitch="+0Hz"):
+    """Synthesize text with edge-tts and return the MP3 audio as bytes"""
+    communicate = edge_tts.Communicate(text, voice, rate=rate, pitch=convert_pitch(pitch))
+    audio = bytearray()
+    async for chunk in communicate.stream():
+        if chunk["type"] == "audio":
+            audio.extend(chunk["data"])
+    if not audio:
+        raise RuntimeError(f"No audio received for voice {voice}")
+    return bytes(audio)
+
+
+class SynthesisEngine:
+    """Long-lived asyncio loop on a background thread that runs synthesis jobs"""
+
+    def __init__(self):
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the event loop thread if it is not already running"""
+        with self._lock:
+            if self._loop is not None:
+                return self._loop
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def run_loop():
+                asyncio.set_event_loop(loop)
+                loop.call_soon(ready.set)
+                loop.run_forever()
+
+            self._thread = threading.Thread(target=run_loop, name='tts-engine', daemon=True)
+            self._thread.start()
+            ready.wait()
+            self._loop = loop
+            return loop
+
+    @property
+    def running(self):
+        return self._loop is not None and self._thread is not None and self._thread.is_alive()
+
+    def submit(self, coro):
+        """Schedule a coroutine on the engine loop and return a concurrent Future"""
+        loop = self.start()
+        return asyncio.run_coroutine_threadsafe(coro, loop)
+
+    def run(self, coro, timeout=None):
+        """Run a coroutine on the engine loop and block until it finishes"""
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise TimeoutError(f"Synthesis timed out after {timeout}s")
+
+    def synthesize(self, text, voice, rate="+0%", pitch="+0Hz", timeout=90):
+        """Synthesize one segment and return its MP3 bytes"""
+        return self.run(synthesize_async(text, voice, rate, pitch), timeout=timeout)
+
+    def stop(self):
+        """Stop the event loop and wait for the thread to exit"""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = None
+            self._thread = None
+        if loop is None:
+            return
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=5)
+        loop.close()
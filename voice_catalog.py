@@ -0,0 +1,201 @@
+"""
+Cached, pre-serialized voice catalog for /api/voices.
+
+The upstream voice list is grouped by locale once, kept in memory and in an
+on-disk snapshot, and served as ready-made JSON bytes with an ETag. Stale data
+is served while a background thread refreshes it, so a request only waits on
+the upstream fetch when there is no snapshot at all.
+"""
+import collections
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def group_voices(voices):
+    """Organize the raw edge-tts voice list by locale"""
+    voice_data = {}
+    for voice in voices:
+        locale = voice['Locale']
+        if locale not in voice_data:
+            voice_data[locale] = []
+
+        voice_data[locale].append({
+            'name': voice['ShortName'],
+            'display_name': voice['FriendlyName'],
+            'gender': voice['Gender'],
+            'locale': voice['Locale']
+        })
+    return voice_data
+
+
+def filter_voices(voice_data, locale=None, gender=None):
+    """Keep only the given locales (full code or language prefix) and gender"""
+    locales = [l.strip().lower() for l in locale.split(',') if l.strip()] if locale else None
+    gender = gender.lower() if gender else None
+
+    filtered = {}
+    for code, voices in voice_data.items():
+        if locales and not any(code.lower() == l or code.lower().startswith(l + '-') for l in locales):
+            continue
+        if gender:
+            voices = [v for v in voices if v['gender'].lower() == gender]
+        if voices:
+            filtered[code] = voices
+    return filtered
+
+
+def _serialize(data):
+    body = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return body, hashlib.sha1(body).hexdigest()[:20]
+
+
+class VoiceCatalog:
+    """In-memory + on-disk voice catalog with TTL and background refresh"""
+
+    # Seconds to wait after a failed refresh before trying upstream again
+    RETRY_DELAY = 60.0
+    # Serialized filter results kept, least recently used dropped first
+    MAX_VARIANTS = 256
+
+    def __init__(self, snapshot_path, ttl, fetch):
+        self.snapshot_path = snapshot_path
+        self.ttl = ttl
+        self._fetch = fetch  # callable returning the raw edge-tts voice list
+        self._voices = None
+        self._names = frozenset()
+        self._fetched_at = 0.0
+        self._variants = collections.OrderedDict()  # (locales, gender) -> (body, etag)
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self.last_error = None
+        self._retry_at = 0.0
+
+    @property
+    def loaded(self):
+        return self._voices is not None
+
+    @property
+    def age(self):
+        return time.time() - self._fetched_at if self.loaded else None
+
+    def load_snapshot(self):
+        """Load the on-disk snapshot if there is one; return True on success"""
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+            self._install(snapshot['voices'], snapshot['fetched_at'])
+            return True
+        except (OSError, ValueError, KeyError):
+            return False
+
+    def _install(self, voice_data, fetched_at):
+        with self._lock:
+            self._voices = voice_data
+            self._names = frozenset(voice['name'] for voices in voice_data.values() for voice in voices)
+            self._fetched_at = fetched_at
+            self._variants.clear()
+
+    def _write_snapshot(self, voice_data, fetched_at):
+        directory = os.path.dirname(self.snapshot_path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'fetched_at': fetched_at, 'voices': voice_data}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.snapshot_path)
+
+    def refresh(self, only_if_missing=False):
+        """Fetch the voice list upstream, regroup it and update memory and disk"""
+        with self._refresh_lock:
+            if only_if_missing and self.loaded:
+                return  # another request finished the cold-start fetch meanwhile
+            try:
+                voice_data = group_voices(self._fetch())
+                fetched_at = time.time()
+                self._install(voice_data, fetched_at)
+                self._write_snapshot(voice_data, fetched_at)
+                self.last_error = None
+                logger.info("Voice catalog refreshed: %d locales", len(voice_data))
+            except Exception as e:
+                self.last_error = str(e)
+                self._retry_at = time.time() + self.RETRY_DELAY
+                logger.warning("Voice catalog refresh failed: %s: %s", type(e).__name__, e)
+                if not self.loaded:
+                    raise
+
+    def refresh_in_background(self):
+        """Start a refresh on a daemon thread unless one is already running"""
+        if self._refresh_lock.locked() or time.time() < self._retry_at:
+            return
+
+        def run():
+            try:
+                self.refresh()
+            except Exception:
+                pass  # already logged; stale data keeps being served
+
+        threading.Thread(target=run, name='voice-catalog-refresh', daemon=True).start()
+
+    def voice_names(self, locale=None, gender=None):
+        """Return the short names of voices matching the filters"""
+        if not self.loaded:
+            self.refresh(only_if_missing=True)
+        with self._lock:
+            data = filter_voices(self._voices, locale, gender)
+        return [voice['name'] for voices in data.values() for voice in voices]
+
+    def has_voice(self, name):
+        """Return True if name is the short name of a voice in the catalog"""
+        if not self.loaded:
+            self.refresh(only_if_missing=True)
+        return name in self._names
+
+    def get(self, locale=None, gender=None):
+        """Return (json_bytes, etag) for the catalog, optionally filtered"""
+        if not self.loaded:
+            # Cold start without a snapshot: the only time a request waits upstream
+            self.refresh(only_if_missing=True)
+        elif self.age > self.ttl:
+            self.refresh_in_background()
+
+        with self._lock:
+            variant = self._variant(locale, gender)
+            if variant is None:
+                return _serialize({})  # matches no voice; not worth a cache entry
+            cached = self._variants.get(variant)
+            if cached is None:
+                locales, gender = variant
+                data = filter_voices(self._voices, ','.join(locales), gender)
+                cached = _serialize(data)
+                self._variants[variant] = cached
+                if len(self._variants) > self.MAX_VARIANTS:
+                    self._variants.popitem(last=False)
+            else:
+                self._variants.move_to_end(variant)
+            return cached
+
+    def _variant(self, locale, gender):
+        """Normalized (locales, gender) cache key, or None if the filters match no voice
+
+        Locale terms are deduplicated and sorted and terms that match no known
+        locale are dropped, so arbitrary query strings map onto few keys.
+        Caller holds the lock.
+        """
+        codes = [code.lower() for code in self._voices]
+        locales = ()
+        if locale:
+            terms = {term.strip().lower() for term in locale.split(',') if term.strip()}
+            locales = tuple(sorted(term for term in terms
+                                   if any(code == term or code.startswith(term + '-') for code in codes)))
+            if terms and not locales:
+                return None
+        gender = (gender or '').strip().lower()
+        if gender and gender not in {v['gender'].lower() for voices in self._voices.values() for v in voices}:
+            return None
+        return locales, gender